@@ -17,6 +17,12 @@ import time
 import ctypes
 import pyperclip
 import backend
+import highlighter
+import edit_events
+import lexers
+import semantic
+import chat_store
+import multiprocessing
 import random
 import tempfile
 import webbrowser
@@ -24,13 +30,15 @@ import re
 
 # === 单实例检查开始 ===
 import socket
-try:
-    lock_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    lock_socket.bind(('localhost', 47294))
-    print("程序启动成功 - 单实例")
-except socket.error:
-    print("程序已在运行中，即将退出")
-    sys.exit(1)
+# 语义分析的工作进程会重新导入本模块，只在主进程中检查
+if multiprocessing.parent_process() is None:
+    try:
+        lock_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        lock_socket.bind(('localhost', 47294))
+        print("程序启动成功 - 单实例")
+    except socket.error:
+        print("程序已在运行中，即将退出")
+        sys.exit(1)
 # === 单实例检查结束 ===
 
 if sys.platform == 'win32':
@@ -248,7 +256,8 @@ class CodeEditorApp:
                 'facebook': 'Facebook',
                 'instagram': 'Instagram',
                 'youtube': 'YouTube',
-                'send': '发送'
+                'send': '发送',
+                'stop': '停止'
             },
             'zh-TW': {
                 'app_title': '聚源倉-Version 1.0.9',
@@ -446,7 +455,8 @@ class CodeEditorApp:
                 'facebook': 'Facebook',
                 'instagram': 'Instagram',
                 'youtube': 'YouTube',
-                'send': '發送'
+                'send': '發送',
+                'stop': '停止'
             },
             'en-US': {
                 'app_title': 'Juyuan Warehouse-Version 1.0.9',
@@ -644,7 +654,8 @@ class CodeEditorApp:
                 'facebook': 'Facebook',
                 'instagram': 'Instagram',
                 'youtube': 'YouTube',
-                'send': 'Send'
+                'send': 'Send',
+                'stop': 'Stop'
             }
         }
         
@@ -666,6 +677,16 @@ class CodeEditorApp:
         self.code_text = None
         self.file_type_label = None
         self.backend_processor = None
+        self.highlighters = {}  # 每个编辑框对应的增量高亮器
+        self.semantic_highlighters = {}  # 每个编辑框对应的语义高亮器
+        self.ai_engine = None  # 执行AI请求的后台事件循环
+        self.auto_generate_stopped = False  # 自动生成是否已被"停止"按钮中断
+        self.edit_buses = {}  # 每个编辑框对应的编辑事件总线
+        self.code_change_pending = False
+        self.file_type_cache = {}  # 编辑框 -> (文件路径, 开头部分的修改版本, 文件类型)
+        self.head_versions = {}  # 编辑框 -> 开头部分的修改版本
+        self.head_watched_buses = {}  # 编辑框 -> 已订阅的编辑事件总线
+        self.file_type_detect_chars = 4096  # 按内容检测文件类型时只看开头的字符数
         self.toolbar = None
         self.main_container = None
         self.ai_panel = None
@@ -679,7 +700,25 @@ class CodeEditorApp:
         self.terminal_panel = None
         
         # 流式响应相关
-        self.streaming_response = ""
+        self.streaming_response = ""  # 最近一条结束的流式回复的完整内容
+        self.streaming_count = 0  # 已开始的流式回复数，用于生成插入位置的标记名
+        self.streaming_parts = {}  # 插入位置 -> 回复的全部内容段，结束时一次拼接
+        self.streaming_pending = {}  # 插入位置 -> 还没显示的内容段
+        self.streaming_flush_id = None
+        
+        # 非流式AI消息的逐步显示：总耗时上限（秒），为0时立即完整显示
+        self.typewriter_duration = 1.0
+        self.rendering = None  # 正在逐步显示的消息
+        self.render_after_id = None
+        
+        # 聊天显示只保留最近的消息，全部消息保存在消息存储中，向上滚动到顶部时分页显示
+        self.chat_store = chat_store.ChatStore()
+        self.chat_max_messages = 200  # 聊天显示最多保留的消息数
+        self.chat_max_chars = 256 * 1024  # 聊天显示最多保留的字符数
+        self.chat_page_size = 50  # 滚动到顶部时一次重新显示的消息数
+        self.chat_first = 0  # 聊天显示中第一条消息的编号
+        self.chat_window_id = None
+        self.streaming_messages = {}  # 插入位置 -> 流式回复的消息编号
         
         # VS Code主题颜色配置 - 浅色主题
         self.vscode_theme = {
@@ -704,7 +743,13 @@ class CodeEditorApp:
             'function': '#795E26',
             'number': '#098658',
             'operator': '#000000',
-            'class_name': '#2B91AF'
+            'class_name': '#2B91AF',
+            # 语义高亮颜色
+            'parameter': '#001080',
+            'attribute': '#0070C1',
+            'builtin': '#267F99',
+            'decorator': '#AF00DB',
+            'call': '#795E26'
         }
         
         # 工具栏项目（移除文件资源管理器和终端相关功能）
@@ -722,6 +767,7 @@ class CodeEditorApp:
         
         # 初始化后端和API
         self.setup_api_key()
+        self.warm_up_ai()
         self.setup_backend()
         
         # 启动简化界面
@@ -781,6 +827,7 @@ class CodeEditorApp:
                           bg=self.vscode_theme['toolbar'],
                           fg=self.vscode_theme['foreground'])
         view_menu.add_command(label="切换AI面板", command=self.toggle_ai_panel)
+        view_menu.add_command(label="API密钥池状态", command=self.show_api_pool_status)
         self.menu_bar.add_cascade(label=self.lang_pack[self.current_language]['view'], menu=view_menu)
         
         # 语言菜单
@@ -838,6 +885,15 @@ class CodeEditorApp:
             print(f"设置API密钥失败: {e}")
             return False
 
+    def warm_up_ai(self):
+        """已有可用的API客户端时预先建立连接，第一次对话不用等待握手"""
+        try:
+            import ai_compiler
+            if ai_compiler._global_compiler.client is not None:
+                self.get_ai_engine().warm_up()
+        except Exception as e:
+            print(f"AI连接预热失败: {e}")
+
     def get_api_key(self):
         """获取API密钥"""
         try:
@@ -851,6 +907,7 @@ class CodeEditorApp:
         try:
             self.backend_processor = backend.backEndprocessing()
             self.backend_processor.setTagKeyWord("keyword")
+            lexers.register_lexer("python", self.backend_processor)
             print("Backend语法高亮引擎初始化成功")
         except Exception as e:
             print(f"Backend初始化失败: {e}")
@@ -1086,9 +1143,11 @@ class CodeEditorApp:
         self.code_text.tag_configure("number", foreground=self.vscode_theme['number'])
         self.code_text.tag_configure("operator", foreground=self.vscode_theme['operator'])
         self.code_text.tag_configure("class_name", foreground=self.vscode_theme['class_name'], font=('Consolas', 12, "bold"))
+        for tag in semantic.SEMANTIC_TAGS:
+            self.code_text.tag_configure(tag, foreground=self.vscode_theme[tag])
         
-        # 绑定事件
-        self.code_text.bind("<KeyRelease>", self.on_code_change)
+        # 绑定事件：只有文本真正被修改时才更新高亮
+        self.get_edit_bus().subscribe(self.on_text_edited)
         
         # 添加右键菜单
         self.setup_right_click_menu()
@@ -1194,8 +1253,7 @@ class CodeEditorApp:
             selected_text = self.code_text.get(tk.SEL_FIRST, tk.SEL_LAST)
             if selected_text:
                 self.add_chat_message("你", "请分析以下代码：\n" + selected_text)
-                threading.Thread(target=self.analyze_code_thread, 
-                               args=(selected_text,), daemon=True).start()
+                self.run_ai_action("analyze", selected_text, error_prefix="分析失败")
             else:
                 self.show_info_message("请先选择要分析的代码")
         except Exception as e:
@@ -1447,7 +1505,7 @@ class CodeEditorApp:
             relief=tk.SOLID
         )
         self.chat_display.pack(fill=tk.BOTH, expand=True)
-        self.chat_display.config(state=tk.DISABLED)
+        self.chat_display.config(state=tk.DISABLED, yscrollcommand=self.on_chat_scroll)
         
         # 输入区域 - 放在底部
         input_frame = ttk.Frame(chat_frame)
@@ -1460,6 +1518,10 @@ class CodeEditorApp:
         send_btn = ttk.Button(input_frame, text=self.lang_pack[self.current_language].get('send', '发送'), command=self.send_quick_chat)
         send_btn.pack(side=tk.RIGHT)
         
+        # 停止按钮：取消所有排队中和进行中的AI请求
+        stop_btn = ttk.Button(input_frame, text=self.lang_pack[self.current_language].get('stop', '停止'), command=self.stop_ai_requests)
+        stop_btn.pack(side=tk.RIGHT, padx=(0, 5))
+        
         # 显示欢迎消息
         if self.current_language == 'zh-CN':
             welcome_msg = """欢迎使用小源！
@@ -1527,7 +1589,7 @@ Please describe your problem or the code section you need help with."""
         """打开API设置对话框"""
         dialog = tk.Toplevel(self.root)
         dialog.title("设置DeepSeek API密钥")
-        dialog.geometry("500x300")
+        dialog.geometry("500x520")
         dialog.transient(self.root)
         
         main_frame = ttk.Frame(dialog, padding=20)
@@ -1546,10 +1608,27 @@ Please describe your problem or the code section you need help with."""
         backup_api_entry = ttk.Entry(main_frame, width=50, show="*")
         backup_api_entry.pack(fill=tk.X, pady=5)
         
+        # 团队共用的其他密钥
+        ttk.Label(main_frame, text="其他API密钥 (可选，每行一个):").pack(anchor='w', pady=(10, 5))
+        extra_api_text = tk.Text(main_frame, height=3, width=50)
+        extra_api_text.pack(fill=tk.X, pady=5)
+        
+        # 每个密钥的速率限制
+        limit_frame = ttk.Frame(main_frame)
+        limit_frame.pack(fill=tk.X, pady=5)
+        ttk.Label(limit_frame, text="每个密钥每分钟请求数:").pack(side=tk.LEFT)
+        rpm_entry = ttk.Entry(limit_frame, width=8)
+        rpm_entry.pack(side=tk.LEFT, padx=5)
+        ttk.Label(limit_frame, text="每分钟tokens:").pack(side=tk.LEFT)
+        tpm_entry = ttk.Entry(limit_frame, width=10)
+        tpm_entry.pack(side=tk.LEFT, padx=5)
+        
         # 说明文字
         help_text = """说明：
 • 主API密钥：必须填写，用于主要的AI功能
 • 备用API密钥：可选，当主API出现问题时自动切换
+• 其他API密钥：可选，请求在所有密钥之间按负载分配
+• 速率限制：留空表示不限制，达到限制的密钥暂时不再分配请求
 • 获取API密钥：访问 https://platform.deepseek.com/
 • 密钥安全：密钥仅保存在本地，不会上传到服务器"""
         
@@ -1560,14 +1639,22 @@ Please describe your problem or the code section you need help with."""
         def save_api_keys():
             primary_key = primary_api_entry.get().strip()
             backup_key = backup_api_entry.get().strip()
+            extra_keys = [key.strip() for key in extra_api_text.get("1.0", tk.END).split() if key.strip()]
             
             if not primary_key:
                 messagebox.showwarning("警告", "请输入主API密钥")
                 return
             
+            try:
+                rpm = int(rpm_entry.get().strip() or 0) or None
+                tpm = int(tpm_entry.get().strip() or 0) or None
+            except ValueError:
+                messagebox.showwarning("警告", "速率限制必须是整数")
+                return
+            
             try:
                 import ai_compiler
-                success = ai_compiler.set_api_keys(primary_key, backup_key)
+                success = ai_compiler.set_api_key_pool([primary_key, backup_key] + extra_keys, rpm, tpm)
                 if success:
                     messagebox.showinfo("成功", "API密钥设置成功")
                     dialog.destroy()
@@ -1575,6 +1662,8 @@ Please describe your problem or the code section you need help with."""
                     os.environ['DEEPSEEK_API_KEY'] = primary_key
                     if backup_key:
                         os.environ['DEEPSEEK_BACKUP_API_KEY'] = backup_key
+                    os.environ['DEEPSEEK_API_KEYS'] = ",".join(extra_keys)
+                    self.warm_up_ai()
                 else:
                     messagebox.showerror("错误", "API密钥设置失败，请检查密钥是否正确")
             except Exception as e:
@@ -1591,6 +1680,68 @@ Please describe your problem or the code section you need help with."""
         if current_api and current_api != "你的Deepseek API":
             primary_api_entry.insert(0, current_api)
 
+    def show_api_pool_status(self):
+        """显示API密钥池中每个密钥的状态、负载、剩余额度和延迟，以及 token 用量和上下文缓存命中情况"""
+        import ai_compiler
+        
+        dialog = tk.Toplevel(self.root)
+        dialog.title("API密钥池状态")
+        dialog.geometry("900x360")
+        dialog.transient(self.root)
+        
+        main_frame = ttk.Frame(dialog, padding=10)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        columns = [
+            ("name", "名称", 70), ("key", "密钥", 90), ("state", "状态", 70),
+            ("in_flight", "进行中", 60), ("rpm_left", "剩余请求/分", 90), ("tpm_left", "剩余tokens/分", 100),
+            ("requests", "请求数", 60), ("error_rate", "错误率", 60),
+            ("latency_p50_ms", "延迟P50", 80), ("ttft_p50_ms", "首字P50", 80),
+        ]
+        tree = ttk.Treeview(main_frame, columns=[name for name, _, _ in columns], show="headings")
+        for name, title, width in columns:
+            tree.heading(name, text=title)
+            tree.column(name, width=width, anchor="center")
+        tree.pack(fill=tk.BOTH, expand=True)
+        
+        # token 用量和服务端上下文缓存命中情况
+        usage_label = tk.Label(main_frame, font=('等线', 10), justify=tk.LEFT, anchor='w')
+        usage_label.pack(fill=tk.X, pady=(10, 0))
+        
+        states = {"closed": "正常", "open": "熔断", "half_open": "试探"}
+        
+        def cell(stats, name):
+            value = stats.get(name)
+            if value is None:
+                return "-"
+            if name == "state":
+                return states.get(value, value)
+            if name == "error_rate":
+                return f"{value:.0%}"
+            if name.endswith("_ms"):
+                return f"{value:.0f} ms"
+            return value
+        
+        def refresh():
+            if not dialog.winfo_exists():
+                return
+            tree.delete(*tree.get_children())
+            for stats in ai_compiler.get_endpoint_stats():
+                tree.insert("", tk.END, values=[cell(stats, name) for name, _, _ in columns])
+            usage = ai_compiler.get_usage_stats()
+            text = (f"最近 {usage['requests']} 个请求：输入 {usage['prompt_tokens']} tokens，"
+                    f"其中上下文缓存命中 {usage['cache_hit_tokens']}（{usage['cache_hit_rate']:.0%}），"
+                    f"输出 {usage['completion_tokens']} tokens")
+            last = usage["last"]
+            if last is not None:
+                text += (f"\n上一个请求（{last['action']}）：输入 {last['prompt_tokens']}，"
+                         f"缓存命中 {last['cache_hit_tokens'] if last['cache_hit_tokens'] is not None else '-'}，"
+                         f"输出 {last['completion_tokens']}")
+            usage_label.config(text=text)
+            dialog.after(1000, refresh)
+        
+        refresh()
+
     def toggle_ai_panel(self):
         """切换AI面板显示/隐藏"""
         if not hasattr(self, 'ai_panel') or not self.ai_panel:
@@ -1675,8 +1826,15 @@ Please describe your problem or the code section you need help with."""
                 # code_text已经被销毁，忽略错误
                 pass
 
+    def on_text_edited(self, start, end, text, version):
+        """编辑事件回调，同一轮事件循环中的多次修改合并为一次处理"""
+        if not self.code_change_pending:
+            self.code_change_pending = True
+            self.root.after_idle(self.on_code_change)
+
     def on_code_change(self, event=None):
         """当代码内容改变时触发的函数"""
+        self.code_change_pending = False
         try:
             if (self.syntax_highlight_enabled and self.backend_processor and 
                 hasattr(self, 'code_text') and self.code_text is not None):
@@ -1684,123 +1842,122 @@ Please describe your problem or the code section you need help with."""
         except Exception as e:
             print(f"代码变更处理失败: {e}")
 
-    def apply_syntax_highlighting(self):
-        """应用语法高亮"""
+    def apply_syntax_highlighting(self, file_type=None):
+        """应用语法高亮，file_type 为 None 时自动检测文件类型"""
         if not hasattr(self, 'code_text') or self.code_text is None:
             return
             
         try:
             # 获取当前文本
             text_content = self.code_text.get("1.0", "end-1c")
+            if file_type is None:
+                file_type = self.detect_file_type(text_content)
+            
+            # 按文件类型选择词法分析器，只增量更新变化的行
+            lexer = lexers.get_lexer(file_type)
+            if lexer is not None:
+                highlighter_obj = self.get_highlighter(lexer)
+                highlighter_obj.refresh(text_content)
+            else:
+                highlighter_obj = self.highlighters.get(str(self.code_text))
+                if highlighter_obj is not None and highlighter_obj.text is self.code_text:
+                    highlighter_obj.reset()
             
-            # 移除所有现有标签
-            self.code_text.tag_remove("keyword", "1.0", "end")
-            self.code_text.tag_remove("string", "1.0", "end")
-            self.code_text.tag_remove("comment", "1.0", "end")
-            self.code_text.tag_remove("function", "1.0", "end")
-            self.code_text.tag_remove("number", "1.0", "end")
-            self.code_text.tag_remove("operator", "1.0", "end")
-            self.code_text.tag_remove("class_name", "1.0", "end")
-            
-            # 自动检测文件类型并应用语法高亮
-            if self.detect_file_type(text_content) == "python":
-                # 使用backend_processor处理关键字
-                if self.backend_processor:
-                    self.backend_processor.insertColorTag(text_content, self.code_text)
-                
-                # 增强的语法高亮：字符串
-                self._highlight_strings(text_content)
-                
-                # 增强的语法高亮：注释
-                self._highlight_comments(text_content)
-                
-                # 增强的语法高亮：函数定义
-                self._highlight_functions(text_content)
-                
-                # 增强的语法高亮：数字
-                self._highlight_numbers(text_content)
-                
-                # 增强的语法高亮：类定义
-                self._highlight_classes(text_content)
+            # Python 代码在停止输入后进行语义高亮（在工作进程中解析），大文件只加在可见区域
+            if file_type == "python":
+                self.get_semantic_highlighter().update(text_content, highlighter_obj)
+            else:
+                semantic_obj = self.semantic_highlighters.get(str(self.code_text))
+                if semantic_obj is not None and semantic_obj.text is self.code_text:
+                    semantic_obj.clear()
             
         except Exception as e:
             print(f"语法高亮错误: {e}")
     
-    def _highlight_strings(self, text):
-        """高亮字符串"""
-        # 匹配单引号和双引号字符串
-        string_pattern = r'"[^"]*"|\'[^\']*\''
-        matches = re.finditer(string_pattern, text, re.DOTALL)
-        for match in matches:
-            start_line = text[:match.start()].count('\n') + 1
-            start_col = match.start() - text[:match.start()].rfind('\n') - 1
-            end_line = text[:match.end()].count('\n') + 1
-            end_col = match.end() - text[:match.end()].rfind('\n') - 1
-            
-            self.code_text.tag_add("string", f"{start_line}.{start_col}", f"{end_line}.{end_col}")
-    
-    def _highlight_comments(self, text):
-        """高亮注释"""
-        # 匹配单行注释
-        comment_pattern = r'#.*$'
-        matches = re.finditer(comment_pattern, text, re.MULTILINE)
-        for match in matches:
-            start_line = text[:match.start()].count('\n') + 1
-            start_col = match.start() - text[:match.start()].rfind('\n') - 1
-            end_line = text[:match.end()].count('\n') + 1
-            end_col = match.end() - text[:match.end()].rfind('\n') - 1
-            
-            self.code_text.tag_add("comment", f"{start_line}.{start_col}", f"{end_line}.{end_col}")
-    
-    def _highlight_functions(self, text):
-        """高亮函数定义"""
-        # 匹配def函数定义
-        function_pattern = r'def\s+(\w+)\s*\('
-        matches = re.finditer(function_pattern, text)
-        for match in matches:
-            # 提取函数名部分
-            func_name_start = match.start(1)
-            func_name_end = match.end(1)
-            
-            start_line = text[:func_name_start].count('\n') + 1
-            start_col = func_name_start - text[:func_name_start].rfind('\n') - 1
-            end_line = text[:func_name_end].count('\n') + 1
-            end_col = func_name_end - text[:func_name_end].rfind('\n') - 1
-            
-            self.code_text.tag_add("function", f"{start_line}.{start_col}", f"{end_line}.{end_col}")
-    
-    def _highlight_numbers(self, text):
-        """高亮数字"""
-        # 匹配整数和浮点数
-        number_pattern = r'\b\d+(\.\d+)?\b'
-        matches = re.finditer(number_pattern, text)
-        for match in matches:
-            start_line = text[:match.start()].count('\n') + 1
-            start_col = match.start() - text[:match.start()].rfind('\n') - 1
-            end_line = text[:match.end()].count('\n') + 1
-            end_col = match.end() - text[:match.end()].rfind('\n') - 1
-            
-            self.code_text.tag_add("number", f"{start_line}.{start_col}", f"{end_line}.{end_col}")
-    
-    def _highlight_classes(self, text):
-        """高亮类定义"""
-        # 匹配class定义
-        class_pattern = r'class\s+(\w+)\s*'
-        matches = re.finditer(class_pattern, text)
-        for match in matches:
-            # 提取类名部分
-            class_name_start = match.start(1)
-            class_name_end = match.end(1)
-            
-            start_line = text[:class_name_start].count('\n') + 1
-            start_col = class_name_start - text[:class_name_start].rfind('\n') - 1
-            end_line = text[:class_name_end].count('\n') + 1
-            end_col = class_name_end - text[:class_name_end].rfind('\n') - 1
-            
-            self.code_text.tag_add("class_name", f"{start_line}.{start_col}", f"{end_line}.{end_col}")
-
-    def detect_file_type(self, content):
-        """自动检测文件类型"""
+    def get_highlighter(self, lexer=None):
+        """获取当前编辑框对应的增量高亮器（词法分析在后台线程中进行）
+
+        词法分析器与现有高亮器不同时（文件类型改变），清除旧的标签后重新创建。
+        """
+        if lexer is None:
+            lexer = self.backend_processor
+        key = str(self.code_text)
+        highlighter_obj = self.highlighters.get(key)
+        if (highlighter_obj is not None and highlighter_obj.text is self.code_text
+                and highlighter_obj.processor is lexer):
+            return highlighter_obj
+        if highlighter_obj is not None:
+            if highlighter_obj.text is self.code_text:
+                highlighter_obj.reset()
+            highlighter_obj.close()
+        highlighter_obj = highlighter.BackgroundHighlighter(
+            self.code_text, lexer, edit_bus=self.get_edit_bus())
+        self.highlighters[key] = highlighter_obj
+        return highlighter_obj
+
+    def get_semantic_highlighter(self):
+        """获取当前编辑框对应的语义高亮器"""
+        key = str(self.code_text)
+        semantic_obj = self.semantic_highlighters.get(key)
+        if semantic_obj is None or semantic_obj.text is not self.code_text:
+            if semantic_obj is not None:
+                semantic_obj.close()
+            semantic_obj = semantic.SemanticHighlighter(self.code_text, edit_bus=self.get_edit_bus())
+            self.semantic_highlighters[key] = semantic_obj
+        return semantic_obj
+
+    def get_edit_bus(self, text_widget=None):
+        """获取编辑框（默认为当前编辑框）对应的编辑事件总线"""
+        if text_widget is None:
+            text_widget = self.code_text
+        key = str(text_widget)
+        bus = self.edit_buses.get(key)
+        if bus is None or bus.text is not text_widget:
+            bus = edit_events.EditEventBus(text_widget)
+            self.edit_buses[key] = bus
+        return bus
+
+    def detect_file_type(self, content=None):
+        """自动检测文件类型
+
+        结果按编辑框缓存，只有文件路径改变或文件开头部分被修改时才重新检测；
+        content 为 None 时只读取开头部分。
+        """
+        if not hasattr(self, 'code_text') or self.code_text is None:
+            return self.detect_content_type(content or "")
+        key = str(self.code_text)
+        self.watch_buffer_head(key)
+        head_version = self.head_versions[key]
+        cached = self.file_type_cache.get(key)
+        if cached is not None and cached[0] == self.current_file and cached[1] == head_version:
+            return cached[2]
+        
+        if content is None:
+            content = self.code_text.get("1.0", f"1.0+{self.file_type_detect_chars}c")
+        file_type = self.detect_content_type(content[:self.file_type_detect_chars])
+        self.file_type_cache[key] = (self.current_file, head_version, file_type)
+        return file_type
+
+    def watch_buffer_head(self, key):
+        """订阅编辑事件，记录编辑框开头部分的修改"""
+        bus = self.get_edit_bus()
+        if self.head_watched_buses.get(key) is bus:
+            return
+        self.head_watched_buses[key] = bus
+        self.head_versions[key] = self.head_versions.get(key, 0) + 1
+        bus.subscribe(lambda start, end, text, version: self.on_buffer_head_edited(key, bus, start))
+
+    def on_buffer_head_edited(self, key, bus, start):
+        """修改位置在检测范围之内时，使缓存的文件类型失效"""
+        try:
+            touched = bus.text.compare(start, "<", f"1.0+{self.file_type_detect_chars}c")
+        except tk.TclError:
+            touched = True
+        if touched:
+            self.head_versions[key] += 1
+
+    def detect_content_type(self, content):
+        """根据文件路径和内容检测文件类型"""
         if self.current_file:
             if self.current_file.endswith('.py'):
                 return "python"
@@ -1808,6 +1965,10 @@ Please describe your problem or the code section you need help with."""
                 return "html"
             elif self.current_file.endswith('.md') or self.current_file.endswith('.markdown'):
                 return "markdown"
+            elif self.current_file.endswith('.css'):
+                return "css"
+            elif self.current_file.endswith('.js') or self.current_file.endswith('.mjs'):
+                return "javascript"
         
         # 通过内容分析文件类型
         if re.search(r'<!DOCTYPE html|<\s*html|<\s*head|<\s*body', content, re.IGNORECASE):
@@ -1825,7 +1986,7 @@ Please describe your problem or the code section you need help with."""
             messagebox.showwarning("警告", "请先打开或保存一个文件")
             return
         
-        file_type = self.detect_file_type(self.get_current_editor_content())
+        file_type = self.detect_file_type()
         
         if file_type == "python":
             self.run_python_file()
@@ -2101,8 +2262,7 @@ Please describe your problem or the code section you need help with."""
             return
         
         self.add_chat_message("你", "请分析当前代码")
-        threading.Thread(target=self.analyze_code_thread, 
-                        args=(current_code,), daemon=True).start()
+        self.run_ai_action("analyze", current_code, error_prefix="分析失败")
 
     def suggest_improvements(self):
         """获取改进建议"""
@@ -2112,8 +2272,7 @@ Please describe your problem or the code section you need help with."""
             return
         
         self.add_chat_message("你", "请提供代码改进建议")
-        threading.Thread(target=self.suggest_improvements_thread, 
-                        args=(current_code,), daemon=True).start()
+        self.run_ai_action("suggest_improvements", current_code, error_prefix="获取建议失败")
 
     def explain_current_code(self):
         """解释当前代码"""
@@ -2123,14 +2282,12 @@ Please describe your problem or the code section you need help with."""
             return
         
         self.add_chat_message("你", "请解释当前代码")
-        threading.Thread(target=self.explain_code_thread, 
-                        args=(current_code,), daemon=True).start()
+        self.run_ai_action("explain", current_code, error_prefix="解释失败")
 
     def generate_html_template(self):
         """生成HTML模板"""
         self.add_chat_message("你", "请生成HTML模板")
-        threading.Thread(target=self.generate_html_thread, 
-                        daemon=True).start()
+        self.run_ai_action("generate_html", "生成一个完整的HTML5模板，包含基本的页面结构和样式", error_prefix="生成HTML失败")
 
     def debug_current_code(self):
         """调试当前代码"""
@@ -2140,12 +2297,7 @@ Please describe your problem or the code section you need help with."""
             return
         
         self.add_chat_message("你", "请调试当前代码")
-        try:
-            import ai_compiler
-            response = ai_compiler.debug(current_code)
-            self.add_chat_message("小源", response)
-        except Exception as e:
-            self.add_chat_message("小源", f"调试失败：{str(e)}")
+        self.run_ai_action("debug", current_code, error_prefix="调试失败")
 
     def review_current_code(self):
         """代码审查"""
@@ -2155,12 +2307,43 @@ Please describe your problem or the code section you need help with."""
             return
         
         self.add_chat_message("你", "请对当前代码进行审查")
+        self.run_ai_action("review", current_code, error_prefix="代码审查失败")
+
+    def get_ai_engine(self):
+        """获取AI引擎：所有AI请求在同一个后台事件循环中执行，回调在主线程中执行"""
+        if self.ai_engine is None:
+            import ai_engine
+            self.ai_engine = ai_engine.AIEngine(ai_engine.TkBridge(self.root))
+        return self.ai_engine
+
+    def run_ai_action(self, action, *args, error_prefix="请求失败"):
+        """把AI操作交给AI引擎，回复流式显示在聊天面板中"""
+        mark = self.start_streaming_response()
+        
+        def on_error(e):
+            self.streaming_response_chunk(f"{error_prefix}：{str(e)}", mark)
+            self.end_streaming_response(mark)
+        
+        def on_cancel():
+            self.streaming_response_chunk("（已停止）", mark)
+            self.end_streaming_response(mark)
+        
         try:
-            import ai_compiler
-            response = ai_compiler.review(current_code)
-            self.add_chat_message("小源", response)
+            return self.get_ai_engine().submit(
+                action, *args,
+                on_chunk=lambda chunk: self.streaming_response_chunk(chunk, mark),
+                on_done=lambda response: self.end_streaming_response(mark, response),
+                on_error=on_error,
+                on_cancel=on_cancel)
         except Exception as e:
-            self.add_chat_message("小源", f"代码审查失败：{str(e)}")
+            on_error(e)
+            return None
+
+    def stop_ai_requests(self):
+        """停止所有排队中和进行中的AI请求（正在接收的回复会中断连接）"""
+        self.auto_generate_stopped = True
+        if self.ai_engine is not None:
+            self.ai_engine.cancel_all()
     
     def auto_generate_compile(self):
         """自动生成并编译代码，直到正常工作"""
@@ -2170,10 +2353,10 @@ Please describe your problem or the code section you need help with."""
             return
         
         self.add_chat_message("小源", f"开始自动生成代码，需求：{user_requirement}")
+        self.auto_generate_stopped = False
         
-        # 在新线程中执行自动生成和编译过程
-        threading.Thread(target=self.auto_generate_compile_thread,
-                        args=(user_requirement,), daemon=True).start()
+        # 生成请求交给AI引擎，运行代码在后台线程中进行，界面更新都在主线程中执行
+        self.auto_generate_step(user_requirement, 1)
     
     def get_user_requirement(self):
         """获取用户的代码生成需求"""
@@ -2221,62 +2404,82 @@ Please describe your problem or the code section you need help with."""
         
         return result["requirement"]
     
-    def auto_generate_compile_thread(self, requirement):
-        """自动生成和编译代码的线程函数"""
-        max_attempts = 10  # 最大尝试次数
-        attempt = 0
-        success = False
+    def auto_generate_step(self, requirement, attempt, max_attempts=10):
+        """主线程：第 attempt 次请求AI生成代码"""
+        if self.auto_generate_stopped:
+            self.add_chat_message("小源", "自动生成已停止。")
+            return
+        if attempt > max_attempts:
+            self.add_chat_message("小源", f"已尝试 {max_attempts} 次，仍无法生成可正常运行的代码，请尝试调整需求。")
+            return
+        self.add_chat_message("小源", f"第 {attempt} 次尝试生成代码...")
         
-        while attempt < max_attempts and not success:
-            attempt += 1
-            self.add_chat_message("小源", f"第 {attempt} 次尝试生成代码...")
-            
+        def on_error(e):
+            if not self.auto_generate_stopped:
+                self.add_chat_message("小源", f"代码生成失败：{str(e)}")
+            self.auto_generate_step(requirement, attempt + 1, max_attempts)
+        
+        try:
+            self.get_ai_engine().submit(
+                "generate", requirement,
+                on_done=lambda response: self.auto_generate_run(requirement, attempt, max_attempts, response),
+                on_error=on_error,
+                on_cancel=lambda: self.add_chat_message("小源", "自动生成已停止。"))
+        except Exception as e:
+            self.add_chat_message("小源", f"自动生成编译过程出错：{str(e)}")
+    
+    def auto_generate_run(self, requirement, attempt, max_attempts, response):
+        """主线程：收到生成的代码，在后台线程中运行，运行结果通过AI引擎的桥交回主线程"""
+        if self.auto_generate_stopped:
+            self.add_chat_message("小源", "自动生成已停止。")
+            return
+        generated_code = self.extract_generated_code(response)
+        if not generated_code:
+            self.add_chat_message("小源", "代码生成失败，继续尝试...")
+            self.auto_generate_step(requirement, attempt + 1, max_attempts)
+            return
+        
+        bridge = self.get_ai_engine().bridge
+        # 运行结束前主线程持续取出回调
+        bridge.begin()
+        
+        def run():
             try:
-                # 生成代码
-                generated_code = self.generate_code_with_ai(requirement)
-                if not generated_code:
-                    self.add_chat_message("小源", "代码生成失败，继续尝试...")
-                    continue
-                
-                # 保存临时文件
-                temp_file_path = self.save_temp_code(generated_code)
-                
-                # 编译和运行代码
-                success, output = self.compile_and_run(temp_file_path)
-                
-                if success:
-                    self.add_chat_message("小源", f"代码生成和运行成功！\n\n{generated_code}")
-                    self.add_chat_message("小源", f"运行结果：\n{output}")
-                    
-                    # 将生成的代码插入到编辑器
-                    self.root.after(0, lambda: self.insert_generated_code(generated_code))
-                    break
-                else:
-                    self.add_chat_message("小源", f"代码运行失败，错误信息：\n{output}")
-                    
-                    # 修复代码
-                    requirement = f"之前的代码运行出错，请修复：\n\n代码：{generated_code}\n\n错误：{output}\n\n请重新生成可以正常运行的代码"
-                    
+                # 保存临时文件，编译和运行代码
+                success, output = self.compile_and_run(self.save_temp_code(generated_code))
+                bridge.post(self.auto_generate_checked, requirement, attempt, max_attempts,
+                            generated_code, success, output)
             except Exception as e:
-                self.add_chat_message("小源", f"自动生成编译过程出错：{str(e)}")
+                bridge.post(self.add_chat_message, "小源", f"自动生成编译过程出错：{str(e)}")
+                bridge.post(self.auto_generate_step, requirement, attempt + 1, max_attempts)
+            bridge.post(bridge.end)
         
-        if not success:
-            self.add_chat_message("小源", f"已尝试 {max_attempts} 次，仍无法生成可正常运行的代码，请尝试调整需求。")
+        threading.Thread(target=run, daemon=True).start()
     
-    def generate_code_with_ai(self, requirement):
-        """使用AI生成代码"""
-        try:
-            import ai_compiler
-            response = ai_compiler.generate(requirement)  # 使用正确的函数名
-            
-            # 提取代码块
-            code_blocks = ai_compiler.extract_code(response)
-            if code_blocks:
-                return code_blocks[0]["code"]  # 返回第一个代码块
-            return response
-        except Exception as e:
-            self.add_chat_message("小源", f"代码生成失败：{str(e)}")
-            return None
+    def auto_generate_checked(self, requirement, attempt, max_attempts, generated_code, success, output):
+        """主线程：处理生成的代码的运行结果，失败时带上错误信息重新生成"""
+        if success:
+            self.add_chat_message("小源", f"代码生成和运行成功！\n\n{generated_code}")
+            self.add_chat_message("小源", f"运行结果：\n{output}")
+            
+            # 将生成的代码插入到编辑器
+            self.insert_generated_code(generated_code)
+            return
+        
+        self.add_chat_message("小源", f"代码运行失败，错误信息：\n{output}")
+        
+        # 修复代码
+        requirement = f"之前的代码运行出错，请修复：\n\n代码：{generated_code}\n\n错误：{output}\n\n请重新生成可以正常运行的代码"
+        self.auto_generate_step(requirement, attempt + 1, max_attempts)
+    
+    def extract_generated_code(self, response):
+        """从AI的回复中取出生成的代码"""
+        import ai_compiler
+        # 提取代码块
+        code_blocks = ai_compiler.extract_code(response)
+        if code_blocks:
+            return code_blocks[0]["code"]  # 返回第一个代码块
+        return response
     
     def save_temp_code(self, code):
         """保存临时代码文件"""
@@ -2324,39 +2527,42 @@ Please describe your problem or the code section you need help with."""
         current_content = self.get_current_editor_content()
         current_type = self.detect_file_type(current_content)
         
-        # 在新线程中调用AI
-        threading.Thread(target=self.chat_with_ai, 
-                        args=(message, current_content, current_type), 
-                        daemon=True).start()
+        # 交给AI引擎，流式内容在主线程中显示
+        self.chat_with_ai(message, current_content, current_type)
 
     def chat_with_ai(self, message, code_context, file_type):
         """与AI对话，自动插入生成的代码"""
         try:
-            import ai_compiler
-            
+            # 当前内容作为代码上下文单独发送，不再重复放进问题里
             if file_type and code_context:
-                enhanced_message = f"当前正在编辑{file_type.upper()}文件:\n\n{message}\n\n当前内容:\n{code_context}"
+                enhanced_message = f"当前正在编辑{file_type.upper()}文件:\n\n{message}"
             else:
                 enhanced_message = message
             
             # 先显示AI开始输入的提示
-            self.root.after(0, self.start_streaming_response)
+            mark = self.start_streaming_response()
             
-            # 定义流式回调函数
-            def stream_callback(chunk):
-                self.root.after(0, self.streaming_response_chunk, chunk)
+            def on_done(response):
+                # 自动提取并插入代码
+                self.auto_insert_code(response, file_type)
+                # 结束流式响应
+                self.end_streaming_response(mark)
             
-            # 使用流式API调用
-            response = ai_compiler.chat(enhanced_message, code_context, stream_callback=stream_callback)
+            def on_error(e):
+                self.streaming_response_chunk(f"对话失败：{str(e)}", mark)
+                self.end_streaming_response(mark)
             
-            # 自动提取并插入代码
-            self.root.after(0, self.auto_insert_code, response, file_type)
+            def on_cancel():
+                self.streaming_response_chunk("（已停止）", mark)
+                self.end_streaming_response(mark)
             
-            # 结束流式响应
-            self.root.after(0, self.end_streaming_response)
+            # 使用流式API调用，回调在主线程中执行
+            self.get_ai_engine().submit("chat", enhanced_message, code_context,
+                                        on_chunk=lambda chunk: self.streaming_response_chunk(chunk, mark),
+                                        on_done=on_done, on_error=on_error, on_cancel=on_cancel)
             
         except Exception as e:
-            self.root.after(0, self.add_chat_message, "小源", f"对话失败：{str(e)}")
+            self.add_chat_message("小源", f"对话失败：{str(e)}")
 
     def auto_insert_code(self, ai_response, current_file_type):
         """自动从AI响应中提取代码并插入到编辑器"""
@@ -2427,104 +2633,239 @@ Please describe your problem or the code section you need help with."""
         return False
 
     def add_chat_message(self, sender, message):
-        """添加消息到聊天显示"""
-        self.chat_display.config(state=tk.NORMAL)
+        """添加消息到聊天显示，在其他线程中调用时转到主线程执行"""
+        if threading.current_thread() is not threading.main_thread():
+            # 逐步显示的状态和聊天显示只在主线程中使用
+            self.root.after(0, self.add_chat_message, sender, message)
+            return
+        # 新消息打断正在逐步显示的消息，剩余部分立即显示
+        self.finish_rendering()
         
         if sender == "小源":
-            # 为AI消息添加打字机效果
-            self.chat_display.insert(tk.END, f"\n🤖 {sender}: ", "ai_message")
+            # AI消息按词分批显示，总耗时有上限；消息存储中直接保存完整内容
             self.chat_display.tag_configure("ai_message", foreground="blue")
-            self.chat_display.config(state=tk.DISABLED)
-            # 使用after方法逐字显示消息
-            self.typewriter_effect(message, "ai_message")
+            self.append_chat_message([(f"\n🤖 {sender}: ", "ai_message"), (f"{message}\n", "ai_message")], shown=1)
+            self.render_message(message, "ai_message")
         else:
             # 用户消息直接显示
-            self.chat_display.insert(tk.END, f"\n👤 {sender}: {message}\n", "user_message")
             self.chat_display.tag_configure("user_message", foreground="green")
-            self.chat_display.config(state=tk.DISABLED)
-            self.chat_display.see(tk.END)
+            self.append_chat_message([(f"\n👤 {sender}: {message}\n", "user_message")])
     
-    def start_streaming_response(self):
-        """开始流式响应，显示AI开始输入的提示"""
+    def append_chat_message(self, segments, shown=None):
+        """把消息存入消息存储并显示在聊天末尾，返回消息编号
+
+        segments 为 [(文本, 标签), ...]，shown 为立即插入的段数（默认全部），
+        其余部分由调用者逐步显示。每条消息开头有一个标记 msg{编号}。
+        消息存储、chat_first 和这些标记只在主线程中修改（分页显示和删除
+        消息也在主线程中进行），在其他线程中调用时抛出 RuntimeError。
+        """
+        if threading.current_thread() is not threading.main_thread():
+            raise RuntimeError("聊天消息只能在主线程中添加")
+        message_id = self.chat_store.add(segments)
+        mark = f"msg{message_id}"
         self.chat_display.config(state=tk.NORMAL)
-        self.chat_display.insert(tk.END, "\n🤖 小源: ", "ai_message")
-        self.chat_display.tag_configure("ai_message", foreground="blue")
+        # 左侧吸附：在标记处插入的内容留在标记之后
+        self.chat_display.mark_set(mark, "end-1c")
+        self.chat_display.mark_gravity(mark, tk.LEFT)
+        self.insert_chat_segments(tk.END, segments[:shown])
+        self.trim_chat_display()
         self.chat_display.config(state=tk.DISABLED)
         self.chat_display.see(tk.END)
+        return message_id
+    
+    def insert_chat_segments(self, index, segments):
+        """在聊天显示的 index 处插入消息的各段"""
+        for text, tag in segments:
+            if tag:
+                self.chat_display.insert(index, text, tag)
+            else:
+                self.chat_display.insert(index, text)
+    
+    def trim_chat_display(self):
+        """聊天显示超过保留的消息数或字符数时，删除最早的消息（仍保存在消息存储中）
+
+        至少保留最新的一条消息，正在流式返回的回复不会被删除。
+        """
+        last = self.chat_store.next_id
+        first, chars = last, 0
+        while first > self.chat_first:
+            chars += self.chat_store.size(first - 1)
+            if first < last and (last - first >= self.chat_max_messages or chars > self.chat_max_chars):
+                break
+            first -= 1
+        if self.streaming_messages:
+            first = min(first, *self.streaming_messages.values())
+        if first <= self.chat_first:
+            return
+        self.chat_display.delete("1.0", f"msg{first}")
+        for message_id in range(self.chat_first, first):
+            self.chat_display.mark_unset(f"msg{message_id}")
+        self.chat_first = first
+    
+    def on_chat_scroll(self, first, last):
+        """聊天显示滚动：更新滚动条，滚动到顶部或底部时调整显示的消息"""
+        self.chat_display.vbar.set(first, last)
+        if self.chat_window_id is None:
+            self.chat_window_id = self.root.after_idle(self.update_chat_window)
+    
+    def update_chat_window(self):
+        """滚动到顶部时从消息存储中重新显示较早的消息，回到底部时再删除多出的消息"""
+        self.chat_window_id = None
+        top, bottom = self.chat_display.yview()
+        if top <= 0.0 and self.chat_first > self.chat_store.first_id:
+            self.page_in_chat_messages()
+        elif bottom >= 1.0:
+            self.chat_display.config(state=tk.NORMAL)
+            self.trim_chat_display()
+            self.chat_display.config(state=tk.DISABLED)
+    
+    def page_in_chat_messages(self):
+        """在聊天显示开头插入前 chat_page_size 条消息，保持当前看到的内容不动"""
+        first = max(self.chat_store.first_id, self.chat_first - self.chat_page_size)
+        if first >= self.chat_first:
+            return
+        old = f"msg{self.chat_first}"
+        self.chat_display.config(state=tk.NORMAL)
+        # 插入位置标记和原来的第一条消息标记都右侧吸附，随插入的内容后移
+        self.chat_display.mark_set("chat_page", "1.0")
+        self.chat_display.mark_gravity("chat_page", tk.RIGHT)
+        self.chat_display.mark_gravity(old, tk.RIGHT)
+        for message_id in range(first, self.chat_first):
+            mark = f"msg{message_id}"
+            self.chat_display.mark_set(mark, "chat_page")
+            self.chat_display.mark_gravity(mark, tk.LEFT)
+            self.insert_chat_segments("chat_page", self.chat_store.get(message_id))
+        self.chat_display.mark_gravity(old, tk.LEFT)
+        self.chat_display.mark_unset("chat_page")
+        self.chat_display.config(state=tk.DISABLED)
+        self.chat_first = first
+        self.chat_display.yview(old)
+    
+    def start_streaming_response(self):
+        """开始流式响应，显示AI开始输入的提示，返回这条回复的插入位置（mark）
+
+        多个请求同时流式返回时，每条回复插入到自己的位置，不会互相穿插。
+        只在主线程中调用，内容段和结束通过AI引擎的桥回到主线程。
+        """
+        self.finish_rendering()
+        self.chat_display.tag_configure("ai_message", foreground="blue")
+        message_id = self.append_chat_message([("\n🤖 小源: ", "ai_message"), ("\n", None)])
+        self.streaming_count += 1
+        mark = f"stream{self.streaming_count}"
+        # 标记在回复末尾的换行之前，右侧吸附：每段内容插入后标记移到它之后
+        self.chat_display.mark_set(mark, "end-2c")
+        self.chat_display.mark_gravity(mark, tk.RIGHT)
         # 初始化流式响应状态
-        self.streaming_response = ""
+        self.streaming_parts[mark] = []
+        self.streaming_messages[mark] = message_id
+        return mark
+    
+    def streaming_response_chunk(self, chunk, mark=None):
+        """处理流式响应块：先攒起来，每帧（约16毫秒）最多刷新一次显示"""
+        self.streaming_parts.setdefault(mark, []).append(chunk)
+        self.streaming_pending.setdefault(mark, []).append(chunk)
+        if self.streaming_flush_id is None:
+            self.streaming_flush_id = self.root.after(16, self.flush_streaming_chunks)
     
-    def streaming_response_chunk(self, chunk):
-        """处理流式响应块，实时显示"""
+    def flush_streaming_chunks(self):
+        """把攒下的内容段显示出来，每条回复只插入一次"""
+        if self.streaming_flush_id is not None:
+            self.root.after_cancel(self.streaming_flush_id)
+            self.streaming_flush_id = None
+        if not self.streaming_pending:
+            return
+        pending, self.streaming_pending = self.streaming_pending, {}
         try:
             self.chat_display.config(state=tk.NORMAL)
-            self.chat_display.insert(tk.END, chunk, "ai_message")
+            for mark, chunks in pending.items():
+                self.chat_display.insert(mark or tk.END, "".join(chunks), "ai_message")
             self.chat_display.config(state=tk.DISABLED)
             self.chat_display.see(tk.END)
-            # 保存当前响应内容
-            self.streaming_response += chunk
         except Exception as e:
             # 记录错误但不中断流式处理
             print(f"流式响应UI更新错误: {str(e)}")
     
-    def end_streaming_response(self):
-        """结束流式响应"""
+    def end_streaming_response(self, mark=None, reply=None):
+        """结束流式响应，返回回复的完整内容
+
+        reply 为缓存的回复时，它没有经过流式返回，在这里注明来自缓存后完整显示。
+        """
+        note = []
+        if getattr(reply, "cached", False):
+            note = [(f"{reply.note}\n", "cached_note")]
+            self.chat_display.tag_configure("cached_note", foreground="gray")
+            self.chat_display.config(state=tk.NORMAL)
+            self.chat_display.insert(mark or tk.END, note[0][0], "cached_note")
+            self.chat_display.config(state=tk.DISABLED)
+            self.streaming_response_chunk(str(reply), mark)
+        self.flush_streaming_chunks()
+        self.streaming_response = "".join(self.streaming_parts.pop(mark, []))
+        message_id = self.streaming_messages.pop(mark, None)
+        if message_id is not None:
+            # 消息存储中保存完整的回复，之后可以重新显示
+            self.chat_store.update(message_id, [("\n🤖 小源: ", "ai_message")] + note +
+                                   [(self.streaming_response, "ai_message"), ("\n", None)])
+        if mark is not None:
+            # 回复末尾的换行已在开始时插入
+            self.chat_display.mark_unset(mark)
+            self.chat_display.see(tk.END)
+            return self.streaming_response
         self.chat_display.config(state=tk.NORMAL)
         self.chat_display.insert(tk.END, "\n")
         self.chat_display.config(state=tk.DISABLED)
         self.chat_display.see(tk.END)
+        return self.streaming_response
     
-    def typewriter_effect(self, message, tag, index=0):
-        """打字机效果显示消息（用于非流式响应）"""
-        if index < len(message):
-            self.chat_display.config(state=tk.NORMAL)
-            self.chat_display.insert(tk.END, message[index], tag)
-            self.chat_display.config(state=tk.DISABLED)
-            self.chat_display.see(tk.END)
-            # 递归调用after方法，实现打字机效果
-            self.root.after(20, self.typewriter_effect, message, tag, index+1)
+    def render_message(self, message, tag):
+        """逐步显示消息（用于非流式响应）
+
+        按词分批插入，每帧（约16毫秒）插入一批，批的大小按消息长度决定，
+        整条消息的显示时间不超过 typewriter_duration 秒；为0时立即完整显示。
+        同一时间只有一条消息在显示，只有一个定时回调。和 render_step、
+        finish_rendering 一样只在主线程中执行。
+        """
+        self.finish_rendering()
+        pieces = re.findall(r"\S+\s*|\s+", str(message))
+        frames = int(self.typewriter_duration * 1000 / 16)
+        if frames <= 1 or len(pieces) <= 1:
+            self.insert_rendered(str(message) + "\n", tag)
+            return
+        self.rendering = {"pieces": pieces, "index": 0, "tag": tag,
+                          "per_frame": -(-len(pieces) // frames)}
+        self.render_after_id = self.root.after(16, self.render_step)
+    
+    def render_step(self):
+        """显示下一批内容"""
+        self.render_after_id = None
+        job = self.rendering
+        if job is None:
+            return
+        start, end = job["index"], job["index"] + job["per_frame"]
+        job["index"] = end
+        if end >= len(job["pieces"]):
+            self.rendering = None
+            self.insert_rendered("".join(job["pieces"][start:]) + "\n", job["tag"])
         else:
-            # 消息显示完毕，添加换行
-            self.chat_display.config(state=tk.NORMAL)
-            self.chat_display.insert(tk.END, "\n")
-            self.chat_display.config(state=tk.DISABLED)
-            self.chat_display.see(tk.END)
-
-    def analyze_code_thread(self, code):
-        """分析代码线程"""
-        try:
-            import ai_compiler
-            response = ai_compiler.analyze(code)
-            self.root.after(0, lambda: self.add_chat_message("小源", response))
-        except Exception as e:
-            self.root.after(0, lambda: self.add_chat_message("小源", f"分析失败：{str(e)}"))
-
-    def suggest_improvements_thread(self, code):
-        """改进建议线程"""
-        try:
-            import ai_compiler
-            response = ai_compiler.suggest_improvements(code)
-            self.root.after(0, lambda: self.add_chat_message("小源", response))
-        except Exception as e:
-            self.root.after(0, lambda: self.add_chat_message("小源", f"获取建议失败：{str(e)}"))
-
-    def explain_code_thread(self, code):
-        """解释代码线程"""
-        try:
-            import ai_compiler
-            response = ai_compiler.explain(code)
-            self.root.after(0, lambda: self.add_chat_message("小源", response))
-        except Exception as e:
-            self.root.after(0, lambda: self.add_chat_message("小源", f"解释失败：{str(e)}"))
-
-    def generate_html_thread(self):
-        """生成HTML线程"""
-        try:
-            import ai_compiler
-            response = ai_compiler.generate_html("生成一个完整的HTML5模板，包含基本的页面结构和样式")
-            self.root.after(0, lambda: self.add_chat_message("小源", response))
-        except Exception as e:
-            self.root.after(0, lambda: self.add_chat_message("小源", f"生成HTML失败：{str(e)}"))
+            self.insert_rendered("".join(job["pieces"][start:end]), job["tag"])
+            self.render_after_id = self.root.after(16, self.render_step)
+    
+    def finish_rendering(self):
+        """立即显示正在逐步显示的消息的剩余部分"""
+        job = self.rendering
+        if job is None:
+            return
+        self.rendering = None
+        if self.render_after_id is not None:
+            self.root.after_cancel(self.render_after_id)
+            self.render_after_id = None
+        self.insert_rendered("".join(job["pieces"][job["index"]:]) + "\n", job["tag"])
+    
+    def insert_rendered(self, text, tag):
+        """在聊天显示末尾插入一段内容"""
+        self.chat_display.config(state=tk.NORMAL)
+        self.chat_display.insert(tk.END, text, tag)
+        self.chat_display.config(state=tk.DISABLED)
+        self.chat_display.see(tk.END)
 
     def get_current_editor_content(self):
         """获取当前编辑器内容"""
@@ -3091,6 +3432,13 @@ Please describe your problem or the code section you need help with."""
                 # 这里可以添加检查文件是否已修改的逻辑
                 pass
             
+            # 关闭语义分析的工作进程
+            semantic.shutdown_executor()
+            
+            # 关闭AI引擎的事件循环和连接
+            if self.ai_engine is not None:
+                self.ai_engine.shutdown()
+            
         except Exception as e:
             print(f"关闭过程中出现错误: {e}")
         finally:
@@ -3099,6 +3447,7 @@ Please describe your problem or the code section you need help with."""
             self.root.destroy()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = CodeEditorApp(root)
     root.protocol("WM_DELETE_WINDOW", app.safe_close)
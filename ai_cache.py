@@ -0,0 +1,217 @@
+import ast
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def default_cache_dir():
+    """默认的缓存目录（用户目录下）"""
+    return os.path.join(os.path.expanduser("~"), ".juyuancang", "ai_cache")
+
+
+def normalize_prompt(prompt):
+    """规范化提示词：统一换行符，去掉行尾和首尾空白"""
+    lines = prompt.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def canonical_code(code):
+    """把 Python 代码规范化为与空白、注释和格式无关的形式
+
+    用 ast.dump 表示语法树；无法解析或没有任何语句（例如只有以 # 开头的
+    Markdown 标题）时返回 None，表示不做语义等价匹配。
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+    if not tree.body:
+        return None
+    return ast.dump(tree, annotate_fields=False)
+
+
+def history_hash(history):
+    """对请求中实际带上的对话历史计算哈希"""
+    data = json.dumps([[msg.get("role"), msg.get("content")] for msg in history or []], ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def make_key(action, model, prompt, history=None, code=None):
+    """按 (操作, 模型, 规范化的提示词, 对话历史哈希[, 规范化的代码]) 计算缓存键
+
+    code 为和提示词分开发送的代码上下文。
+    """
+    parts = [action, model, normalize_prompt(prompt), history_hash(history)]
+    if code:
+        parts.append(normalize_prompt(code))
+    data = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def make_semantic_key(action, model, prompt, code, history=None):
+    """用代码的规范化形式计算缓存键，代码无法规范化时返回 None"""
+    canonical = canonical_code(code) if code else None
+    if canonical is None:
+        return None
+    return make_key(action + ":semantic", model, prompt, history, canonical)
+
+
+class CachedReply(str):
+    """来自缓存的回复，note 为提示用户这是缓存结果的说明
+
+    equivalent 为 True 表示回复来自一份只有空白、注释或格式不同的早先代码。
+    """
+
+    def __new__(cls, text, created=None, equivalent=False):
+        reply = super().__new__(cls, text)
+        reply.created = created or time.time()
+        reply.cached = True
+        reply.equivalent = equivalent
+        return reply
+
+    @property
+    def note(self):
+        minutes = int((time.time() - self.created) // 60)
+        age = f"{minutes} 分钟前" if minutes else "刚才"
+        if self.equivalent:
+            return f"（缓存结果：基于{age}的等价早先版本，代码只有空白、注释或格式不同，未重新调用AI）"
+        return f"（缓存结果：与{age}的相同请求一致，未重新调用AI）"
+
+
+class ResponseCache:
+    """持久化的AI回复缓存
+
+    每条回复按缓存键保存为缓存目录中的一个 JSON 文件。命中时更新文件的
+    修改时间，超过条目数或总大小时按修改时间淘汰最久未使用的条目；
+    超过有效期的条目视为未命中并删除。
+    """
+
+    def __init__(self, cache_dir=None, max_entries=500, max_bytes=20 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.equivalent_hits = 0  # 命中中通过语义等价键命中的次数
+        self._lock = threading.Lock()
+
+    def get(self, key, semantic_key=None):
+        """查找缓存，返回 CachedReply，未命中时返回 None
+
+        精确键未命中时再用语义等价键查找，返回的回复标记为 equivalent。
+        """
+        entry = self._load(key)
+        equivalent = False
+        if entry is None and semantic_key is not None:
+            entry = self._load(semantic_key)
+            equivalent = entry is not None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if equivalent:
+                self.equivalent_hits += 1
+        return CachedReply(entry["response"], entry["created"], equivalent)
+
+    def _load(self, key):
+        """读取一条未过期的缓存条目，并更新它的使用时间"""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            if self.ttl and time.time() - entry["created"] > self.ttl:
+                os.remove(path)
+                entry = None
+            else:
+                os.utime(path)
+        except (OSError, ValueError, KeyError):
+            entry = None
+        return entry
+
+    def put(self, key, response, semantic_key=None, **meta):
+        """保存一条回复，meta 中的信息（操作、模型等）一并写入
+
+        给出 semantic_key 时同时按语义等价键保存一份。
+        """
+        entry = dict(meta, created=time.time(), response=response)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for cache_key in (key, semantic_key):
+                if cache_key is None:
+                    continue
+                path = self._path(cache_key)
+                temp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump(entry, f, ensure_ascii=False)
+                os.replace(temp_path, path)
+            self._evict()
+        except OSError as e:
+            print(f"写入AI缓存失败: {e}")
+
+    def clear(self):
+        """删除所有缓存条目并清零计数"""
+        for path, _, _ in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.equivalent_hits = 0
+
+    def stats(self):
+        """返回命中/未命中次数、条目数和占用的字节数"""
+        entries = self._entries()
+        with self._lock:
+            hits, misses, equivalent_hits = self.hits, self.misses, self.equivalent_hits
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "equivalent_hits": equivalent_hits,
+            "hit_rate": hits / total if total else 0.0,
+            "entries": len(entries),
+            "bytes": sum(size for _, _, size in entries),
+        }
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def _entries(self):
+        """列出缓存条目 [(路径, 修改时间, 大小), ...]"""
+        entries = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _evict(self):
+        """按最久未使用的顺序淘汰条目，直到条目数和总大小都在限制之内"""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda item: item[1])
+            count = len(entries)
+            total = sum(size for _, _, size in entries)
+            for path, _, size in entries:
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                count -= 1
+                total -= size
@@ -1,15 +1,94 @@
+import asyncio
+import collections
 import openai
 import os
 import re
+import time
 from typing import List, Dict, Any
 
+import ai_cache
+import ai_context
+import ai_failover
+import ai_http
+
+class InFlight:
+    """一次进行中的上游请求
+
+    相同请求的所有等待者共享它：后加入的等待者先收到已经到达的内容，之后
+    和其他等待者一起收到每一段新内容。所有等待者都取消后才取消上游请求。
+    """
+
+    def __init__(self):
+        self.task = None
+        self.chunks = []
+        self.listeners = []
+        self.waiters = 0
+
+    def publish(self, chunk):
+        """把一段流式内容转发给所有等待者"""
+        self.chunks.append(chunk)
+        for listener in list(self.listeners):
+            listener(chunk)
+
+    async def wait(self, stream_callback=None):
+        """加入并等待上游请求的结果"""
+        if stream_callback:
+            if self.chunks:
+                stream_callback("".join(self.chunks))
+            self.listeners.append(stream_callback)
+        self.waiters += 1
+        try:
+            return await asyncio.shield(self.task)
+        except asyncio.CancelledError:
+            self.waiters -= 1
+            if self.waiters == 0:
+                self.task.cancel()
+            raise
+        finally:
+            if stream_callback in self.listeners:
+                self.listeners.remove(stream_callback)
+
 class SmartAICompiler:
+    # 结果只取决于代码本身的操作，相同请求的回复可以缓存
+    CACHEABLE_ACTIONS = ("analyze", "explain", "review", "suggest_improvements", "optimize")
+
+    # 第一个参数为代码的操作，代码作为上下文单独发送
+    CODE_ACTIONS = CACHEABLE_ACTIONS + ("debug",)
+
+    # 按每分钟 token 数限流时，预先为回复占用的 token 数（实际用量已知时修正）
+    COMPLETION_TOKENS_ESTIMATE = 1000
+
+    NO_ENDPOINT_MESSAGE = "所有API端点暂时不可用（连续失败或密钥无效），请稍后重试。"
+
     def __init__(self, primary_api_key=None, backup_api_key=None):
         self.primary_api_key = primary_api_key or os.getenv('DEEPSEEK_API_KEY') or os.getenv('OPENAI_API_KEY')
         self.backup_api_key = backup_api_key or os.getenv('DEEPSEEK_BACKUP_API_KEY')
         self.current_api_key = self.primary_api_key
+        # 团队共用的其他密钥（逗号分隔），和主备密钥一起组成密钥池
+        self.extra_api_keys = [key.strip() for key in os.getenv('DEEPSEEK_API_KEYS', '').split(',') if key.strip()]
+        # 每个密钥每分钟的请求数和 token 数限制，None 表示不限制
+        self.key_rpm = int(os.getenv('DEEPSEEK_KEY_RPM', 0)) or None
+        self.key_tpm = int(os.getenv('DEEPSEEK_KEY_TPM', 0)) or None
+        self.base_url = os.getenv('DEEPSEEK_BASE_URL') or ai_http.DEFAULT_BASE_URL
+        self.clients = {}  # API密钥 -> 客户端，共用同一个连接池
+        self.async_clients = {}  # API密钥 -> 异步客户端，只在AI引擎的事件循环中使用
+        self.flights = {}  # 缓存键 -> 进行中的上游请求，只在AI引擎的事件循环中使用
+        self.failover = ai_failover.FailoverManager(probe=self._probe)
+        # 对冲请求：流式请求在最近首字耗时的 hedge_percentile 分位数内没有收到
+        # 第一段内容时，向另一个端点发出同样的请求，先返回内容的一方胜出
+        self.hedging_enabled = False
+        self.hedge_percentile = 0.95
+        self._update_endpoints()
         self.conversation_history = []
         self.code_context = ""
+        # 按 token 预算组装上下文，预算可以用环境变量调整
+        self.context = ai_context.ContextAssembler(int(os.getenv('DEEPSEEK_CONTEXT_BUDGET', 0)) or 16000)
+        self.history_token_limit = 4 * self.context.budget  # 保存的对话历史最多占用的 token 数
+        self.usage_log = collections.deque(maxlen=100)  # 最近请求的 token 用量
+        self.model = "deepseek-coder"
+        self.response_cache = ai_cache.ResponseCache()
+        self.cache_enabled = True
+        self.semantic_cache_enabled = True  # 空白、注释或格式不同的等价代码复用缓存
         
         # 确保有API密钥时才创建客户端
         if self.primary_api_key and self.primary_api_key != "你的Deepseek API":
@@ -45,36 +124,67 @@ class SmartAICompiler:
 对于复杂问题，请分步骤解释。"""
 
     def initialize_client(self):
-        """初始化API客户端"""
+        """初始化API客户端，同一个密钥的客户端只创建一次，所有客户端共享连接池"""
         try:
-            # 增加超时设置，支持长内容生成
-            import httpx
-            self.client = openai.OpenAI(
-                api_key=self.current_api_key,
-                base_url="https://api.deepseek.com/v1",
-                timeout=httpx.Timeout(60.0, read=120.0, write=60.0, connect=30.0)
-            )
+            self.client = self._get_client(self.current_api_key)
             print("AI编译器初始化成功 - 使用API密钥:", self.current_api_key[:8] + "..." if self.current_api_key else "None")
+            return True
         except Exception as e:
             print(f"AI编译器初始化失败: {e}")
             self.client = None
+            return False
 
-    def switch_to_backup_api(self):
-        """切换到备用API"""
-        if self.backup_api_key and self.backup_api_key != self.current_api_key:
-            print("切换到备用API...")
-            self.current_api_key = self.backup_api_key
-            self.initialize_client()
-            return True
-        return False
+    def _get_client(self, api_key):
+        """获取密钥对应的客户端，不存在时创建"""
+        client = self.clients.get(api_key)
+        if client is None:
+            client = openai.OpenAI(
+                api_key=api_key,
+                base_url=self.base_url,
+                timeout=ai_http.pool.timeout,
+                max_retries=0,  # 重试和切换端点由 failover 负责
+                http_client=ai_http.pool.get_client(self.base_url)
+            )
+            self.clients[api_key] = client
+        return client
+
+    def _update_endpoints(self):
+        """把主备API密钥和其他密钥交给密钥池"""
+        keys = [("主API", self.primary_api_key), ("备用API", self.backup_api_key)]
+        keys += [(f"API {i}", key) for i, key in enumerate(self.extra_api_keys, 3)]
+        self.failover.set_endpoints(keys, self.key_rpm, self.key_tpm)
+
+    def _probe(self, endpoint):
+        """健康检查：用端点的密钥请求模型列表，失败时抛出异常"""
+        self._get_client(endpoint.api_key).models.list(timeout=10.0)
+
+    def get_endpoint_stats(self):
+        """获取密钥池中各密钥的熔断状态、负载、剩余额度、延迟和错误统计"""
+        return self.failover.stats()
 
     def set_api_keys(self, primary_api_key, backup_api_key=None):
         """设置主备API密钥"""
         self.primary_api_key = primary_api_key
         self.backup_api_key = backup_api_key
         self.current_api_key = self.primary_api_key
+        self._update_endpoints()
         return self.initialize_client()
 
+    def set_api_key_pool(self, api_keys, rpm=None, tpm=None):
+        """设置任意数量的API密钥和每个密钥每分钟的请求数、token 数限制
+
+        第一个密钥作为主API，第二个作为备用API，请求在所有可用的密钥之间
+        按负载分配。
+        """
+        api_keys = [key for key in api_keys if key]
+        if not api_keys:
+            print("无效的API密钥")
+            return False
+        self.extra_api_keys = api_keys[2:]
+        self.key_rpm = rpm
+        self.key_tpm = tpm
+        return self.set_api_keys(api_keys[0], api_keys[1] if len(api_keys) > 1 else None)
+
     def validate_and_set_api(self, api_key):
         """验证并设置API密钥（兼容旧版本）"""
         return self.set_api_key(api_key)
@@ -84,32 +194,56 @@ class SmartAICompiler:
         if api_key and api_key != "你的Deepseek API":
             self.primary_api_key = api_key
             self.current_api_key = self.primary_api_key
-            try:
-                # 增加超时设置，支持长内容生成
-                import httpx
-                self.client = openai.OpenAI(
-                    api_key=api_key,
-                    base_url="https://api.deepseek.com/v1",
-                    timeout=httpx.Timeout(60.0, read=120.0, write=60.0, connect=30.0)
-                )
+            self._update_endpoints()
+            if self.initialize_client():
                 print("API密钥设置成功")
                 return True
-            except Exception as e:
-                print(f"API密钥设置失败: {e}")
-                self.client = None
-                return False
+            print("API密钥设置失败")
+            return False
         else:
             print("无效的API密钥")
             return False
 
+    def set_base_url(self, base_url):
+        """设置API端点（例如本地的 OpenAI 兼容服务），已有的客户端作废"""
+        self.base_url = base_url
+        self.clients = {}
+        self.async_clients = {}
+        if self.client is not None:
+            return self.initialize_client()
+        return True
+
+    def warm_up(self, wait=False):
+        """预先建立到API端点的连接，避免第一次对话承担DNS、TCP和TLS的延迟"""
+        return ai_http.pool.warm_up(self.base_url, wait)
+
     def set_code_context(self, code):
         """设置当前代码上下文"""
         self.code_context = code
 
-    def analyze_code_quality(self, code):
+    def build_request(self, action, *args, **kwargs):
+        """构建操作的请求参数 {"prompt", "action", "code", "context"}，可直接传给 _call_api
+
+        针对代码的操作把代码作为 context 单独发送，放在对话历史和问题之前，
+        提示词中只有要求。这样同一份代码的各种请求有相同的消息前缀，
+        可以命中API服务端的上下文缓存。
+        """
+        prompt = getattr(self, f"_{action}_prompt")(*args, **kwargs)
+        code = args[0] if action in self.CACHEABLE_ACTIONS and args else None
+        context = None
+        if action in self.CODE_ACTIONS and args:
+            context = args[0]
+        elif action == "chat":
+            context = kwargs.get("code_context", args[1] if len(args) > 1 else None)
+        return {"prompt": prompt, "action": action, "code": code, "context": context}
+
+    def analyze_code_quality(self, code, stream_callback=None):
         """深度分析代码质量"""
-        analysis_prompt = f"""
-{code}
+        return self._call_api(stream_callback=stream_callback, **self.build_request("analyze", code))
+
+    def _analyze_prompt(self, code):
+        """深度分析代码质量的提示词"""
+        analysis_prompt = """请深度分析前面给出的代码的质量。
 
 请从以下方面分析：
 
@@ -126,12 +260,15 @@ class SmartAICompiler:
 6、具体的改进建议
 
 请给出详细的评分（1-10分）和具体建议。"""
-        return self._call_api(analysis_prompt)
+        return analysis_prompt
     
-    def explain_code_detailed(self, code):
+    def explain_code_detailed(self, code, stream_callback=None):
         """详细解释代码"""
-        explanation_prompt = f"""请详细解释这段代码：
-{code}
+        return self._call_api(stream_callback=stream_callback, **self.build_request("explain", code))
+
+    def _explain_prompt(self, code):
+        """详细解释代码的提示词"""
+        explanation_prompt = """请详细解释前面给出的代码。
 
 请包括：
 
@@ -146,12 +283,15 @@ class SmartAICompiler:
 5、可能的用例和应用场景
 
 6、学习要点和关键概念"""
-        return self._call_api(explanation_prompt)
+        return explanation_prompt
     
-    def optimize_code(self, code):
+    def optimize_code(self, code, stream_callback=None):
         """优化代码并提供多种方案"""
-        optimization_prompt = f"""请优化这段代码
-{code}
+        return self._call_api(stream_callback=stream_callback, **self.build_request("optimize", code))
+
+    def _optimize_prompt(self, code):
+        """优化代码并提供多种方案的提示词"""
+        optimization_prompt = """请优化前面给出的代码。
 
 请提供：
 
@@ -172,10 +312,14 @@ class SmartAICompiler:
 ·优化后的改进
 
 ·为什么这样优化更好"""
-        return self._call_api(optimization_prompt)
+        return optimization_prompt
     
-    def generate_code(self, requirements):
+    def generate_code(self, requirements, stream_callback=None):
         """根据需求生成代码"""
+        return self._call_api(stream_callback=stream_callback, **self.build_request("generate", requirements))
+
+    def _generate_prompt(self, requirements):
+        """根据需求生成代码的提示词"""
         generation_prompt = f"""根据以下需求生成代码：
 {requirements}
 
@@ -200,13 +344,16 @@ class SmartAICompiler:
 ·可扩展
 
 ·有适当的文档字符串"""
-        return self._call_api(generation_prompt)
+        return generation_prompt
     
-    def debug_code(self, code, error_message=None):
+    def debug_code(self, code, error_message=None, stream_callback=None):
         """调试代码问题"""
+        return self._call_api(stream_callback=stream_callback, **self.build_request("debug", code, error_message))
+
+    def _debug_prompt(self, code, error_message=None):
+        """调试代码问题的提示词"""
         if error_message:
-            debug_prompt = f"""请帮助调试这段代码：
-{code}
+            debug_prompt = f"""请帮助调试前面给出的代码。
 
 遇到的错误：
 {error_message}
@@ -223,9 +370,7 @@ class SmartAICompiler:
 
 5、建议如何避免类似错误"""
         else:
-            debug_prompt = f"""请检查这段代码的潜在问题：
-
-{code}
+            debug_prompt = """请检查前面给出的代码的潜在问题。
 
 请：
 
@@ -238,13 +383,16 @@ class SmartAICompiler:
 4、提供改进后的代码
 
 5、给出测试建议"""
-        return self._call_api(debug_prompt)
+        return debug_prompt
 
     def chat_with_context(self, message, code_context=None, stream_callback=None):
         """带上下文的智能对话"""
+        return self._call_api(stream_callback=stream_callback, **self.build_request("chat", message, code_context))
+
+    def _chat_prompt(self, message, code_context=None):
+        """带上下文的智能对话的提示词"""
         if code_context:
-            chat_prompt = f"""当前代码上下文：
-{code_context}
+            chat_prompt = f"""结合前面给出的当前代码上下文回答。
 用户问题：{message}"""
         else:
             chat_prompt = f"用户问题：{message}"
@@ -262,12 +410,15 @@ class SmartAICompiler:
 4、进一步的学习资源（如需要）
 
 5、友好的语气和专业的表达"""
-        return self._call_api(chat_prompt, stream_callback=stream_callback)
+        return chat_prompt
 
-    def suggest_improvements(self, code):
+    def suggest_improvements(self, code, stream_callback=None):
         """提供代码改进建议"""
-        improvement_prompt = f"""为这段代码提供改进建议： 
-{code}
+        return self._call_api(stream_callback=stream_callback, **self.build_request("suggest_improvements", code))
+
+    def _suggest_improvements_prompt(self, code):
+        """提供代码改进建议的提示词"""
+        improvement_prompt = """为前面给出的代码提供改进建议。
 
 请从以下角度提供具体建议：
 
@@ -294,10 +445,14 @@ class SmartAICompiler:
 ·改进后的代码示例
 
 ·改进带来的好处"""
-        return self._call_api(improvement_prompt)
+        return improvement_prompt
     
-    def teach_concept(self, concept, level="beginner"):
+    def teach_concept(self, concept, level="beginner", stream_callback=None):
         """教学特定编程概念"""
+        return self._call_api(stream_callback=stream_callback, **self.build_request("teach", concept, level))
+
+    def _teach_prompt(self, concept, level="beginner"):
+        """教学特定编程概念的提示词"""
         teaching_prompt = f"""请以{level}级别讲解以下编程概念：
 {concept}
 
@@ -316,12 +471,15 @@ class SmartAICompiler:
 6、进一步学习路径
 
 使用通俗易懂的语言，配合具体例子。"""
-        return self._call_api(teaching_prompt)
+        return teaching_prompt
     
-    def code_review(self, code):
+    def code_review(self, code, stream_callback=None):
         """代码审查"""
-        review_prompt = f"""对以下代码进行专业审查：
-{code}
+        return self._call_api(stream_callback=stream_callback, **self.build_request("review", code))
+
+    def _review_prompt(self, code):
+        """代码审查的提示词"""
+        review_prompt = """对前面给出的代码进行专业审查。
 
 请提供详细的代码审查报告，包括：
 
@@ -340,10 +498,14 @@ class SmartAICompiler:
 7、具体的修改建议
 
 格式化为清晰的报告形式。"""
-        return self._call_api(review_prompt)
+        return review_prompt
     
-    def generate_html_template(self, requirements):
+    def generate_html_template(self, requirements, stream_callback=None):
         """生成HTML模板"""
+        return self._call_api(stream_callback=stream_callback, **self.build_request("generate_html", requirements))
+
+    def _generate_html_prompt(self, requirements):
+        """生成HTML模板的提示词"""
         html_prompt = f"""根据以下需求生成完整的HTML页面：
 {requirements}
 
@@ -362,128 +524,341 @@ class SmartAICompiler:
 6、符合Web标准
 
 请提供可以直接运行的完整代码。"""
-        return self._call_api(html_prompt)
+        return html_prompt
     
-    def _call_api(self, prompt, stream_callback=None):
-        """调用API的统一方法，支持备用API切换和流式返回"""
+    def _call_api(self, prompt, stream_callback=None, action=None, code=None, context=None):
+        """调用API的统一方法，支持故障切换、流式返回和回复缓存
+
+        action 为 CACHEABLE_ACTIONS 中的操作时，请求不带对话历史，相同的请求
+        直接返回缓存的回复（CachedReply）。给出提示词中嵌入的 code 且启用了
+        语义缓存时，只有空白、注释或格式不同的 Python 代码也能命中缓存。
+        超时、频率限制等API错误按熔断器的状态换到备用API或退避后重试。
+        context 为单独放入的代码上下文（默认为 set_code_context 设置的代码）。
+        缓存的回复不经过 stream_callback，直接作为结果返回，由调用者注明来自缓存。
+
+        请求交给AI引擎的事件循环执行（见 _call_api_async），调用线程等待结果，
+        stream_callback 在事件循环的线程中调用。事件循环中应直接 await
+        _call_api_async。
+        """
+        import ai_engine  # ai_engine 导入了本模块，在这里延迟导入
+        loop = ai_engine.get_loop()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            raise RuntimeError("不能在AI引擎的事件循环中同步调用API，请使用 _call_api_async")
+        return asyncio.run_coroutine_threadsafe(
+            self._call_api_async(prompt, stream_callback, action, code, context), loop).result()
+
+    async def _call_api_async(self, prompt, stream_callback=None, action=None, code=None, context=None):
+        """_call_api 的异步实现，在AI引擎的事件循环中使用异步客户端
+
+        可缓存的操作中，同时进行的相同请求（缓存键相同）共用一次上游调用，
+        每个请求都收到同样的流式内容和最终结果。
+        """
+        request = self._prepare_request(prompt, stream_callback, action, code, context)
+        if request["reply"] is not None:
+            return request["reply"]
+        
+        key = request["flight_key"]
+        if key is None:
+            return await self._send_async(request, stream_callback)
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = InFlight()
+            # 上游调用总是使用流式返回，后加入的流式请求也能收到完整内容
+            flight.task = asyncio.ensure_future(self._send_async(request, flight.publish))
+            flight.task.add_done_callback(lambda task: self.flights.pop(key, None))
+            self.flights[key] = flight
+        return await flight.wait(stream_callback)
+
+    async def _send_async(self, request, stream_callback=None):
+        """发送请求并处理流式返回，出错时按熔断器的状态换到备用API或退避后重试"""
+        attempt, failed = 0, None
+        while True:
+            endpoint, wait = self.failover.acquire(request["tokens"], avoid=failed)
+            if endpoint is None:
+                if wait is not None:
+                    # 所有可用的密钥都达到速率限制，等到有额度时再发
+                    await asyncio.sleep(wait)
+                    continue
+                if not attempt:
+                    error_msg = self.NO_ENDPOINT_MESSAGE
+                break
+            usage = None
+            try:
+                if attempt:
+                    await asyncio.sleep(self.failover.retry_delay(attempt - 1, failed, endpoint))
+                self.current_api_key = endpoint.api_key
+                client = self._get_async_client(endpoint.api_key)
+                start = time.perf_counter()
+                if stream_callback:
+                    # 流式返回模式
+                    ai_reply = ""
+                    try:
+                        endpoint, opened = await self._open_stream(endpoint, request)
+                        stream, chunks, content, _ = opened.result()
+                        # 请求被取消时退出 async with 会关闭响应，中断HTTP流
+                        async with stream:
+                            if content:
+                                ai_reply += content
+                                stream_callback(content)
+                            async for chunk in chunks:
+                                if chunk.usage:
+                                    usage = chunk.usage
+                                if chunk.choices and chunk.choices[0].delta.content:
+                                    content = chunk.choices[0].delta.content
+                                    ai_reply += content
+                                    stream_callback(content)
+                    except Exception as e:
+                        if not ai_reply:
+                            raise
+                        # 在流式处理中发生错误，仍然返回已生成的内容
+                        self.failover.record_error(endpoint, e)
+                        error_msg = f"\n\n处理响应时出错：{str(e)}"
+                        stream_callback(error_msg)
+                        return ai_reply + error_msg
+                else:
+                    # 非流式返回模式
+                    response = await client.chat.completions.create(stream=False, **request["params"])
+                    ai_reply = response.choices[0].message.content
+                    usage = response.usage
+            except Exception as e:
+                retry, error_msg = self._error_message(e)
+                self.failover.record_error(endpoint, e)
+                if not retry:
+                    break
+                attempt, failed = attempt + 1, endpoint
+                if attempt >= self.failover.max_attempts:
+                    break
+                continue
+            finally:
+                self.failover.release(endpoint, request["tokens"], usage.total_tokens if usage else None)
+            
+            self.failover.record_success(endpoint, time.perf_counter() - start)
+            return self._finish_request(request, ai_reply, usage)
+        
+        if stream_callback:
+            stream_callback(error_msg)
+        return error_msg
+
+    async def _open_stream(self, endpoint, request):
+        """发出流式请求并等到第一段内容，返回 (实际使用的端点, 已完成的任务)
+
+        任务的结果为 (stream, 迭代器, 第一段内容, 首字耗时)，失败时 result()
+        抛出异常。启用对冲时，超过等待时间仍没有内容就向另一个端点发出同样的
+        请求，先收到内容的一方胜出，另一方被取消、关闭连接并释放占用的额度。
+        """
+        params = request["params"]
+        first = asyncio.ensure_future(self._start_stream(endpoint, params))
+        tasks = {first: endpoint}
+        winner = endpoint
+        try:
+            delay = self.failover.hedge_delay(self.hedge_percentile) if self.hedging_enabled else None
+            await asyncio.wait([first], timeout=delay)
+            if not first.done():
+                backup, _ = self.failover.acquire(request["tokens"], exclude=endpoint)
+                if backup is not None:
+                    print(f"{delay:.1f} 秒内未收到回复，向{backup.name}发出对冲请求")
+                    tasks[asyncio.ensure_future(self._start_stream(backup, params))] = backup
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # 同时完成时成功的一方优先
+                for task in sorted(done, key=lambda task: task.exception() is not None):
+                    if task.exception() is None or not pending:
+                        winner = tasks[task]
+                        if task.exception() is None:
+                            self.failover.record_ttft(winner, task.result()[3], winner is not endpoint)
+                        return winner, task
+                    # 对冲的一方失败，继续等待另一方
+                    self.failover.record_error(tasks[task], task.exception())
+        finally:
+            for task, other in tasks.items():
+                if not task.done():
+                    task.cancel()
+                if other is not winner:
+                    self.failover.release(other, request["tokens"])
+
+    async def _start_stream(self, endpoint, params):
+        """打开流并读到第一段内容，返回 (stream, 迭代器, 第一段内容, 首字耗时)"""
+        start = time.perf_counter()
+        client = self._get_async_client(endpoint.api_key)
+        stream = await client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **params)
+        chunks = stream.__aiter__()
+        try:
+            async for chunk in chunks:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    return stream, chunks, chunk.choices[0].delta.content, time.perf_counter() - start
+        except BaseException:
+            # 被取消（对冲失败的一方）或出错时关闭响应
+            await stream.close()
+            raise
+        return stream, chunks, "", time.perf_counter() - start
+
+    def _get_async_client(self, api_key=None):
+        """获取密钥（默认为当前密钥）的异步客户端，只能在AI引擎的事件循环中使用"""
+        api_key = api_key or self.current_api_key
+        client = self.async_clients.get(api_key)
+        if client is None:
+            client = openai.AsyncOpenAI(
+                api_key=api_key,
+                base_url=self.base_url,
+                timeout=ai_http.pool.timeout,
+                max_retries=0,  # 重试和切换端点由 failover 负责
+                http_client=ai_http.pool.get_async_client(self.base_url)
+            )
+            self.async_clients[api_key] = client
+        return client
+
+    def _prepare_request(self, prompt, stream_callback, action, code, context=None):
+        """检查客户端、构建消息并查找缓存
+
+        返回的字典中 reply 不为 None 时（错误提示或缓存的回复）直接返回它，
+        否则 params 为调用 chat.completions.create 的参数。
+        """
+        request = {"reply": None, "prompt": prompt, "action": action, "cache_key": None, "semantic_key": None,
+                   "flight_key": None, "params": None, "tokens": 0, "report": None}
         if not self.primary_api_key or self.primary_api_key == "你的Deepseek API":
-            error_msg = "错误：请先设置有效的Deepseek API密钥"
+            request["reply"] = "错误：请先设置有效的Deepseek API密钥"
+        elif self.client is None:
+            request["reply"] = "错误：AI客户端未正确初始化，请检查API密钥"
+        if request["reply"] is not None:
             if stream_callback:
-                stream_callback(error_msg)
-            return error_msg
+                stream_callback(request["reply"])
+            return request
         
-        if self.client is None:
-            error_msg = "错误：AI客户端未正确初始化，请检查API密钥"
-            if stream_callback:
-                stream_callback(error_msg)
-            return error_msg
+        # 可缓存的操作只针对代码本身，不带对话历史
+        history = [] if action in self.CACHEABLE_ACTIONS else self.conversation_history
+        context = context or self.code_context
         
-        # 构建消息历史
-        messages = [
-            {"role": "system", "content": self.system_prompt},
-            {"role": "user", "content": prompt}
-        ]
+        # 查找缓存，缓存键同时用于合并同时进行的相同请求
+        if action in self.CACHEABLE_ACTIONS:
+            request["flight_key"] = ai_cache.make_key(action, self.model, prompt, history, context)
+        if self.cache_enabled and action in self.CACHEABLE_ACTIONS:
+            request["cache_key"] = request["flight_key"]
+            if self.semantic_cache_enabled and code:
+                request["semantic_key"] = ai_cache.make_semantic_key(action, self.model, prompt, code, history)
+            cached = self.response_cache.get(request["cache_key"], request["semantic_key"])
+            if cached is not None:
+                self._remember(prompt, cached)
+                request["reply"] = cached
+                return request
         
-        # 添加上下文对话历史（限制长度）
-        for msg in self.conversation_history[-6:]:  # 保留最近6条对话
-            messages.insert(1, msg)
+        # 按预算组装消息，前缀保持稳定：系统提示词、当前代码、较早对话的摘要、
+        # 按时间顺序的最近对话，最后才是本次的问题
+        messages, request["report"] = self.context.assemble(self.system_prompt, prompt, history, context)
+        request["params"] = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": 8000,  # 增加max_tokens值，支持更长内容生成
+        }
+        # 估计请求使用的 token 数，用于按密钥的每分钟 token 数限流
+        request["tokens"] = request["report"]["total"] + self.COMPLETION_TOKENS_ESTIMATE
+        return request
+
+    def _finish_request(self, request, ai_reply, usage=None):
+        """请求成功：记录 token 用量，保存到对话历史并写入缓存"""
+        self._record_usage(request, usage)
+        self._remember(request["prompt"], ai_reply)
+        self._store(request["cache_key"], request["semantic_key"], request["action"], ai_reply)
+        return ai_reply
+
+    def _record_usage(self, request, usage):
+        """记录一次请求估计的和实际的 token 用量"""
+        report = request["report"]
+        entry = dict(report, action=request["action"], time=time.time(),
+                     prompt_tokens=usage.prompt_tokens if usage else None,
+                     completion_tokens=usage.completion_tokens if usage else None,
+                     total_tokens=usage.total_tokens if usage else None,
+                     cache_hit_tokens=self._cache_hit_tokens(usage))
+        self.usage_log.append(entry)
+        actual = ""
+        if usage:
+            actual = f"，实际 输入 {entry['prompt_tokens']} / 输出 {entry['completion_tokens']}"
+            if entry["cache_hit_tokens"] is not None:
+                actual += f"，上下文缓存命中 {entry['cache_hit_tokens']}"
+        print(f"AI请求 {request['action'] or ''} tokens: 估计输入 {report['total']}/{report['budget']}"
+              f"（代码 {report['code']}，对话 {report['history_turns']} 轮 {report['history']}，"
+              f"摘要 {report['summarized_turns']} 轮 {report['summary']}）{actual}")
+
+    def _cache_hit_tokens(self, usage):
+        """回复的 usage 中命中服务端上下文缓存的输入 token 数，未提供时返回 None"""
+        if usage is None:
+            return None
+        hit = getattr(usage, "prompt_cache_hit_tokens", None)  # DeepSeek
+        if hit is None and getattr(usage, "prompt_tokens_details", None) is not None:
+            hit = usage.prompt_tokens_details.cached_tokens  # OpenAI
+        return hit
+
+    def _error_message(self, e):
+        """把异常转换为提示信息，返回 (是否可以切换备用API重试, 提示信息)
+
+        只有端点引起的错误（见 ai_failover.is_endpoint_error）才重试，其他
+        4xx 错误由请求本身引起，直接返回给调用者。
+        """
+        retry = ai_failover.is_endpoint_error(e)
+        if isinstance(e, openai.APITimeoutError):
+            return retry, "请求超时，请稍后重试。"
+        if isinstance(e, openai.RateLimitError):
+            return retry, "API调用频率超限，请稍后重试。"
+        if isinstance(e, openai.AuthenticationError):
+            return retry, "API密钥错误，请检查密钥是否正确。"
+        if isinstance(e, openai.APIError):
+            return retry, f"API调用失败：{str(e)}"
+        return retry, f"处理响应时出错：{str(e)}"
+
+    def _remember(self, prompt, ai_reply):
+        """保存到对话历史"""
+        self.conversation_history.extend([
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": str(ai_reply)}
+        ])
         
-        try:
-            if stream_callback:
-                # 流式返回模式
-                ai_reply = ""
-                try:
-                    for chunk in self.client.chat.completions.create(
-                        model="deepseek-coder",
-                        messages=messages,
-                        temperature=0.7,
-                        max_tokens=8000,  # 增加max_tokens值，支持更长内容生成
-                        stream=True
-                    ):
-                        if chunk.choices[0].delta.content:
-                            content = chunk.choices[0].delta.content
-                            ai_reply += content
-                            # 调用回调函数实时处理内容
-                            stream_callback(content)
-                except Exception as e:
-                    # 在流式处理中发生错误，仍然返回已生成的内容
-                    error_msg = f"\n\n处理响应时出错：{str(e)}"
-                    stream_callback(error_msg)
-                    ai_reply += error_msg
-                    return ai_reply
-                
-                # 保存到对话历史
-                self.conversation_history.extend([
-                    {"role": "user", "content": prompt},
-                    {"role": "assistant", "content": ai_reply}
-                ])
-                
-                # 限制对话历史长度
-                if len(self.conversation_history) > 20:
-                    self.conversation_history = self.conversation_history[-20:]
-                
-                return ai_reply
-            else:
-                # 非流式返回模式
-                response = self.client.chat.completions.create(
-                    model="deepseek-coder",
-                    messages=messages,
-                    temperature=0.7,
-                    max_tokens=8000,  # 增加max_tokens值，支持更长内容生成
-                    stream=False
-                )
-                
-                ai_reply = response.choices[0].message.content
-                
-                # 保存到对话历史
-                self.conversation_history.extend([
-                    {"role": "user", "content": prompt},
-                    {"role": "assistant", "content": ai_reply}
-                ])
-                
-                # 限制对话历史长度
-                if len(self.conversation_history) > 20:
-                    self.conversation_history = self.conversation_history[-20:]
-                
-                return ai_reply
-            
-        except openai.APITimeoutError:
-            # 超时错误，尝试切换API
-            if self.switch_to_backup_api():
-                return self._call_api(prompt, stream_callback)  # 重试
-            error_msg = "请求超时，请稍后重试。"
-            if stream_callback:
-                stream_callback(error_msg)
-            return error_msg
-        except openai.RateLimitError:
-            # 频率限制错误，尝试切换API
-            if self.switch_to_backup_api():
-                return self._call_api(prompt, stream_callback)  # 重试
-            error_msg = "API调用频率超限，请稍后重试。"
-            if stream_callback:
-                stream_callback(error_msg)
-            return error_msg
-        except openai.APIError as e:
-            # 其他API错误，尝试切换API
-            if self.switch_to_backup_api():
-                return self._call_api(prompt, stream_callback)  # 重试
-            error_msg = f"API调用失败：{str(e)}"
-            if stream_callback:
-                stream_callback(error_msg)
-            return error_msg
-        except openai.AuthenticationError:
-            # 认证错误，尝试切换API
-            if self.switch_to_backup_api():
-                return self._call_api(prompt, stream_callback)  # 重试
-            error_msg = "API密钥错误，请检查密钥是否正确。"
-            if stream_callback:
-                stream_callback(error_msg)
-            return error_msg
-        except Exception as e:
-            error_msg = f"处理响应时出错：{str(e)}"
-            if stream_callback:
-                stream_callback(error_msg)
-            return error_msg
+        # 按 token 数限制对话历史长度，从最早的一轮开始丢弃
+        turns = ai_context.split_turns(self.conversation_history)
+        total = sum(ai_context.message_tokens(msg) for msg in self.conversation_history)
+        while len(turns) > 1 and total > self.history_token_limit:
+            total -= sum(ai_context.message_tokens(msg) for msg in turns.pop(0))
+        self.conversation_history = [msg for turn in turns for msg in turn]
+
+    def _store(self, cache_key, semantic_key, action, ai_reply):
+        """把成功的回复写入缓存"""
+        if cache_key is not None and ai_reply:
+            self.response_cache.put(cache_key, ai_reply, semantic_key, action=action, model=self.model)
+
+    def set_context_budget(self, tokens):
+        """设置每个请求发送的消息最多使用的 token 数"""
+        self.context.budget = tokens
+        self.history_token_limit = 4 * tokens
+
+    def get_usage_log(self):
+        """获取最近请求的 token 用量（估计的各部分用量和API返回的实际用量）"""
+        return list(self.usage_log)
+
+    def get_usage_stats(self):
+        """汇总最近请求的 token 用量和服务端上下文缓存的命中率"""
+        entries = [entry for entry in self.usage_log if entry["prompt_tokens"] is not None]
+        prompt_tokens = sum(entry["prompt_tokens"] for entry in entries)
+        hit_tokens = sum(entry["cache_hit_tokens"] or 0 for entry in entries)
+        return {
+            "requests": len(entries),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": sum(entry["completion_tokens"] or 0 for entry in entries),
+            "cache_hit_tokens": hit_tokens,
+            "cache_hit_rate": hit_tokens / prompt_tokens if prompt_tokens else 0.0,
+            "last": entries[-1] if entries else None,
+        }
+
+    def get_cache_stats(self):
+        """获取回复缓存的命中统计"""
+        return self.response_cache.stats()
+
+    def clear_cache(self):
+        """清空回复缓存"""
+        self.response_cache.clear()
 
     def extract_code_blocks(self, text):
         """从回复中提取代码块"""
@@ -519,49 +894,53 @@ def set_api_keys(primary_api_key, backup_api_key=None):
     """设置主备API密钥"""
     return _global_compiler.set_api_keys(primary_api_key, backup_api_key)
 
+def set_api_key_pool(api_keys, rpm=None, tpm=None):
+    """设置API密钥池和每个密钥的速率限制"""
+    return _global_compiler.set_api_key_pool(api_keys, rpm, tpm)
+
 def set_current_code(code):
     """设置当前代码上下文"""
     _global_compiler.set_code_context(code)
 
-def analyze(code):
+def analyze(code, stream_callback=None):
     """分析代码质量"""
-    return _global_compiler.analyze_code_quality(code)
+    return _global_compiler.analyze_code_quality(code, stream_callback=stream_callback)
 
-def explain(code):
+def explain(code, stream_callback=None):
     """解释代码"""
-    return _global_compiler.explain_code_detailed(code)
+    return _global_compiler.explain_code_detailed(code, stream_callback=stream_callback)
 
-def optimize(code):
+def optimize(code, stream_callback=None):
     """优化代码"""
-    return _global_compiler.optimize_code(code)
+    return _global_compiler.optimize_code(code, stream_callback=stream_callback)
 
 def chat(message, code_context=None, stream_callback=None):
     """AI聊天"""
     return _global_compiler.chat_with_context(message, code_context, stream_callback=stream_callback)
 
-def suggest_improvements(code):
+def suggest_improvements(code, stream_callback=None):
     """提供改进建议"""
-    return _global_compiler.suggest_improvements(code)
+    return _global_compiler.suggest_improvements(code, stream_callback=stream_callback)
 
-def debug(code, error_message=None):
+def debug(code, error_message=None, stream_callback=None):
     """调试代码"""
-    return _global_compiler.debug_code(code, error_message)
+    return _global_compiler.debug_code(code, error_message, stream_callback=stream_callback)
 
-def generate(requirements):
+def generate(requirements, stream_callback=None):
     """生成代码"""
-    return _global_compiler.generate_code(requirements)
+    return _global_compiler.generate_code(requirements, stream_callback=stream_callback)
 
-def teach(concept, level="beginner"):
+def teach(concept, level="beginner", stream_callback=None):
     """教学概念"""
-    return _global_compiler.teach_concept(concept, level)
+    return _global_compiler.teach_concept(concept, level, stream_callback=stream_callback)
 
-def review(code):
+def review(code, stream_callback=None):
     """代码审查"""
-    return _global_compiler.code_review(code)
+    return _global_compiler.code_review(code, stream_callback=stream_callback)
 
-def generate_html(requirements):
+def generate_html(requirements, stream_callback=None):
     """生成HTML模板"""
-    return _global_compiler.generate_html_template(requirements)
+    return _global_compiler.generate_html_template(requirements, stream_callback=stream_callback)
 
 def clear_chat_history():
     """清空对话历史"""
@@ -573,4 +952,50 @@ def extract_code(text):
 
 def validate_and_set_api(api_key):
     """验证并设置API密钥"""
-    return _global_compiler.validate_and_set_api(api_key)
\ No newline at end of file
+    return _global_compiler.validate_and_set_api(api_key)
+
+def set_base_url(base_url):
+    """设置API端点"""
+    return _global_compiler.set_base_url(base_url)
+
+def warm_up(wait=False):
+    """预先建立到API端点的连接"""
+    return _global_compiler.warm_up(wait)
+
+def get_endpoint_stats():
+    """获取各API端点的熔断状态、延迟和错误统计"""
+    return _global_compiler.get_endpoint_stats()
+
+def set_hedging(enabled, percentile=None):
+    """启用或停用对冲请求，percentile 为触发对冲的首字耗时分位数（0~1）"""
+    _global_compiler.hedging_enabled = enabled
+    if percentile is not None:
+        _global_compiler.hedge_percentile = percentile
+
+def set_context_budget(tokens):
+    """设置每个请求的上下文 token 预算"""
+    _global_compiler.set_context_budget(tokens)
+
+def get_usage_log():
+    """获取最近请求的 token 用量"""
+    return _global_compiler.get_usage_log()
+
+def get_usage_stats():
+    """汇总 token 用量和上下文缓存命中率"""
+    return _global_compiler.get_usage_stats()
+
+def get_cache_stats():
+    """获取回复缓存的命中统计"""
+    return _global_compiler.get_cache_stats()
+
+def clear_cache():
+    """清空回复缓存"""
+    _global_compiler.clear_cache()
+
+def set_cache_enabled(enabled):
+    """启用或停用回复缓存"""
+    _global_compiler.cache_enabled = enabled
+
+def set_semantic_cache_enabled(enabled):
+    """启用或停用语义等价代码的缓存匹配"""
+    _global_compiler.semantic_cache_enabled = enabled
\ No newline at end of file
@@ -0,0 +1,121 @@
+def estimate_tokens(text):
+    """离线粗略估计文本的 token 数：中文等非ASCII字符约0.6个，其他字符约0.3个"""
+    wide = sum(1 for ch in text if ord(ch) > 0x7f)
+    return int(wide * 0.6 + (len(text) - wide) * 0.3) + 1
+
+
+def message_tokens(message):
+    """一条消息的 token 数，包括角色等格式开销"""
+    return estimate_tokens(message["content"]) + 4
+
+
+def truncate_to_tokens(text, tokens):
+    """把文本截断到大约 tokens 个 token，保留开头"""
+    total = estimate_tokens(text)
+    if total <= tokens:
+        return text
+    marker = "\n...（内容过长，已截断）"
+    keep = max(0, int(len(text) * (tokens - estimate_tokens(marker)) / total))
+    return text[:keep] + marker
+
+
+def split_turns(history):
+    """把对话历史分成轮次，每轮从一条用户消息开始"""
+    turns = []
+    for message in history:
+        if message["role"] == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def summarize_turns(turns, budget):
+    """把较早的对话压缩为一条摘要消息（不调用API），预算不够时丢弃最早的轮次
+
+    每轮只保留问题和回答的开头。返回 (摘要消息, 摘要包含的轮数)，放不下
+    任何一轮时返回 (None, 0)。
+    """
+    blocks = []
+    for turn in turns:
+        lines = []
+        for message in turn:
+            text = " ".join(message["content"].split())
+            role, limit = ("用户", 80) if message["role"] == "user" else ("小源", 120)
+            lines.append(f"{role}：{text[:limit]}{'…' if len(text) > limit else ''}")
+        blocks.append("\n".join(lines))
+    header = "较早的对话摘要（已压缩）：\n"
+    while blocks:
+        message = {"role": "system", "content": header + "\n".join(blocks)}
+        if message_tokens(message) <= budget:
+            return message, len(blocks)
+        blocks.pop(0)
+    return None, 0
+
+
+class ContextAssembler:
+    """按 token 预算组装发给API的消息
+
+    按优先级填充预算：系统提示词和本次的提示词总是包含；其次是当前代码
+    （超出预算时截断）；然后从最近的一轮开始加入完整的对话，直到预算用完；
+    放不下的更早的对话压缩为一条摘要。消息始终保持时间顺序：
+    系统提示词、当前代码、摘要、最近的对话、本次提示词。
+    """
+
+    def __init__(self, budget=16000, summary_share=0.15):
+        self.budget = budget  # 发送的消息最多使用的 token 数（不含回复）
+        self.summary_share = summary_share  # 需要摘要时为它预留的预算比例
+
+    def assemble(self, system_prompt, prompt, history=(), code=None):
+        """返回 (消息列表, 各部分估计 token 数的报告)"""
+        system = {"role": "system", "content": system_prompt}
+        question = {"role": "user", "content": prompt}
+        report = {"budget": self.budget, "system": message_tokens(system), "prompt": message_tokens(question),
+                  "code": 0, "history": 0, "history_turns": 0, "summary": 0, "summarized_turns": 0}
+        remaining = self.budget - report["system"] - report["prompt"]
+
+        code_message = None
+        if code and code not in prompt:
+            code_message = {"role": "system", "content": "当前代码上下文：\n" + code}
+            if message_tokens(code_message) > remaining:
+                code_message["content"] = truncate_to_tokens(code_message["content"], max(0, remaining - 8))
+            report["code"] = message_tokens(code_message)
+            remaining -= report["code"]
+
+        turns = split_turns(history)
+        recent = self._fit_turns(turns, remaining)
+        summary = None
+        if len(recent) < len(turns):
+            # 放不下全部对话：先为摘要预留预算，再重新放入最近的对话
+            reserve = min(int(self.budget * self.summary_share), max(0, remaining))
+            recent = self._fit_turns(turns, remaining - reserve)
+            history_tokens = sum(message_tokens(message) for turn in recent for message in turn)
+            older = turns[:len(turns) - len(recent)]
+            summary, report["summarized_turns"] = summarize_turns(older, remaining - history_tokens)
+            if summary is not None:
+                report["summary"] = message_tokens(summary)
+
+        messages = [system]
+        if code_message is not None:
+            messages.append(code_message)
+        if summary is not None:
+            messages.append(summary)
+        for turn in recent:
+            messages.extend(turn)
+        messages.append(question)
+
+        report["history"] = sum(message_tokens(message) for turn in recent for message in turn)
+        report["history_turns"] = len(recent)
+        report["total"] = sum(message_tokens(message) for message in messages)
+        report["over_budget"] = report["total"] > self.budget
+        return messages, report
+
+    def _fit_turns(self, turns, budget):
+        """从最近的一轮开始，返回预算内放得下的完整轮次（时间顺序）"""
+        fitted = []
+        for turn in reversed(turns):
+            tokens = sum(message_tokens(message) for message in turn)
+            if tokens > budget:
+                break
+            budget -= tokens
+            fitted.insert(0, turn)
+        return fitted
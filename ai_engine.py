@@ -0,0 +1,161 @@
+import asyncio
+import queue
+import threading
+
+import ai_compiler
+import ai_http
+import ai_scheduler
+
+
+class TkBridge:
+    """把AI引擎线程中的回调转交给Tk主线程执行
+
+    所有回调放进同一个线程安全的队列，主线程在还有未完成的请求时按固定
+    间隔取出执行，不再为每个回调单独调用 root.after。
+    """
+
+    POLL_INTERVAL = 16  # 取出回调的间隔（毫秒）
+
+    def __init__(self, root):
+        self.root = root
+        self.queue = queue.Queue()
+        self.active = 0  # 未完成的请求数
+        self._lock = threading.Lock()
+        self._poll_id = None
+
+    def post(self, callback, *args):
+        """任意线程：安排 callback(*args) 在主线程中执行"""
+        self.queue.put((callback, args))
+
+    def wrap(self, callback):
+        """返回一个在任意线程中调用时都转交给主线程执行的函数"""
+        if callback is None:
+            return None
+        return lambda *args: self.post(callback, *args)
+
+    def begin(self):
+        """开始一个请求（在主线程中调用），确保主线程在请求结束前持续取出回调"""
+        with self._lock:
+            self.active += 1
+        if self._poll_id is None:
+            self._poll_id = self.root.after(self.POLL_INTERVAL, self._poll)
+
+    def end(self):
+        """结束一个请求（在主线程中调用）"""
+        with self._lock:
+            self.active -= 1
+
+    def _poll(self):
+        """主线程：执行队列中的全部回调"""
+        self._poll_id = None
+        while True:
+            try:
+                callback, args = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"AI回调执行失败: {e}")
+        if self.active > 0 or not self.queue.empty():
+            self._poll_id = self.root.after(self.POLL_INTERVAL, self._poll)
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_loop():
+    """所有AI请求共用的 asyncio 事件循环，第一次使用时在后台线程中启动
+
+    异步客户端和连接池只能在创建它们的事件循环中使用，所以AI引擎和
+    SmartAICompiler 的同步入口都在这一个事件循环中执行请求。
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_run_loop, args=(_loop,), daemon=True).start()
+        return _loop
+
+
+def _run_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+class AIEngine:
+    """在一个后台线程的 asyncio 事件循环中执行所有AI请求
+
+    每个请求是事件循环中的一个任务，使用异步客户端，多个请求可以同时
+    进行而不需要各自占用一个线程。请求经过优先级调度器排队，提交后返回
+    可以取消的 RequestHandle。给出 bridge 时，on_chunk / on_done / on_error /
+    on_cancel 回调通过它在Tk主线程中执行。
+    """
+
+    def __init__(self, bridge=None, compiler=None, limits=None, max_running=4):
+        self.bridge = bridge
+        self.compiler = compiler or ai_compiler._global_compiler
+        self.loop = get_loop()
+        self.scheduler = ai_scheduler.Scheduler(self.loop, limits, max_running)
+
+    def submit(self, action, *args, priority=None, on_chunk=None, on_done=None, on_error=None,
+               on_cancel=None, **kwargs):
+        """提交一个AI操作（ai_compiler 中的操作名，如 "analyze"），返回 RequestHandle
+
+        priority 为优先级类别，默认按操作决定；给出 on_chunk 时使用流式返回，
+        每收到一段内容调用一次。有 bridge 时只能在Tk主线程中调用。
+        """
+        request = self.compiler.build_request(action, *args, **kwargs)
+        if priority is None:
+            priority = ai_scheduler.ACTION_PRIORITIES.get(action, "normal")
+        if self.bridge is not None:
+            on_chunk, on_done, on_error, on_cancel = (
+                self.bridge.wrap(callback) for callback in (on_chunk, on_done, on_error, on_cancel))
+            self.bridge.begin()
+        handle = self.scheduler.submit(
+            lambda: self._run(request, on_chunk, on_done, on_error), priority, action)
+        handle.add_done_callback(lambda handle: self._finished(handle, on_cancel))
+        return handle
+
+    async def _run(self, request, on_chunk, on_done, on_error):
+        """事件循环：执行请求并回调"""
+        try:
+            reply = await self.compiler._call_api_async(stream_callback=on_chunk, **request)
+        except Exception as e:
+            print(f"AI请求失败: {e}")
+            if on_error:
+                on_error(e)
+            raise
+        if on_done:
+            on_done(reply)
+        return reply
+
+    def _finished(self, handle, on_cancel):
+        """请求结束（包括排队时被取消）"""
+        if handle.cancelled() and on_cancel:
+            on_cancel()
+        if self.bridge is not None:
+            self.bridge.post(self.bridge.end)
+
+    def cancel_all(self, priority=None):
+        """取消全部排队中和执行中的请求，给出 priority 时只取消该类别的请求"""
+        self.scheduler.cancel_all(priority)
+
+    def warm_up(self):
+        """预先建立事件循环使用的连接"""
+        return asyncio.run_coroutine_threadsafe(ai_http.pool.warm_up_async(self.compiler.base_url), self.loop)
+
+    def shutdown(self, timeout=2.0):
+        """关闭连接并停止共用的事件循环"""
+        global _loop
+        with _loop_lock:
+            if _loop is self.loop:
+                _loop = None
+        if not self.loop.is_running():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(ai_http.pool.aclose(), self.loop).result(timeout)
+        except Exception as e:
+            print(f"关闭AI引擎失败: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,380 @@
+import collections
+import random
+import threading
+import time
+
+import openai
+
+
+def backoff_delay(attempt, base=0.5, cap=8.0):
+    """第 attempt 次重试前的等待时间（秒）：带全抖动的指数退避"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def is_endpoint_error(error):
+    """错误是否由端点引起：超时、连接错误、频率限制、5xx 和认证错误
+
+    只有这些错误计入熔断器、换端点重试；其他 4xx（如 400、404、422）由
+    请求本身引起，换端点也一样会失败。
+    """
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.AuthenticationError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class TokenBucket:
+    """令牌桶：容量为 per_minute，每分钟补满一次（按时间连续补充）"""
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.per_minute, self.tokens + (now - self.updated) * self.per_minute / 60.0)
+        self.updated = now
+
+    def level(self):
+        """当前剩余的令牌数"""
+        self._refill()
+        return self.tokens
+
+    def wait_time(self, amount):
+        """取出 amount 个令牌还需要等待的秒数，超过容量的请求等到桶满即可"""
+        self._refill()
+        amount = min(amount, self.per_minute)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) * 60.0 / self.per_minute
+
+    def take(self, amount):
+        self._refill()
+        self.tokens -= amount
+
+    def refund(self, amount):
+        """按实际用量修正：归还多占用的令牌，amount 为负时补扣少占用的"""
+        self._refill()
+        self.tokens = min(self.per_minute, self.tokens + amount)
+
+
+class CircuitBreaker:
+    """单个端点的熔断器
+
+    closed：正常使用；连续失败达到 failure_threshold 次后变为 open，在
+    reset_timeout 秒内不再向该端点发送请求；之后变为 half_open，只放行一个
+    试探请求，成功则恢复 closed，失败则重新 open。认证失败直接 open，并使用
+    更长的 auth_timeout，避免错误的密钥被反复调用。健康检查失败时等待时间
+    加倍，最长为 auth_timeout。
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0, auth_timeout=600.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.auth_timeout = auth_timeout
+        self.state = "closed"
+        self.failures = 0  # 连续失败次数
+        self.opened_at = 0.0
+        self.timeout = reset_timeout
+        self.trial = False  # half_open 状态下是否已放行试探请求
+        self.auth = False  # 是否因认证失败而打开
+
+    def remaining(self):
+        """open 状态下距离可以再次尝试还有多少秒"""
+        return max(0.0, self.timeout - (time.monotonic() - self.opened_at))
+
+    def available(self):
+        """allow() 是否会放行（不改变状态）"""
+        if self.state == "open":
+            return time.monotonic() - self.opened_at >= self.timeout
+        return self.state == "closed" or not self.trial
+
+    def allow(self):
+        """是否可以向该端点发送请求"""
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.timeout:
+            self.state = "half_open"
+            self.trial = False
+        if self.state == "closed":
+            return True
+        if self.state == "half_open" and not self.trial:
+            self.trial = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.auth = False
+        self.timeout = self.reset_timeout
+
+    def record_probe_failure(self):
+        """健康检查失败：保持 open，下一次检查前的等待时间加倍"""
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.timeout = min(self.timeout * 2, self.auth_timeout)
+
+    def record_failure(self, auth=False):
+        """记录一次失败，返回熔断器是否因此打开"""
+        self.failures += 1
+        if auth or self.state == "half_open" or self.failures >= self.failure_threshold:
+            opened = self.state != "open"
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.timeout = self.auth_timeout if auth else self.reset_timeout
+            self.auth = auth
+            return opened
+        return False
+
+
+class Endpoint:
+    """一个API端点（密钥）及其熔断器、速率限制和延迟、错误统计
+
+    rpm / tpm 为每分钟的请求数和 token 数限制，None 表示不限制。
+    """
+
+    def __init__(self, name, api_key, breaker=None, window=100, rpm=None, tpm=None):
+        self.name = name
+        self.api_key = api_key
+        self.breaker = breaker or CircuitBreaker()
+        self.rpm = self.tpm = None
+        self.request_bucket = self.token_bucket = None
+        self.set_limits(rpm, tpm)
+        self.in_flight = 0  # 正在进行的请求数
+        self.latencies = collections.deque(maxlen=window)  # 最近成功请求的耗时（秒）
+        self.ttfts = collections.deque(maxlen=window)  # 最近流式请求收到第一段内容的耗时（秒）
+        self.hedge_wins = 0  # 作为对冲请求先返回内容的次数
+        self.requests = 0
+        self.successes = 0
+        self.errors = collections.Counter()  # 异常类型名 -> 次数
+        self.last_error = None
+
+    def set_limits(self, rpm=None, tpm=None):
+        """设置速率限制，限制未变时保留令牌桶的状态"""
+        if rpm != self.rpm:
+            self.rpm = rpm
+            self.request_bucket = TokenBucket(rpm) if rpm else None
+        if tpm != self.tpm:
+            self.tpm = tpm
+            self.token_bucket = TokenBucket(tpm) if tpm else None
+
+    def wait_time(self, tokens):
+        """按速率限制，发出一个估计使用 tokens 个 token 的请求还需要等待的秒数"""
+        wait = 0.0
+        if self.request_bucket is not None:
+            wait = self.request_bucket.wait_time(1)
+        if self.token_bucket is not None:
+            wait = max(wait, self.token_bucket.wait_time(tokens))
+        return wait
+
+    def load(self):
+        """负载：正在进行的请求数，其次是请求数和 token 额度的使用比例"""
+        used = 0.0
+        if self.request_bucket is not None:
+            used = max(used, 1 - self.request_bucket.level() / self.rpm)
+        if self.token_bucket is not None:
+            used = max(used, 1 - self.token_bucket.level() / self.tpm)
+        return self.in_flight, used
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        ttfts = sorted(self.ttfts)
+
+        return {
+            "name": self.name,
+            "key": self.api_key[:8] + "..." if self.api_key else None,
+            "state": self.breaker.state,
+            "in_flight": self.in_flight,
+            "rpm": self.rpm,
+            "rpm_left": int(self.request_bucket.level()) if self.request_bucket is not None else None,
+            "tpm": self.tpm,
+            "tpm_left": int(self.token_bucket.level()) if self.token_bucket is not None else None,
+            "requests": self.requests,
+            "successes": self.successes,
+            "failures": sum(self.errors.values()),
+            "error_rate": 1 - self.successes / self.requests if self.requests else 0.0,
+            "errors": dict(self.errors),
+            "last_error": self.last_error,
+            "latency_avg_ms": sum(latencies) / len(latencies) * 1000 if latencies else None,
+            "latency_p50_ms": _ms(percentile(latencies, 0.5)),
+            "latency_p95_ms": _ms(percentile(latencies, 0.95)),
+            "ttft_p50_ms": _ms(percentile(ttfts, 0.5)),
+            "ttft_p95_ms": _ms(percentile(ttfts, 0.95)),
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+def percentile(samples, p):
+    """已排序样本的 p 分位数，没有样本时返回 None"""
+    return samples[min(len(samples) - 1, int(len(samples) * p))] if samples else None
+
+
+def _ms(seconds):
+    return seconds * 1000 if seconds is not None else None
+
+
+class FailoverManager:
+    """API密钥池：在任意数量的端点之间分配请求
+
+    每个请求选择熔断器允许、没有达到速率限制且负载最低的端点，负载相同
+    时按端点的顺序（主API、备用API、其他密钥）选择。每个端点有自己的熔断器，
+    熔断器打开后，等到它的等待时间过去，由后台线程调用 probe(endpoint) 检查
+    端点，probe 不抛出异常即视为恢复，之后新的请求重新分配到该端点；检查
+    失败时等待时间加倍。认证失败的端点不做检查，直到 set_endpoints 换掉密钥。
+    """
+
+    def __init__(self, probe=None, probe_interval=15.0, max_attempts=3):
+        self.probe = probe
+        self.probe_interval = probe_interval  # 后台线程两次查看熔断器状态的最长间隔
+        self.max_attempts = max_attempts  # 一个请求最多尝试的次数（包括第一次）
+        self.endpoints = []
+        self.ttfts = collections.deque(maxlen=100)  # 所有端点最近的首字耗时（秒）
+        self._lock = threading.Lock()
+        self._probe_thread = None
+
+    def set_endpoints(self, keys, rpm=None, tpm=None):
+        """设置端点 [(名称, API密钥), ...] 和每个密钥的速率限制，密钥未变的端点保留统计"""
+        with self._lock:
+            old = {endpoint.api_key: endpoint for endpoint in self.endpoints}
+            endpoints = []
+            for name, api_key in keys:
+                if not api_key or any(endpoint.api_key == api_key for endpoint in endpoints):
+                    continue
+                endpoint = old.get(api_key) or Endpoint(name, api_key)
+                endpoint.name = name
+                endpoint.set_limits(rpm, tpm)
+                endpoints.append(endpoint)
+            self.endpoints = endpoints
+
+    def acquire(self, tokens=0, avoid=None, exclude=None):
+        """选择负载最低的可用端点，占用它的请求和 token 额度
+
+        返回 (端点, 0)；可用的端点都达到速率限制时返回 (None, 需要等待的秒数)；
+        所有端点都已熔断时返回 (None, None)。给出 avoid（刚失败的端点）时优先
+        选择其他端点，给出 exclude 时只在其他端点中选择（不占用 exclude 的
+        额度）。得到的端点用完后必须调用 release。
+        """
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints
+                          if endpoint is not exclude and endpoint.breaker.available()]
+            if not candidates:
+                return None, None
+            waits = [endpoint.wait_time(tokens) for endpoint in candidates]
+            ready = [endpoint for endpoint, wait in zip(candidates, waits) if wait == 0]
+            if not ready:
+                return None, min(waits)
+            ready = [endpoint for endpoint in ready if endpoint is not avoid] or ready
+            endpoint = min(ready, key=lambda endpoint: (endpoint.load(), self.endpoints.index(endpoint)))
+            endpoint.breaker.allow()
+            endpoint.in_flight += 1
+            if endpoint.request_bucket is not None:
+                endpoint.request_bucket.take(1)
+            if endpoint.token_bucket is not None:
+                endpoint.token_bucket.take(tokens)
+            return endpoint, 0.0
+
+    def release(self, endpoint, tokens=0, used=None):
+        """请求结束，used 为实际使用的 token 数（已知时归还多估计的额度）"""
+        with self._lock:
+            endpoint.in_flight -= 1
+            if used is not None and endpoint.token_bucket is not None:
+                endpoint.token_bucket.refund(tokens - used)
+
+    def record_success(self, endpoint, latency):
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.successes += 1
+            endpoint.latencies.append(latency)
+            endpoint.breaker.record_success()
+
+    def record_failure(self, endpoint, error):
+        """记录一次端点失败（见 is_endpoint_error），认证错误直接打开熔断器"""
+        auth = isinstance(error, openai.AuthenticationError)
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.errors[type(error).__name__] += 1
+            endpoint.last_error = str(error)[:200]
+            opened = endpoint.breaker.record_failure(auth)
+        if opened:
+            print(f"API端点 {endpoint.name} 暂停使用: {endpoint.last_error}")
+            self._start_probing()
+
+    def record_error(self, endpoint, error):
+        """记录一次请求出错：端点引起的错误计入熔断器，其他错误只计入统计
+
+        请求本身的错误（如 400）说明端点能正常应答，half_open 的试探请求
+        视为成功；其他异常不能说明端点的状态，放行下一个试探请求。
+        """
+        if is_endpoint_error(error):
+            self.record_failure(endpoint, error)
+            return
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.errors[type(error).__name__] += 1
+            endpoint.last_error = str(error)[:200]
+            if endpoint.breaker.state == "half_open":
+                if isinstance(error, openai.APIStatusError):
+                    endpoint.breaker.record_success()
+                else:
+                    endpoint.breaker.trial = False
+
+    def record_ttft(self, endpoint, ttft, hedged=False):
+        """记录流式请求收到第一段内容的耗时，hedged 表示这是先返回的对冲请求"""
+        with self._lock:
+            endpoint.ttfts.append(ttft)
+            self.ttfts.append(ttft)
+            if hedged:
+                endpoint.hedge_wins += 1
+
+    def hedge_delay(self, p=0.95, default=5.0, min_samples=5):
+        """发出对冲请求前等待的时间：最近首字耗时的 p 分位数，样本不足时为 default"""
+        with self._lock:
+            if len(self.ttfts) < min_samples:
+                return default
+            return percentile(sorted(self.ttfts), p)
+
+    def retry_delay(self, attempt, failed, endpoint):
+        """下一次尝试前的等待时间：换到另一个端点时立即重试，同一端点按退避等待"""
+        return 0.0 if endpoint is not failed else backoff_delay(attempt)
+
+    def stats(self):
+        """各端点的状态、延迟和错误统计"""
+        with self._lock:
+            return [endpoint.stats() for endpoint in self.endpoints]
+
+    def _start_probing(self):
+        if self.probe is None:
+            return
+        with self._lock:
+            if self._probe_thread is not None and self._probe_thread.is_alive():
+                return
+            self._probe_thread = threading.Thread(target=self._probe_loop, daemon=True)
+            self._probe_thread.start()
+
+    def _probe_loop(self):
+        """后台线程：熔断器的等待时间过去后检查端点，直到没有需要检查的端点"""
+        while True:
+            with self._lock:
+                broken = [endpoint for endpoint in self.endpoints
+                          if endpoint.breaker.state != "closed" and not endpoint.breaker.auth]
+                if not broken:
+                    self._probe_thread = None
+                    return
+                # half_open 的端点正在由真实请求试探，不另外检查
+                waiting = [endpoint.breaker.remaining() for endpoint in broken if endpoint.breaker.state == "open"]
+                due = [endpoint for endpoint in broken
+                       if endpoint.breaker.state == "open" and endpoint.breaker.remaining() == 0]
+            if not due:
+                time.sleep(min([self.probe_interval] + waiting))
+                continue
+            for endpoint in due:
+                try:
+                    self.probe(endpoint)
+                except Exception as e:
+                    with self._lock:
+                        endpoint.last_error = str(e)[:200]
+                        if isinstance(e, openai.AuthenticationError):
+                            endpoint.breaker.record_failure(auth=True)
+                        else:
+                            endpoint.breaker.record_probe_failure()
+                    continue
+                with self._lock:
+                    endpoint.breaker.record_success()
+                print(f"API端点 {endpoint.name} 已恢复")
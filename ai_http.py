@@ -0,0 +1,108 @@
+import threading
+import time
+
+import httpx
+
+DEFAULT_BASE_URL = "https://api.deepseek.com/v1"
+
+
+def http2_available():
+    """是否安装了 HTTP/2 支持（h2）"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class ConnectionPool:
+    """按端点共享的长连接 HTTP 客户端
+
+    每个 base_url 只创建一个 httpx.Client，所有API密钥的客户端共用它的
+    连接池，切换密钥或重新设置密钥时不会丢弃已建立的 TCP/TLS 连接。
+    AI引擎的事件循环另外使用一个 httpx.AsyncClient。安装了 h2 时使用 HTTP/2。
+    """
+
+    def __init__(self, timeout=None, limits=None):
+        # 增加超时设置，支持长内容生成
+        self.timeout = timeout or httpx.Timeout(60.0, read=120.0, write=60.0, connect=30.0)
+        self.limits = limits or httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=300.0)
+        self.http2 = http2_available()
+        self.clients = {}
+        self.async_clients = {}
+        self._lock = threading.Lock()
+
+    def get_client(self, base_url):
+        """获取端点对应的 httpx.Client，不存在或已关闭时创建"""
+        key = base_url.rstrip("/")
+        with self._lock:
+            client = self.clients.get(key)
+            if client is None or client.is_closed:
+                client = httpx.Client(timeout=self.timeout, limits=self.limits, http2=self.http2)
+                self.clients[key] = client
+            return client
+
+    def get_async_client(self, base_url):
+        """获取端点对应的 httpx.AsyncClient，只能在同一个事件循环中使用"""
+        key = base_url.rstrip("/")
+        with self._lock:
+            client = self.async_clients.get(key)
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits, http2=self.http2)
+                self.async_clients[key] = client
+            return client
+
+    def warm_up(self, base_url, wait=False):
+        """预先建立到端点的连接（DNS、TCP、TLS），默认在后台线程中进行
+
+        只请求模型列表而不带密钥，返回什么状态码都无所谓，连接会留在池中。
+        """
+        client = self.get_client(base_url)
+
+        def connect():
+            start = time.perf_counter()
+            try:
+                client.get(base_url.rstrip("/") + "/models", timeout=10.0)
+                print(f"AI连接预热完成: {base_url} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+            except Exception as e:
+                print(f"AI连接预热失败: {e}")
+
+        thread = threading.Thread(target=connect, daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+        return thread
+
+    def close(self):
+        """关闭所有连接"""
+        with self._lock:
+            clients, self.clients = list(self.clients.values()), {}
+        for client in clients:
+            try:
+                client.close()
+            except Exception as e:
+                print(f"关闭HTTP连接失败: {e}")
+
+    async def warm_up_async(self, base_url):
+        """warm_up 的异步版本，预热AI引擎事件循环使用的连接"""
+        client = self.get_async_client(base_url)
+        start = time.perf_counter()
+        try:
+            await client.get(base_url.rstrip("/") + "/models", timeout=10.0)
+            print(f"AI连接预热完成: {base_url} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+        except Exception as e:
+            print(f"AI连接预热失败: {e}")
+
+    async def aclose(self):
+        """在AI引擎的事件循环中关闭异步连接"""
+        with self._lock:
+            clients, self.async_clients = list(self.async_clients.values()), {}
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                print(f"关闭HTTP连接失败: {e}")
+
+
+# 全局共享的连接池
+pool = ConnectionPool()
@@ -0,0 +1,141 @@
+import concurrent.futures
+import heapq
+import itertools
+
+# 优先级类别，按优先级从高到低排列
+PRIORITY_CLASSES = ("interactive", "normal", "background")
+
+# 每个类别同时执行的请求数上限
+DEFAULT_LIMITS = {"interactive": 3, "normal": 2, "background": 1}
+
+# 各操作默认的优先级类别
+ACTION_PRIORITIES = {
+    "chat": "interactive",
+    "teach": "interactive",
+    "analyze": "normal",
+    "explain": "normal",
+    "optimize": "normal",
+    "review": "normal",
+    "debug": "normal",
+    "suggest_improvements": "normal",
+    "generate_html": "normal",
+    "generate": "background",
+}
+
+
+class RequestHandle:
+    """一个已提交的AI请求，可以在任意线程中等待结果或取消"""
+
+    def __init__(self, scheduler, priority, action=None):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.action = action
+        self.future = concurrent.futures.Future()
+        self.task = None  # 开始执行后对应的 asyncio 任务
+
+    def cancel(self):
+        """取消请求：排队中的直接移除，执行中的任务被取消，HTTP流随之中断"""
+        self.scheduler.loop.call_soon_threadsafe(self.scheduler._cancel, self)
+
+    def cancelled(self):
+        return self.future.cancelled()
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        """等待并返回结果，请求被取消时抛出 concurrent.futures.CancelledError"""
+        return self.future.result(timeout)
+
+    def add_done_callback(self, callback):
+        """请求结束（完成、失败或取消）后调用 callback(handle)"""
+        self.future.add_done_callback(lambda future: callback(self))
+
+
+class Scheduler:
+    """按优先级调度AI请求
+
+    请求按优先级类别排队，总并发数不超过 max_running，每个类别的并发数
+    不超过各自的上限；有空位时总是先启动优先级最高、最早提交的请求。
+    除 submit 和 RequestHandle.cancel 外，所有方法都在事件循环线程中执行。
+    """
+
+    def __init__(self, loop, limits=None, max_running=4):
+        self.loop = loop
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.max_running = max_running
+        self.pending = []  # 堆：(优先级序号, 提交顺序, 请求, 协程工厂)
+        self.running = {priority: set() for priority in PRIORITY_CLASSES}
+        self._order = itertools.count()
+
+    def submit(self, factory, priority="normal", action=None):
+        """任意线程：提交 factory() 返回的协程，返回 RequestHandle"""
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"未知的优先级类别: {priority}")
+        handle = RequestHandle(self, priority, action)
+        self.loop.call_soon_threadsafe(self._enqueue, handle, factory)
+        return handle
+
+    def handles(self):
+        """排队中和执行中的全部请求"""
+        handles = [item[2] for item in self.pending]
+        for running in self.running.values():
+            handles.extend(running)
+        return handles
+
+    def cancel_all(self, priority=None):
+        """任意线程：取消全部请求，给出 priority 时只取消该类别的请求"""
+        self.loop.call_soon_threadsafe(self._cancel_all, priority)
+
+    def _cancel_all(self, priority):
+        for handle in self.handles():
+            if priority is None or handle.priority == priority:
+                self._cancel(handle)
+
+    def _enqueue(self, handle, factory):
+        if handle.future.done():
+            return
+        heapq.heappush(self.pending, (PRIORITY_CLASSES.index(handle.priority), next(self._order), handle, factory))
+        self._dispatch()
+
+    def _dispatch(self):
+        """在并发上限之内按优先级启动排队的请求"""
+        blocked = []
+        while self.pending and sum(len(running) for running in self.running.values()) < self.max_running:
+            item = heapq.heappop(self.pending)
+            handle = item[2]
+            if len(self.running[handle.priority]) >= self.limits[handle.priority]:
+                # 该类别已满，让后面其他类别的请求先执行
+                blocked.append(item)
+                continue
+            self._start(handle, item[3])
+        for item in blocked:
+            heapq.heappush(self.pending, item)
+
+    def _start(self, handle, factory):
+        self.running[handle.priority].add(handle)
+        handle.task = self.loop.create_task(factory())
+        handle.task.add_done_callback(lambda task: self._finished(handle, task))
+
+    def _finished(self, handle, task):
+        """任务结束：把结果交给 RequestHandle，并启动下一个请求"""
+        self.running[handle.priority].discard(handle)
+        if not handle.future.done():
+            if task.cancelled():
+                handle.future.cancel()
+            elif task.exception() is not None:
+                handle.future.set_exception(task.exception())
+            else:
+                handle.future.set_result(task.result())
+        self._dispatch()
+
+    def _cancel(self, handle):
+        if handle.task is not None:
+            handle.task.cancel()
+            return
+        for i, item in enumerate(self.pending):
+            if item[2] is handle:
+                self.pending.pop(i)
+                heapq.heapify(self.pending)
+                break
+        handle.future.cancel()
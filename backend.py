@@ -1,35 +1,193 @@
 import re
 
+# 语法高亮使用的全部标签
+TAG_NAMES = ("keyword", "string", "comment", "function", "number", "operator", "class_name")
+
 class backEndprocessing:
     def __init__(self):
         self.KeyWordList = ["def","class","import","pass","True","False","for","in","continue","if","else","elif","while","return","and","or","not","None","as","with","from","try","except","finally","raise","lambda","is","global","nonlocal","yield","async","await","print","input"]
         self.Tag = "keyword"  # 设置默认标签
+        self._buildLexer()
+
+    def _buildLexer(self):
+        """编译词法分析使用的组合正则表达式（所有标记一次扫描完成）"""
+        keywords = "|".join(re.escape(k) for k in self.KeyWordList)
+        self._pattern = re.compile(
+            r"(?P<comment>#[^\n]*)"
+            r"|(?P<string>(?P<prefix>\b[rRbBuUfF]{1,2})?(?P<quote>'''|\"\"\"|'|\"))"
+            r"|\b(?P<def>def)[ \t]+(?P<function>\w+)"
+            r"|\b(?P<cls>class)[ \t]+(?P<class_name>\w+)"
+            r"|\b(?P<keyword>" + keywords + r")\b"
+            r"|\b(?P<number>\d+(?:\.\d+)?)\b"
+            r"|\w+"
+        )
+        # 普通字符串的结束位置（跳过转义字符）
+        self._stringEnd = {
+            "'": re.compile(r"(?:[^'\\\n]|\\.)*'"),
+            '"': re.compile(r'(?:[^"\\\n]|\\.)*"'),
+            "'''": re.compile(r"(?:\\.|[^\\])*?'''", re.DOTALL),
+            '"""': re.compile(r'(?:\\.|[^\\])*?"""', re.DOTALL),
+        }
+
+    def _scan(self, text, pos, endpos, tokens):
+        """从pos扫描到endpos，把 (标签, 起始, 结束) 追加到tokens
+
+        返回扫描结束时未闭合字符串的状态：None 或 (引号, 是否f字符串)。
+        """
+        pattern = self._pattern
+        while True:
+            match = pattern.search(text, pos, endpos)
+            if match is None:
+                return None
+            kind = match.lastgroup
+            pos = match.end()
+            if kind == "string":
+                is_f = "f" in (match.group("prefix") or "").lower()
+                pos, state = self._scanString(text, match.start(), pos, match.group("quote"), is_f, endpos, tokens)
+                if state:
+                    return state
+            elif kind == "function":
+                tokens.append(("keyword", match.start("def"), match.end("def")))
+                tokens.append(("function", match.start("function"), pos))
+            elif kind == "class_name":
+                tokens.append(("keyword", match.start("cls"), match.end("cls")))
+                tokens.append(("class_name", match.start("class_name"), pos))
+            elif kind is not None:
+                tokens.append((kind, match.start(), pos))
+
+    def _scanString(self, text, start, body, quote, is_f, endpos, tokens):
+        """扫描字符串字面量，body为开始引号之后的位置
+
+        返回 (结束位置, 状态)，三引号字符串到endpos仍未闭合时状态为 (引号, 是否f字符串)。
+        f字符串 {} 中的表达式按普通代码继续分析。
+        """
+        triple = len(quote) == 3
+        if not is_f:
+            match = self._stringEnd[quote].match(text, body, endpos)
+            if match:
+                tokens.append(("string", start, match.end()))
+                return match.end(), None
+            if triple:
+                tokens.append(("string", start, endpos))
+                return endpos, (quote, False)
+            line_end = text.find("\n", body, endpos)
+            end = endpos if line_end == -1 else line_end
+            tokens.append(("string", start, end))
+            return end, None
+
+        segment = start
+        i = body
+        while i < endpos:
+            char = text[i]
+            if char == "\\":
+                i += 2
+                continue
+            if text.startswith(quote, i):
+                tokens.append(("string", segment, i + len(quote)))
+                return i + len(quote), None
+            if char == "\n" and not triple:
+                break
+            if char == "{":
+                if text.startswith("{", i + 1):
+                    i += 2
+                    continue
+                tokens.append(("string", segment, i + 1))
+                expr_end, close = self._fieldEnd(text, i + 1, endpos, triple)
+                self._scan(text, i + 1, expr_end, tokens)
+                segment = expr_end
+                i = close
+                continue
+            i += 1
+
+        end = min(i, endpos)
+        if end > segment:
+            tokens.append(("string", segment, end))
+        return end, ((quote, True) if triple and end == endpos else None)
+
+    def _fieldEnd(self, text, pos, endpos, multiline):
+        """查找f字符串替换字段中表达式的结束位置，以及右花括号之后的位置"""
+        depth = 0
+        expr_end = None
+        i = pos
+        while i < endpos:
+            char = text[i]
+            if char in "([{":
+                depth += 1
+            elif char in ")]" and depth:
+                depth -= 1
+            elif char == "}":
+                if not depth:
+                    return (i if expr_end is None else expr_end), i + 1
+                depth -= 1
+            elif char in "'\"" and expr_end is None:
+                # 跳过表达式中嵌套的字符串
+                limit = endpos if multiline else text.find("\n", i, endpos)
+                if limit == -1:
+                    limit = endpos
+                close = text.find(char, i + 1, limit)
+                i = limit - 1 if close == -1 else close
+            elif char == "\n" and not multiline:
+                break
+            elif expr_end is None and not depth and (
+                    char == ":" or (char == "!" and not text.startswith("=", i + 1))):
+                # 格式说明和转换标记按字符串显示
+                expr_end = i
+            i += 1
+        return (i if expr_end is None else expr_end), i
+
+    def lexLine(self, line, state=None):
+        """对单行进行词法分析
+
+        state 为上一行行末的状态（None 或未闭合的三引号字符串），
+        返回 (标记元组, 本行行末状态)，标记为 (标签, 起始列, 结束列)。
+        """
+        tokens = []
+        pos = 0
+        if state:
+            quote, is_f = state
+            pos, state = self._scanString(line, 0, 0, quote, is_f, len(line), tokens)
+            if state:
+                return tuple(tokens), state
+        state = self._scan(line, pos, len(line), tokens)
+        return tuple(tokens), state
+
+    def tokenize(self, text):
+        """单遍扫描整段文本，返回按位置排序的 (标签, 起始偏移, 结束偏移) 列表"""
+        tokens = []
+        self._scan(text, 0, len(text), tokens)
+        return tokens
+
+    def collectSpans(self, text):
+        """单遍扫描整段文本，按标签汇总所有高亮区间
+
+        返回 {标签: [起始索引, 结束索引, ...]}，每个标签只需调用一次 tag_add。
+        """
+        spans = {}
+        row = 1
+        row_start = 0
+        last = 0
+        for tag, start, end in self.tokenize(text):
+            indices = spans.setdefault(tag, [])
+            for offset in (start, end):
+                newlines = text.count("\n", last, offset)
+                if newlines:
+                    row += newlines
+                    row_start = text.rfind("\n", last, offset) + 1
+                last = offset
+                indices.append(f"{row}.{offset - row_start}")
+        return spans
 
     def insertColorTag(self, text, parent):
-        """插入颜色标签 - 修复版本"""
+        """插入颜色标签 - 单遍扫描后批量添加"""
         try:
             if not text or not parent:
                 return
                 
-            for p in self.KeyWordList:
-                self._insertColorTag(text, parent, p)
+            for tag, indices in self.collectSpans(text).items():
+                parent.tag_add(self.Tag if tag == "keyword" else tag, *indices)
         except Exception as e:
             print(f"插入颜色标签失败: {e}")
 
-    def _insertColorTag(self, text, parent, pattern):
-        """插入单个颜色标签 - 修复版本"""
-        try:
-            lines = text.split("\n")
-            for i, line in enumerate(lines):
-                # 使用正则表达式查找所有匹配项
-                matches = re.finditer(r'\b' + re.escape(pattern) + r'\b', line)
-                for match in matches:
-                    start_index = f"{i+1}.{match.start()}"
-                    end_index = f"{i+1}.{match.end()}"
-                    parent.tag_add(self.Tag, start_index, end_index)
-        except Exception as e:
-            print(f"插入单个颜色标签失败: {e}")
-
     def setTagKeyWord(self, tag_name):
         """设置标签关键字"""
         self.Tag = tag_name
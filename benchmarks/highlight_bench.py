@@ -0,0 +1,352 @@
+"""语法高亮性能测试
+
+生成 Python、HTML、Markdown 合成语料（默认 1k 到 200k 行），分别测量：
+
+- lex：词法分析器逐行分析整段文本（不访问Text组件）
+- full_highlight：同步增量高亮器首次高亮整段文本
+- background_highlight：后台线程高亮器（编辑器实际使用的）从提交到标签全部执行完
+- keystroke：在随机位置输入一个字符后重新高亮
+- scroll：滚动到随机位置后补齐可见区域的标签
+
+需要图形环境，无显示器时在 Xvfb 下运行：
+
+    xvfb-run -a python benchmarks/highlight_bench.py --output results.json
+
+结果以 JSON 输出，便于比较不同版本的高亮器。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tkinter as tk
+from tkinter import scrolledtext
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backend
+import edit_events
+import highlighter
+import lexers
+
+DEFAULT_SIZES = (1000, 10000, 50000, 200000)
+LANGUAGES = ("python", "html", "markdown")
+WORDS = ["alpha", "beta", "gamma", "delta", "value", "result", "items", "config", "buffer", "index"]
+
+
+def python_corpus(line_count, seed=0):
+    """生成指定行数的 Python 代码"""
+    rng = random.Random(seed)
+    lines = ["import os", "import sys", ""]
+    while len(lines) < line_count:
+        name = rng.choice(WORDS)
+        kind = rng.randrange(4)
+        if kind == 0:
+            lines += [
+                f"class {name.title()}{len(lines)}(object):",
+                f'    """{name} 的文档字符串',
+                "",
+                "    多行字符串会跨行保持词法状态。",
+                '    """',
+                "",
+                f"    def __init__(self, {name}=None):",
+                f"        self.{name} = {name}  # 保存参数",
+                "",
+            ]
+        elif kind == 1:
+            lines += [
+                f"def {name}_{len(lines)}(items, limit={rng.randrange(100)}):",
+                "    total = 0",
+                "    for item in items:",
+                f"        if item > {rng.random():.3f} and item < limit:",
+                "            total += item * 2",
+                f"    return total, '{name}', \"done\"",
+                "",
+            ]
+        elif kind == 2:
+            lines += [
+                f"# {name} 注释 {rng.randrange(1000)}",
+                f"{name}_table = {{'key': {rng.randrange(1000)}, 'name': \"{name}\"}}",
+                f"print(f\"{{{name}_table['key']}} {name}\", len({name}_table))",
+            ]
+        else:
+            lines += [
+                "try:",
+                f"    value = int(os.environ.get('{name.upper()}', '0'))",
+                "except ValueError as e:",
+                "    value = None",
+                "",
+            ]
+    return "\n".join(lines[:line_count])
+
+
+def html_corpus(line_count, seed=0):
+    """生成指定行数的 HTML，包含内嵌的 <script> 和 <style>"""
+    rng = random.Random(seed)
+    lines = ["<!DOCTYPE html>", "<html>", "<head>", '<meta charset="utf-8">', "</head>", "<body>"]
+    while len(lines) < line_count - 2:
+        name = rng.choice(WORDS)
+        kind = rng.randrange(4)
+        if kind == 0:
+            lines += [
+                f'<div class="{name}" id="{name}-{len(lines)}">',
+                f"  <p>{name} &amp; {rng.choice(WORDS)} 段落文本</p>",
+                f'  <a href="https://example.com/{name}" target=\'_blank\'>{name}</a>',
+                "</div>",
+            ]
+        elif kind == 1:
+            lines += [
+                "<script>",
+                f"function {name}(items) {{",
+                f"  const total = items.reduce((a, b) => a + b, {rng.randrange(10)});",
+                f"  return `{name}: ${{total}}`; // 注释",
+                "}",
+                "</script>",
+            ]
+        elif kind == 2:
+            lines += [
+                "<style>",
+                f".{name} > p:hover {{",
+                f"  color: #{rng.randrange(0x1000000):06x};",
+                f"  margin: {rng.randrange(20)}px 0 !important;",
+                "}",
+                "</style>",
+            ]
+        else:
+            lines += [
+                "<!--",
+                f"  {name} 注释",
+                "-->",
+            ]
+    lines += ["</body>", "</html>"]
+    return "\n".join(lines[:line_count])
+
+
+def markdown_corpus(line_count, seed=0):
+    """生成指定行数的 Markdown，包含围栏代码块"""
+    rng = random.Random(seed)
+    lines = []
+    while len(lines) < line_count:
+        name = rng.choice(WORDS)
+        kind = rng.randrange(4)
+        if kind == 0:
+            lines += [
+                f"## {name.title()} {len(lines)}",
+                "",
+                f"这是关于 **{name}** 的一段说明，包含 *强调*、`行内代码` 和 [链接](https://example.com/{name})。",
+                "",
+            ]
+        elif kind == 1:
+            lines += [
+                f"- {name} 列表项",
+                f"- {rng.choice(WORDS)} 列表项",
+                f"1. 第 {rng.randrange(10)} 项",
+                "",
+            ]
+        elif kind == 2:
+            lines += [
+                "```python",
+                f"def {name}():",
+                f"    return {rng.randrange(100)}",
+                "```",
+                "",
+            ]
+        else:
+            lines += [
+                f"> {name} 引用",
+                "",
+                "---",
+                "",
+            ]
+    return "\n".join(lines[:line_count])
+
+
+CORPORA = {"python": python_corpus, "html": html_corpus, "markdown": markdown_corpus}
+
+
+def get_processor(language):
+    """获取语言对应的词法分析器"""
+    if language == "python":
+        return backend.backEndprocessing()
+    return lexers.get_lexer(language)
+
+
+def summarize(samples):
+    """把多次测量的耗时（秒）汇总为毫秒统计"""
+    samples = sorted(samples)
+    return {
+        "runs": len(samples),
+        "mean_ms": statistics.mean(samples) * 1000,
+        "median_ms": statistics.median(samples) * 1000,
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+        "max_ms": samples[-1] * 1000,
+    }
+
+
+class Bench:
+    """在一个Text组件上测量各项高亮耗时"""
+
+    def __init__(self, root, repeat, seed):
+        self.root = root
+        self.repeat = repeat
+        self.rng = random.Random(seed)
+        self.frame = None
+        self.text = None
+        self.bus = None
+
+    def new_editor(self, content):
+        """创建与编辑器相同配置的Text组件并填入文本"""
+        if self.frame is not None:
+            self.bus.close()
+            self.frame.destroy()
+        self.frame = tk.Frame(self.root)
+        self.frame.pack(fill=tk.BOTH, expand=True)
+        self.text = scrolledtext.ScrolledText(self.frame, wrap=tk.WORD, font=("Consolas", 12))
+        self.text.pack(fill=tk.BOTH, expand=True)
+        for tag in backend.TAG_NAMES:
+            self.text.tag_configure(tag, foreground="#0000FF")
+        self.text.insert("1.0", content)
+        self.bus = edit_events.EditEventBus(self.text)
+        self.root.update()
+        return self.text
+
+    def settle(self):
+        """处理完所有待执行的空闲回调"""
+        self.root.update_idletasks()
+        self.root.update_idletasks()
+
+    def measure_lex(self, processor, content):
+        """只测词法分析"""
+        samples = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            state = None
+            for line in content.split("\n"):
+                _, state = processor.lexLine(line, state)
+            samples.append(time.perf_counter() - start)
+        return summarize(samples)
+
+    def measure_full(self, processor, content):
+        """同步增量高亮器首次高亮"""
+        samples = []
+        for _ in range(self.repeat):
+            self.new_editor(content)
+            hl = highlighter.IncrementalHighlighter(self.text, processor, edit_bus=self.bus)
+            start = time.perf_counter()
+            hl.refresh(content)
+            self.settle()
+            samples.append(time.perf_counter() - start)
+        return summarize(samples), hl
+
+    def measure_background(self, processor, content):
+        """后台线程高亮器：从提交到标签全部执行完"""
+        samples = []
+        for _ in range(self.repeat):
+            self.new_editor(content)
+            hl = highlighter.BackgroundHighlighter(self.text, processor, edit_bus=self.bus)
+            start = time.perf_counter()
+            hl.refresh(content)
+            while hl._inflight or hl._applying is not None:
+                self.root.update()
+                time.sleep(0.0005)
+            samples.append(time.perf_counter() - start)
+            hl.close()
+        return summarize(samples)
+
+    def measure_keystroke(self, hl, line_count):
+        """在随机位置输入一个字符后重新高亮（包括插入本身）"""
+        samples = []
+        for _ in range(self.repeat * 10):
+            line = self.rng.randrange(line_count) + 1
+            self.text.see(f"{line}.0")
+            self.settle()
+            hl.refresh()
+            self.settle()
+            start = time.perf_counter()
+            self.text.insert(f"{line}.0", "x")
+            hl.refresh()
+            self.settle()
+            samples.append(time.perf_counter() - start)
+        return summarize(samples)
+
+    def measure_scroll(self, hl, line_count):
+        """滚动到随机位置后补齐可见区域的标签"""
+        samples = []
+        for _ in range(self.repeat * 10):
+            line = self.rng.randrange(line_count) + 1
+            start = time.perf_counter()
+            self.text.see(f"{line}.0")
+            self.settle()
+            samples.append(time.perf_counter() - start)
+        return summarize(samples)
+
+    def run(self, language, line_count, seed):
+        """测量一种语言、一种行数的全部指标"""
+        content = CORPORA[language](line_count, seed)
+        processor = get_processor(language)
+        result = {"language": language, "lines": line_count, "chars": len(content)}
+        result["lex"] = self.measure_lex(processor, content)
+        result["full_highlight"], hl = self.measure_full(processor, content)
+        result["viewport_mode"] = hl.viewport_active
+        result["scroll"] = self.measure_scroll(hl, line_count)
+        result["keystroke"] = self.measure_keystroke(hl, line_count)
+        result["background_highlight"] = self.measure_background(processor, content)
+        return result
+
+
+def git_revision():
+    """当前代码的 git 版本，获取失败时返回 None"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="语法高亮性能测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="语料行数")
+    parser.add_argument("--languages", nargs="+", choices=LANGUAGES, default=list(LANGUAGES), help="测试的语言")
+    parser.add_argument("--repeat", type=int, default=3, help="整段高亮的重复次数（按键和滚动为其10倍）")
+    parser.add_argument("--seed", type=int, default=0, help="生成语料和随机位置的种子")
+    parser.add_argument("--output", help="结果写入的 JSON 文件，默认输出到标准输出")
+    args = parser.parse_args(argv)
+
+    root = tk.Tk()
+    root.geometry("1000x700")
+    bench = Bench(root, args.repeat, args.seed)
+    results = []
+    try:
+        for language in args.languages:
+            for line_count in args.sizes:
+                print(f"测试 {language} {line_count} 行...", file=sys.stderr)
+                results.append(bench.run(language, line_count, args.seed))
+    finally:
+        root.destroy()
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "tk": str(tk.TkVersion),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "seed": args.seed,
+        "results": results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -72,8 +72,8 @@ class BrowserTabSystem:
             text_widget.tag_configure("keyword", foreground="blue", 
                                     font=("Consolas", 12, "bold"))
             
-            # 绑定语法高亮
-            text_widget.bind("<KeyRelease>", lambda e: self.code_editor_ref.apply_syntax_highlighting())
+            # 文本被修改时更新语法高亮
+            self.watch_editor(text_widget, None)
             
         elif tab_type == "html":
             # HTML编辑器 - 分屏显示
@@ -88,6 +88,7 @@ class BrowserTabSystem:
             html_editor = scrolledtext.ScrolledText(left_frame, wrap=tk.WORD,
                                                   font=("Consolas", 11))
             html_editor.pack(fill=tk.BOTH, expand=True, padx=2, pady=2)
+            self.configure_highlight_tags(html_editor)
             
             # 右侧预览
             right_frame = ttk.Frame(html_frame)
@@ -107,9 +108,9 @@ class BrowserTabSystem:
             
             text_widget = html_editor
             
-            # 绑定实时预览
-            html_editor.bind("<KeyRelease>", 
-                           lambda e: self.refresh_html_preview(html_editor, html_preview))
+            # 文本被修改时更新实时预览和语法高亮
+            self.watch_editor(html_editor, "html",
+                              lambda: self.refresh_html_preview(html_editor, html_preview))
             
         elif tab_type == "markdown":
             # Markdown编辑器 - 分屏显示
@@ -124,6 +125,7 @@ class BrowserTabSystem:
             md_editor = scrolledtext.ScrolledText(left_frame, wrap=tk.WORD,
                                                 font=("Consolas", 11))
             md_editor.pack(fill=tk.BOTH, expand=True, padx=2, pady=2)
+            self.configure_highlight_tags(md_editor)
             
             # 右侧HTML预览
             right_frame = ttk.Frame(md_frame)
@@ -143,9 +145,9 @@ class BrowserTabSystem:
             
             text_widget = md_editor
             
-            # 绑定实时预览
-            md_editor.bind("<KeyRelease>", 
-                         lambda e: self.refresh_markdown_preview(md_editor, md_preview))
+            # 文本被修改时更新实时预览和语法高亮
+            self.watch_editor(md_editor, "markdown",
+                              lambda: self.refresh_markdown_preview(md_editor, md_preview))
         
         # 隐藏所有内容区域
         content_area.pack_forget()
@@ -173,6 +175,40 @@ class BrowserTabSystem:
         
         return tab_id
     
+    def watch_editor(self, text_widget, tab_type, refresh_preview=None):
+        """订阅编辑框的编辑事件，只有文本真正被修改时才刷新预览和语法高亮
+
+        同一轮事件循环中的多次修改合并为一次处理；tab_type 为 None 时自动检测文件类型。
+        """
+        pending = {"scheduled": False}
+        
+        def on_idle():
+            pending["scheduled"] = False
+            if not text_widget.winfo_exists():
+                # 标签页已关闭
+                return
+            if refresh_preview is not None:
+                refresh_preview()
+            if self.code_editor_ref.code_text is text_widget:
+                self.code_editor_ref.apply_syntax_highlighting(tab_type)
+        
+        def on_edit(start, end, text, version):
+            if not pending["scheduled"]:
+                pending["scheduled"] = True
+                text_widget.after_idle(on_idle)
+        
+        self.code_editor_ref.get_edit_bus(text_widget).subscribe(on_edit)
+    
+    def configure_highlight_tags(self, text_widget):
+        """配置语法高亮使用的标签"""
+        text_widget.tag_configure("keyword", foreground="blue", font=("Consolas", 11, "bold"))
+        text_widget.tag_configure("string", foreground="#A31515")
+        text_widget.tag_configure("comment", foreground="#008000", font=("Consolas", 11, "italic"))
+        text_widget.tag_configure("function", foreground="#795E26")
+        text_widget.tag_configure("number", foreground="#098658")
+        text_widget.tag_configure("operator", foreground="#AF00DB")
+        text_widget.tag_configure("class_name", foreground="#267F99", font=("Consolas", 11, "bold"))
+    
     def switch_tab(self, tab_id):
         """切换到指定标签页"""
         # 隐藏当前标签内容
@@ -190,9 +226,8 @@ class BrowserTabSystem:
             current_text_widget = self.tabs[tab_id]['text_widget']
             self.code_editor_ref.code_text = current_text_widget
             
-            # 应用语法高亮
-            if self.tabs[tab_id]['type'] == 'python':
-                self.code_editor_ref.apply_syntax_highlighting()
+            # 应用语法高亮（按标签类型选择词法分析器）
+            self.code_editor_ref.apply_syntax_highlighting(self.tabs[tab_id]['type'])
     
     def close_tab(self, tab_id):
         """关闭标签页"""
@@ -286,8 +321,7 @@ class BrowserTabSystem:
         self.tabs[tab_id]['modified'] = False
         
         # 应用语法高亮
-        if tab_type == 'python':
-            self.code_editor_ref.apply_syntax_highlighting()
+        self.code_editor_ref.apply_syntax_highlighting(tab_type)
         
         # 如果是HTML或Markdown，刷新预览
         if tab_type == 'html':
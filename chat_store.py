@@ -0,0 +1,44 @@
+import collections
+
+
+class ChatStore:
+    """聊天消息存储
+
+    聊天显示只保留最近的一部分消息，全部消息保存在这里，向上滚动时从
+    这里取出较早的消息重新显示。每条消息是一组 (文本, 标签) 段，按显示
+    顺序排列，标签为 None 表示不带标签。消息编号从0开始递增，超过
+    max_messages 条时丢弃最早的消息，编号不变。不加锁，只在Tk主线程中使用。
+    """
+
+    def __init__(self, max_messages=5000):
+        self.messages = collections.deque(maxlen=max_messages)
+        self.next_id = 0  # 下一条消息的编号
+
+    @property
+    def first_id(self):
+        """存储中最早一条消息的编号"""
+        return self.next_id - len(self.messages)
+
+    def add(self, segments):
+        """保存一条消息，返回它的编号"""
+        self.messages.append(list(segments))
+        self.next_id += 1
+        return self.next_id - 1
+
+    def update(self, message_id, segments):
+        """替换一条消息的内容（流式回复结束时保存完整内容）"""
+        if self.first_id <= message_id < self.next_id:
+            self.messages[message_id - self.first_id] = list(segments)
+
+    def get(self, message_id):
+        """消息的全部段，已丢弃的消息返回空列表"""
+        if self.first_id <= message_id < self.next_id:
+            return self.messages[message_id - self.first_id]
+        return []
+
+    def size(self, message_id):
+        """消息的字符数"""
+        return sum(len(text) for text, tag in self.get(message_id))
+
+    def __len__(self):
+        return len(self.messages)
@@ -0,0 +1,125 @@
+class EditEventBus:
+    """编辑事件总线
+
+    在Tcl层把Text组件的命令替换为代理：insert/delete/replace 以及
+    edit undo/redo 照常执行，执行完后向订阅者发布
+    (起始索引, 结束索引, 插入的文本, 版本号)。
+
+    起始和结束索引是被替换区域在修改前的位置（插入时两者相同，删除时
+    插入的文本为空）。撤销/重做无法得知具体范围，按整段文本被替换发布。
+    不修改文本的按键不会产生任何事件。
+    """
+
+    def __init__(self, text_widget):
+        self.text = text_widget
+        self.version = 0
+        self.listeners = []
+        self._widget = str(text_widget)
+        self._orig = self._widget + "_orig"
+        self.text.tk.call("rename", self._widget, self._orig)
+        self.text.tk.createcommand(self._widget, self._dispatch)
+        self.text.bind("<Destroy>", self._on_destroy, add="+")
+
+    def subscribe(self, listener):
+        """订阅编辑事件，listener(start, end, text, version) 在文本修改后调用"""
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        """取消订阅"""
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def close(self):
+        """移除代理，恢复原始的组件命令"""
+        if self._orig is None:
+            return
+        try:
+            self.text.tk.deletecommand(self._widget)
+            self.text.tk.call("rename", self._orig, self._widget)
+        except Exception as e:
+            print(f"移除编辑事件代理失败: {e}")
+        self._orig = None
+
+    def _on_destroy(self, event=None):
+        """组件销毁时原始命令已被删除，只需清理代理命令"""
+        if event is not None and str(event.widget) != self._widget:
+            return
+        try:
+            self.text.tk.deletecommand(self._widget)
+        except Exception:
+            pass
+        self._orig = None
+        self.listeners = []
+
+    def _call(self, *args):
+        """调用原始的组件命令"""
+        return self.text.tk.call(self._orig, *args)
+
+    def _dispatch(self, *args):
+        """代理组件命令，修改文本的命令执行后发布事件"""
+        command = args[0] if args else ""
+        if command not in ("insert", "delete", "replace", "edit"):
+            return self._call(*args)
+        if command == "edit" and args[1:2] not in (("undo",), ("redo",)):
+            return self._call(*args)
+        if str(self._call("cget", "-state")) == "disabled":
+            return self._call(*args)
+
+        if command == "insert":
+            start = self._index(args[1])
+            result = self._call(*args)
+            inserted = "".join(args[2::2])
+            if inserted:
+                self._publish(start, start, inserted)
+        elif command == "delete":
+            ranges = self._ranges(args[1:])
+            result = self._call(*args)
+            for start, end in ranges:
+                self._publish(start, end, "")
+        elif command == "replace":
+            start = self._index(args[1])
+            end = self._index(args[2])
+            result = self._call(*args)
+            self._publish(start, end, "".join(args[3::2]))
+        else:
+            end = self._index("end-1c")
+            result = self._call(*args)
+            self._publish("1.0", end, str(self._call("get", "1.0", "end-1c")))
+        return result
+
+    def _index(self, index):
+        """把索引规范为 "行.列"，超过文本末尾时取最后一个换行符之前的位置"""
+        position = str(self._call("index", index))
+        last = str(self._call("index", "end-1c"))
+        return last if self._key(position) > self._key(last) else position
+
+    def _key(self, index):
+        """把 "行.列" 转换为可比较的元组"""
+        row, col = index.split(".")
+        return int(row), int(col)
+
+    def _ranges(self, indices):
+        """解析 delete 的参数，返回按位置从后往前排列的非空区间"""
+        ranges = []
+        for i in range(0, len(indices), 2):
+            start = self._index(indices[i])
+            if i + 1 < len(indices):
+                end = self._index(indices[i + 1])
+            else:
+                end = self._index(f"{start}+1c")
+            if self._key(start) < self._key(end):
+                ranges.append((start, end))
+        if len(ranges) > 1:
+            # 从后往前发布，每个事件的位置在前一个事件之后的文本中仍然有效
+            ranges.sort(key=lambda item: self._key(item[0]), reverse=True)
+        return ranges
+
+    def _publish(self, start, end, text):
+        """发布一次编辑事件"""
+        self.version += 1
+        for listener in list(self.listeners):
+            try:
+                listener(start, end, text, self.version)
+            except Exception as e:
+                print(f"编辑事件处理失败: {e}")
@@ -0,0 +1,594 @@
+import queue
+import threading
+import time
+
+import backend
+
+
+class IncrementalHighlighter:
+    """增量语法高亮器
+
+    按行缓存词法分析结果和行末状态，文本变化时只从第一处修改的行开始
+    重新分析，直到行末状态与缓存一致为止，并且只重新设置标记真正发生
+    变化的行上的标签。
+
+    行数很多时切换为视口模式：只分析到可见区域为止，只给可见行及上下
+    margin 行加标签，滚动时再逐步扩展，离开视口的标签在超出预算后移除。
+
+    分析（compute）只读写缓存并给出标签操作列表，不访问Text组件；
+    操作列表由 _execute 在主线程中执行。给出编辑事件总线时，用事件报告的
+    修改范围限定首尾未变化行的比较。
+    """
+
+    VIEWPORT_THRESHOLD = 20000  # 超过该行数时自动启用视口模式
+    VIEWPORT_MARGIN = 100       # 可见区域上下额外高亮的行数
+    TAGGED_LINE_BUDGET = 3000   # 视口模式下最多保留标签的行数
+    APPLY_BATCH = 500           # 每次批量设置标签的最大行数
+
+    def __init__(self, text_widget, processor=None, viewport_mode=None,
+                 margin=None, line_budget=None, edit_bus=None):
+        self.text = text_widget
+        self.processor = processor or backend.backEndprocessing()
+        self.lines = []   # 缓存的每行文本
+        self.tokens = []  # 每行的标记 (标签, 起始列, 结束列)，视口模式下只覆盖已分析的前缀
+        self.states = []  # 每行行末的词法状态
+        self.dirty = set()  # 标签状态未知、需要重新设置的行
+        self._hint = None   # 上次分析后被修改的范围 (首行, 末尾未修改的行数)
+
+        # 视口模式配置：viewport_mode 为 None 时按行数自动选择
+        self.viewport_mode = viewport_mode
+        self.margin = self.VIEWPORT_MARGIN if margin is None else margin
+        self.line_budget = self.TAGGED_LINE_BUDGET if line_budget is None else line_budget
+        self.viewport_active = False
+        self.tagged = set()  # 视口模式下当前带有标签的行
+        self._viewport_pending = False
+        self.scroll_listeners = []  # 视口模式下滚动时调用的回调（如语义高亮器）
+        self._watch_scroll()
+        self.edit_bus = edit_bus
+        if edit_bus is not None:
+            edit_bus.subscribe(self._on_edit)
+
+    def reset(self):
+        """清空缓存并移除所有高亮标签"""
+        if self.lines:
+            self._remove_tags(0, None)
+        self._clear()
+        self._hint = None
+
+    def refresh(self, text=None):
+        """根据当前文本增量更新高亮"""
+        if text is None:
+            text = self.text.get("1.0", "end-1c")
+        hint, self._hint = self._hint, None
+        self._execute(self.compute(text, self._window(), hint))
+
+    def compute(self, text, window=None, hint=None):
+        """分析新文本并更新缓存，返回需要执行的标签操作列表
+
+        不访问Text组件，可以在后台线程中调用。window 为 _window() 的结果，
+        只在视口模式下使用；hint 为 (首行, 末尾未修改的行数)，表示相对缓存
+        文本确定没有修改的范围，为 None 时逐行比较。操作为
+        ("apply", 行号, 标记) 或 ("remove", 首行, 末行)，末行为 None 表示
+        直到文本末尾。
+        """
+        new_lines = text.split("\n")
+        ops = []
+
+        viewport = self._use_viewport(len(new_lines))
+        if viewport != self.viewport_active:
+            if self.lines:
+                ops.append(("remove", 0, None))
+            self._clear()
+            self.viewport_active = viewport
+
+        old_lines = self.lines
+        old_count = len(old_lines)
+        new_count = len(new_lines)
+
+        # 找出首尾未变化的行，中间部分即为被编辑的区域
+        limit = min(old_count, new_count)
+        first = min(hint[0], limit) if hint else 0
+        while first < limit and old_lines[first] == new_lines[first]:
+            first += 1
+        if first == old_count == new_count:
+            if self.viewport_active:
+                return ops + self._viewport_ops(window)
+            return ops + self._apply_ops(self._take_dirty([]))
+        tail = min(hint[1], limit - first) if hint else 0
+        while tail < limit - first and old_lines[old_count - 1 - tail] == new_lines[new_count - 1 - tail]:
+            tail += 1
+        single_line_edit = old_count - tail - first == 1 and new_count - tail - first == 1
+        if not single_line_edit:
+            # 跨行编辑时，边界行即使文本相同也可能拼接了其他行的字符（连同标签），一并重新处理
+            first = max(0, first - 1)
+            tail = max(0, tail - 1)
+        old_end = old_count - tail
+        new_end = new_count - tail
+        shift = new_end - old_end
+
+        lex_limit = new_count
+        if self.viewport_active:
+            lex_limit = min(new_count, self._clamp(window, new_count)[1] + 1)
+
+        old_lexed = len(self.tokens)
+        start = min(first, old_lexed)
+        tokens = self.tokens[:start]
+        states = self.states[:start]
+        state = states[-1] if states else None
+        changed = []
+
+        line_no = start
+        while line_no < lex_limit:
+            if first <= line_no < new_end:
+                line_tokens, state = self.processor.lexLine(new_lines[line_no], state)
+                if not single_line_edit or line_no >= old_lexed or line_tokens != self._shift_tokens(
+                        self.tokens[line_no], old_lines[line_no], new_lines[line_no]):
+                    changed.append((line_no, line_tokens))
+            else:
+                old_no = line_no if line_no < first else line_no - shift
+                if old_no < old_lexed:
+                    # 未修改的行：进入状态与缓存一致时，后续结果都可以直接复用
+                    old_state = self.states[old_no - 1] if old_no else None
+                    if state == old_state:
+                        tokens.extend(self.tokens[old_no:])
+                        states.extend(self.states[old_no:])
+                        break
+                    line_tokens, state = self.processor.lexLine(new_lines[line_no], state)
+                    if line_tokens != self.tokens[old_no]:
+                        changed.append((line_no, line_tokens))
+                else:
+                    line_tokens, state = self.processor.lexLine(new_lines[line_no], state)
+                    changed.append((line_no, line_tokens))
+            tokens.append(line_tokens)
+            states.append(state)
+            line_no += 1
+
+        self.lines = new_lines
+        self.tokens = tokens
+        self.states = states
+        self.dirty = self._shift_lines(self.dirty, first, old_end, shift, single_line_edit)
+
+        if not self.viewport_active:
+            return ops + self._apply_ops(self._take_dirty(changed))
+
+        # 视口模式：标签随文本移动，按编辑位置调整已加标签的行号
+        kept_edit_line = single_line_edit and first in self.tagged
+        tagged = self._shift_lines(self.tagged, first, old_end, shift, kept_edit_line)
+        if not kept_edit_line and new_end > first:
+            ops.append(("remove", first, new_end - 1))
+        stale = [line_no for line_no in tagged if line_no >= len(tokens)]
+        ops.extend(self._remove_ops(stale))
+        tagged.difference_update(stale)
+        self.tagged = tagged
+
+        top, bottom = self._clamp(window, new_count)
+        changed = [(line_no, line_tokens) for line_no, line_tokens in changed
+                   if line_no in tagged or top <= line_no <= bottom]
+        ops.extend(self._apply_ops(self._take_dirty(changed)))
+        ops.extend(self._viewport_ops(window))
+        return ops
+
+    def _on_edit(self, start, end, text, version):
+        """编辑事件：累计自上次分析以来被修改的行范围"""
+        first = int(start.split(".")[0]) - 1
+        last = first + text.count("\n")
+        tail = int(self.text.index("end-1c").split(".")[0]) - 1 - last
+        if self._hint is not None:
+            first = min(first, self._hint[0])
+            tail = min(tail, self._hint[1])
+        self._hint = (first, tail)
+
+    def _clear(self):
+        """清空分析缓存"""
+        self.lines = []
+        self.tokens = []
+        self.states = []
+        self.tagged = set()
+        self.dirty = set()
+
+    def _use_viewport(self, line_count):
+        """判断是否使用视口模式"""
+        if self.viewport_mode is None:
+            return line_count > self.VIEWPORT_THRESHOLD
+        return self.viewport_mode
+
+    def _window(self):
+        """返回可见区域（含上下margin）的首末行号，从0开始，获取失败时返回 None"""
+        try:
+            top = int(self.text.index("@0,0").split(".")[0]) - 1
+            bottom = int(self.text.index(f"@0,{self.text.winfo_height()}").split(".")[0]) - 1
+        except Exception as e:
+            print(f"获取可见区域失败: {e}")
+            return None
+        return max(0, top - self.margin), bottom + self.margin
+
+    def viewport_window(self):
+        """视口模式下返回正在高亮的可见区域（含上下margin）的首末行号，从0开始；否则返回 None"""
+        if not self.viewport_active:
+            return None
+        return self._window()
+
+    def _clamp(self, window, line_count=None):
+        """把可见区域限制在文本行数之内"""
+        if line_count is None:
+            line_count = len(self.lines)
+        if window is None:
+            return 0, -1
+        top, bottom = window
+        return top, max(0, min(line_count - 1, bottom))
+
+    def _watch_scroll(self):
+        """在滚动条回调中挂接视口更新"""
+        vbar = getattr(self.text, "vbar", None)
+        if vbar is None:
+            return
+
+        def on_scroll(first, last):
+            vbar.set(first, last)
+            if self.viewport_active and not self._viewport_pending:
+                self._viewport_pending = True
+                self.text.after_idle(self._sync_viewport)
+            if self.viewport_active:
+                for listener in self.scroll_listeners:
+                    listener()
+
+        self.text.configure(yscrollcommand=on_scroll)
+
+    def _sync_viewport(self):
+        """滚动后补齐可见区域的分析和标签"""
+        self._viewport_pending = False
+        if not self.viewport_active or not self.lines:
+            return
+        window = self._window()
+        if window is not None and self._in_sync(window):
+            self._execute(self._viewport_ops(window))
+
+    def _in_sync(self, window):
+        """文本自上次分析后是否没有被修改
+
+        插入文本本身就会触发滚动回调，此时可能还没有调用 refresh；只要行数
+        和可见区域内的行都与缓存一致，按缓存的行号加标签就是正确的。
+        """
+        try:
+            if int(self.text.index("end-1c").split(".")[0]) != len(self.lines):
+                return False
+            top, bottom = self._clamp(window)
+            return self.text.get(f"{top + 1}.0", f"{bottom + 1}.end") == "\n".join(self.lines[top:bottom + 1])
+        except Exception as e:
+            print(f"检查文本状态失败: {e}")
+            return False
+
+    def _viewport_ops(self, window):
+        """视口模式下补齐可见区域的分析和标签，并按预算丢弃远处的标签"""
+        if not self.viewport_active or not self.lines or window is None:
+            return []
+        top, bottom = self._clamp(window)
+
+        # 按需向后扩展已分析的前缀
+        state = self.states[-1] if self.states else None
+        for line_no in range(len(self.tokens), bottom + 1):
+            line_tokens, state = self.processor.lexLine(self.lines[line_no], state)
+            self.tokens.append(line_tokens)
+            self.states.append(state)
+
+        ops = self._apply_ops(self._take_dirty(
+            [(line_no, self.tokens[line_no]) for line_no in range(top, bottom + 1)
+             if line_no not in self.tagged]))
+
+        excess = len(self.tagged) - self.line_budget
+        if excess > 0:
+            # 离视口最远的行最先丢弃标签
+            outside = [line_no for line_no in self.tagged if line_no < top or line_no > bottom]
+            outside.sort(key=lambda line_no: top - line_no if line_no < top else line_no - bottom)
+            evicted = outside[-excess:]
+            ops.extend(self._remove_ops(evicted))
+            self.tagged.difference_update(evicted)
+        return ops
+
+    def _shift_lines(self, line_numbers, first, old_end, shift, keep_first):
+        """按编辑位置调整一组行号，被编辑区域内的行只在 keep_first 时保留首行"""
+        shifted = set()
+        for line_no in line_numbers:
+            if line_no < first:
+                shifted.add(line_no)
+            elif line_no >= old_end:
+                shifted.add(line_no + shift)
+            elif keep_first:
+                shifted.add(first)
+        return shifted
+
+    def _take_dirty(self, changed):
+        """把已分析的脏行并入变化列表，返回按行号排序的结果"""
+        if not self.dirty:
+            return changed
+        lexed = len(self.tokens)
+        seen = {line_no for line_no, _ in changed}
+        for line_no in self.dirty:
+            if line_no < lexed and line_no not in seen:
+                changed.append((line_no, self.tokens[line_no]))
+        self.dirty = {line_no for line_no in self.dirty if lexed <= line_no < len(self.lines)}
+        changed.sort(key=lambda item: item[0])
+        return changed
+
+    def _forget(self, ops):
+        """记录没有执行的标签操作：涉及的行标签状态未知，下次分析时重新设置"""
+        for op in ops:
+            if op[0] == "apply":
+                lines = (op[1],)
+            else:
+                last = len(self.lines) - 1 if op[2] is None else op[2]
+                lines = range(op[1], last + 1)
+            self.dirty.update(lines)
+            if self.viewport_active:
+                self.tagged.update(lines)
+
+    def _shift_tokens(self, old_tokens, old_line, new_line):
+        """推断单行原地编辑后，Text组件中随文本移动的标签位置
+
+        标签跨越编辑位置时无法推断，返回 None。
+        """
+        prefix = 0
+        limit = min(len(old_line), len(new_line))
+        while prefix < limit and old_line[prefix] == new_line[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < limit - prefix and old_line[-1 - suffix] == new_line[-1 - suffix]:
+            suffix += 1
+        edit_end = len(old_line) - suffix
+        delta = len(new_line) - len(old_line)
+
+        # 紧贴编辑位置的标记也视为无法推断：插入的字符会继承两侧共有的标签
+        shifted = []
+        for tag, start, end in old_tokens:
+            if end < prefix:
+                shifted.append((tag, start, end))
+            elif start > edit_end:
+                shifted.append((tag, start + delta, end + delta))
+            else:
+                return None
+        return tuple(shifted)
+
+    def _apply_ops(self, changed):
+        """把发生变化的行转换为设置标签的操作"""
+        if self.viewport_active:
+            self.tagged.update(line_no for line_no, _ in changed)
+        return [("apply", line_no, line_tokens) for line_no, line_tokens in changed]
+
+    def _remove_ops(self, line_numbers):
+        """把若干行转换为移除标签的操作，连续的行合并成一段"""
+        return [("remove", first, last) for first, last in self._runs(line_numbers)]
+
+    def _execute(self, ops, pos=0, deadline=None):
+        """从pos开始按顺序执行标签操作，返回下一个未执行操作的位置
+
+        给出 deadline（time.perf_counter 时间）时，超时后提前返回。
+        """
+        count = len(ops)
+        while pos < count:
+            op = ops[pos]
+            if op[0] == "remove":
+                self._remove_tags(op[1], op[2])
+                pos += 1
+            else:
+                end = pos + 1
+                while end < count and end - pos < self.APPLY_BATCH and ops[end][0] == "apply":
+                    end += 1
+                self._apply([op[1:] for op in ops[pos:end]])
+                pos = end
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+        return pos
+
+    def _apply(self, changed):
+        """批量更新发生变化的行上的标签"""
+        if not changed:
+            return
+        text = self.text
+        self._remove_lines([line_no for line_no, _ in changed])
+
+        ranges = {}
+        for line_no, line_tokens in changed:
+            row = line_no + 1
+            for tag, start, end in line_tokens:
+                ranges.setdefault(tag, []).extend((f"{row}.{start}", f"{row}.{end}"))
+        for tag, indices in ranges.items():
+            text.tag_add(tag, *indices)
+
+    def _remove_lines(self, line_numbers):
+        """移除若干行上的标签，连续的行合并成一段处理"""
+        for first, last in self._runs(line_numbers):
+            self._remove_tags(first, last)
+
+    def _runs(self, line_numbers):
+        """把行号分组为连续的 (首行, 末行) 区间"""
+        runs = []
+        for line_no in sorted(line_numbers):
+            if runs and line_no == runs[-1][1] + 1:
+                runs[-1][1] = line_no
+            else:
+                runs.append([line_no, line_no])
+        return runs
+
+    def _remove_tags(self, first_line, last_line):
+        """移除指定行范围内的所有高亮标签，last_line 为 None 时直到文本末尾"""
+        start = f"{first_line + 1}.0"
+        end = "end" if last_line is None else f"{last_line + 1}.end"
+        for tag in backend.TAG_NAMES:
+            self.text.tag_remove(tag, start, end)
+
+
+class BackgroundHighlighter(IncrementalHighlighter):
+    """在后台线程中进行词法分析的增量高亮器
+
+    主线程只提交带版本号的文本快照，后台线程分析后给出标签操作列表，
+    主线程在 after_idle 回调中按时间预算分片执行。版本已过期的结果直接
+    丢弃，没有执行的操作涉及的行在下一次分析时重新设置标签。
+    后台线程同一时间只有一份结果在途，上一份结果执行完或丢弃后才开始
+    下一次分析，期间提交的快照只保留最新的一份。
+    """
+
+    SLICE_BUDGET = 0.008  # 每个分片占用主线程的最长时间（秒）
+    POLL_INTERVAL = 10    # 等待后台结果时的轮询间隔（毫秒）
+
+    def __init__(self, text_widget, processor=None, **options):
+        self.version = 0
+        self.results = queue.Queue()
+        self._lock = threading.Condition()
+        self._job = None          # 尚未开始分析的任务
+        self._settled = True      # 上一份结果是否已经执行完或丢弃
+        self._unapplied = []      # 上一份结果中没有执行的操作
+        self._inflight = False    # 是否还有任务或结果未处理完
+        self._closed = False
+        self._submitted = None    # 最近提交的 (版本, 文本)
+        self._poll_id = None
+        self._slice_id = None
+        self._applying = None     # 正在分片执行的 (版本, 操作列表, 位置)
+        super().__init__(text_widget, processor, **options)
+
+        if self.edit_bus is None:
+            # 按键在Text类绑定修改文本之前就让在途结果失效，避免把旧版本的标签加到新文本上
+            self.text.bind("<KeyPress>", lambda event: self.invalidate(), add="+")
+        self.worker = threading.Thread(target=self._work, daemon=True)
+        self.worker.start()
+
+    def refresh(self, text=None):
+        """提交当前文本快照，由后台线程分析"""
+        if text is None:
+            text = self.text.get("1.0", "end-1c")
+        if self._submitted is not None and self._submitted[0] == self.version and self._submitted[1] == text:
+            return
+        self.version += 1
+        self._submitted = (self.version, text)
+        hint, self._hint = self._hint, None
+        self._submit(text, self._window(), hint=hint)
+
+    def reset(self):
+        """移除所有高亮标签，并让后台线程清空缓存"""
+        if self._submitted is None and not self._inflight:
+            return
+        self.version += 1
+        self._submitted = None
+        self._hint = None
+        self._remove_tags(0, None)
+        self._submit(None, None, reset=True)
+
+    def invalidate(self):
+        """文本即将改变：之前提交的版本全部过期"""
+        self.version += 1
+
+    def _on_edit(self, start, end, text, version):
+        """编辑事件：文本已经改变，在途结果全部过期"""
+        self.invalidate()
+        super()._on_edit(start, end, text, version)
+
+    def close(self):
+        """停止后台线程，取消尚未执行的回调"""
+        with self._lock:
+            self._closed = True
+            self._lock.notify()
+        for after_id in (self._poll_id, self._slice_id):
+            if after_id is not None:
+                try:
+                    self.text.after_cancel(after_id)
+                except Exception:
+                    pass
+        self._poll_id = self._slice_id = None
+        if self.edit_bus is not None:
+            self.edit_bus.unsubscribe(self._on_edit)
+
+    def _sync_viewport(self):
+        """滚动后把新的可见区域交给后台线程"""
+        self._viewport_pending = False
+        if not self.viewport_active or self._submitted is None or self._submitted[0] != self.version:
+            # 文本已修改但还没有提交新快照，可见区域交给下一次 refresh 处理
+            return
+        window = self._window()
+        if window is not None:
+            self._submit(None, window)
+
+    def _submit(self, text, window, reset=False, hint=None):
+        """提交任务，尚未开始的旧任务被合并或替换"""
+        with self._lock:
+            job = self._job
+            if job is not None and text is None and not reset:
+                # 仅滚动：保留尚未分析的文本，只更新可见区域
+                job["window"] = window
+            else:
+                if job is not None and job["text"] is not None:
+                    # 旧文本还没有分析，修改范围要从更早的缓存文本算起
+                    hint = hint and job["hint"] and (min(hint[0], job["hint"][0]), min(hint[1], job["hint"][1]))
+                reset = reset or (job is not None and job["reset"])
+                self._job = {"version": self.version, "text": text, "window": window,
+                             "reset": reset, "hint": hint}
+            self._inflight = True
+            self._lock.notify()
+        self._schedule_poll()
+
+    def _work(self):
+        """后台线程：等待任务，分析文本并把标签操作交给主线程"""
+        while True:
+            with self._lock:
+                while not self._closed and (self._job is None or not self._settled):
+                    self._lock.wait()
+                if self._closed:
+                    return
+                job, self._job = self._job, None
+                unapplied, self._unapplied = self._unapplied, []
+                self._settled = False
+
+            try:
+                self._forget(unapplied)
+                if job["reset"]:
+                    self._clear()
+                if job["text"] is not None:
+                    ops = self.compute(job["text"], job["window"], job["hint"])
+                else:
+                    ops = self._viewport_ops(job["window"])
+            except Exception as e:
+                print(f"后台语法分析失败: {e}")
+                self._clear()
+                ops = [("remove", 0, None)]
+            self.results.put((job["version"], ops))
+
+    def _schedule_poll(self):
+        """安排主线程检查后台结果"""
+        if self._poll_id is None and not self._closed:
+            self._poll_id = self.text.after(self.POLL_INTERVAL, self._poll)
+
+    def _poll(self):
+        """主线程：取出后台结果，版本过期则丢弃，否则开始分片执行"""
+        self._poll_id = None
+        try:
+            version, ops = self.results.get_nowait()
+        except queue.Empty:
+            if self._inflight:
+                self._schedule_poll()
+            return
+        if version != self.version:
+            self._settle(ops, 0)
+            return
+        self._applying = (version, ops, 0)
+        self._apply_slice()
+
+    def _apply_slice(self):
+        """在空闲时按时间预算执行一片标签操作，版本过期时停止"""
+        self._slice_id = None
+        version, ops, pos = self._applying
+        if version == self.version:
+            pos = self._execute(ops, pos, time.perf_counter() + self.SLICE_BUDGET)
+            if pos < len(ops):
+                self._applying = (version, ops, pos)
+                self._slice_id = self.text.after_idle(self._apply_slice)
+                return
+        self._applying = None
+        self._settle(ops, pos)
+
+    def _settle(self, ops, pos):
+        """结束一份结果，把没有执行的操作交还后台线程"""
+        with self._lock:
+            self._unapplied = ops[pos:]
+            self._settled = True
+            self._inflight = self._job is not None
+            self._lock.notify()
+        if self._inflight:
+            self._schedule_poll()
@@ -0,0 +1,267 @@
+import re
+
+
+class TableLexer:
+    """表驱动的状态机词法分析器
+
+    rules 为 {状态: [(正则, 标签, 动作), ...]}，每个状态的全部规则编译成一个
+    组合正则，从当前位置向后查找最先匹配的规则。标签可以是字符串、None
+    （只移动位置），或按分组给出标签的元组。动作为 None（保持状态）、
+    状态名（压栈）、"#pop"（出栈）、"#root"（回到初始状态），或依次执行的
+    动作元组。defaults 给出状态中未被规则匹配的文本使用的标签，例如注释
+    状态下整行都是注释。
+
+    状态栈就是行末状态，接口与 backEndprocessing.lexLine 一致，可以直接
+    用于增量高亮器。
+    """
+
+    def __init__(self, name, rules, defaults=None, initial="root"):
+        self.name = name
+        self.defaults = defaults or {}
+        self.initial = (initial,)
+        self._tables = {}
+        for state, state_rules in rules.items():
+            parts = []
+            compiled = []
+            for i, (pattern, tag, action) in enumerate(state_rules):
+                parts.append(f"(?P<r{i}>{pattern})")
+                sub_pattern = re.compile(pattern) if isinstance(tag, tuple) else None
+                actions = action if isinstance(action, tuple) else (action,)
+                compiled.append((sub_pattern, tag, actions))
+            self._tables[state] = (re.compile("|".join(parts)), compiled)
+
+    def lexLine(self, line, state=None):
+        """对单行进行词法分析，返回 (标记元组, 本行行末状态)"""
+        stack = state or self.initial
+        tokens = []
+        pos = 0
+        end = len(line)
+        while True:
+            current = stack[-1]
+            pattern, rules = self._tables[current]
+            default = self.defaults.get(current)
+            match = pattern.search(line, pos)
+            if match is None:
+                if default and pos < end:
+                    tokens.append((default, pos, end))
+                break
+            start = match.start()
+            if default and start > pos:
+                tokens.append((default, pos, start))
+
+            sub_pattern, tag, actions = rules[int(match.lastgroup[1:])]
+            pos = match.end()
+            if sub_pattern is not None:
+                sub_match = sub_pattern.match(line, start)
+                for group, group_tag in enumerate(tag, 1):
+                    if group_tag and sub_match.end(group) > sub_match.start(group):
+                        tokens.append((group_tag, sub_match.start(group), sub_match.end(group)))
+            elif tag and pos > start:
+                tokens.append((tag, start, pos))
+
+            new_stack = self._transition(stack, actions)
+            if pos == start and new_stack == stack:
+                # 空匹配且状态不变时前进一个字符，避免死循环
+                if start >= end:
+                    break
+                if default:
+                    tokens.append((default, start, start + 1))
+                pos += 1
+            stack = new_stack
+        return tuple(tokens), (None if stack == self.initial else stack)
+
+    def tokenize(self, text):
+        """逐行分析整段文本，返回按位置排序的 (标签, 起始偏移, 结束偏移) 列表"""
+        tokens = []
+        state = None
+        offset = 0
+        for line in text.split("\n"):
+            line_tokens, state = self.lexLine(line, state)
+            tokens.extend((tag, offset + start, offset + end) for tag, start, end in line_tokens)
+            offset += len(line) + 1
+        return tokens
+
+    def _transition(self, stack, actions):
+        """按动作更新状态栈"""
+        for action in actions:
+            if action is None:
+                continue
+            if action == "#pop":
+                if len(stack) > 1:
+                    stack = stack[:-1]
+            elif action == "#root":
+                stack = self.initial
+            else:
+                stack = stack + (action,)
+        return stack
+
+
+def embed(rules, defaults, prefix, exit_rule):
+    """把一组规则嵌入到另一种语言中
+
+    状态名加上前缀，每个状态最前面加入退出规则（如 </script>），
+    返回 (规则, 默认标签)。
+    """
+    def rename(action):
+        if isinstance(action, tuple):
+            return tuple(rename(item) for item in action)
+        if action is None or action.startswith("#"):
+            return action
+        return prefix + action
+
+    embedded = {}
+    for state, state_rules in rules.items():
+        embedded[prefix + state] = [exit_rule] + [
+            (pattern, tag, rename(action)) for pattern, tag, action in state_rules]
+    return embedded, {prefix + state: tag for state, tag in defaults.items()}
+
+
+# JavaScript
+JS_KEYWORDS = [
+    "async", "await", "break", "case", "catch", "class", "const", "continue", "debugger",
+    "default", "delete", "do", "else", "export", "extends", "false", "finally", "for",
+    "from", "function", "get", "if", "import", "in", "instanceof", "let", "new", "null",
+    "of", "return", "set", "static", "super", "switch", "this", "throw", "true", "try",
+    "typeof", "undefined", "var", "void", "while", "with", "yield",
+]
+
+_JS_CODE = [
+    (r"//.*", "comment", None),
+    (r"/\*", "comment", "comment"),
+    (r"`", "string", "template"),
+    (r'"(?:[^"\\]|\\.)*"?', "string", None),
+    (r"'(?:[^'\\]|\\.)*'?", "string", None),
+    (r"\b(function)(\s*\*?\s*)([A-Za-z_$][\w$]*)", ("keyword", None, "function"), None),
+    (r"\b(class)(\s+)([A-Za-z_$][\w$]*)", ("keyword", None, "class_name"), None),
+    (r"\b(?:" + "|".join(JS_KEYWORDS) + r")\b(?![$])", "keyword", None),
+    (r"\b(?:0[xXbBoO][0-9a-fA-F_]+n?|\d[\d_]*(?:\.\d+)?(?:[eE][+-]?\d+)?n?)\b", "number", None),
+    (r"[A-Za-z_$][\w$]*(?=\s*\()", "function", None),
+    (r"[A-Za-z_$][\w$]*", None, None),
+]
+
+# 只在 ${...} 中记录花括号的嵌套，用来找到结束插值的 }；其他位置的花括号
+# 不进入行末状态，否则未配对的 { 会使后面每一行的状态都与缓存不同
+_JS_BRACE = (r"\{", None, "brace")
+
+JS_RULES = {
+    "root": _JS_CODE,
+    "brace": [(r"\}", None, "#pop"), _JS_BRACE] + _JS_CODE,
+    "comment": [(r"\*/", "comment", "#pop")],
+    "template": [
+        (r"\\.", "string", None),
+        (r"`", "string", "#pop"),
+        (r"\$\{", "keyword", "interpolation"),
+    ],
+    "interpolation": [(r"\}", "keyword", "#pop"), _JS_BRACE] + _JS_CODE,
+}
+JS_DEFAULTS = {"comment": "comment", "template": "string"}
+
+# CSS
+_CSS_STRING = r'"(?:[^"\\]|\\.)*"?|\'(?:[^\'\\]|\\.)*\'?'
+_CSS_NUMBER = r"(?<![\w-])-?(?:\d+\.?\d*|\.\d+)(?:%|[A-Za-z]+)?"
+
+CSS_RULES = {
+    "root": [
+        (r"/\*", "comment", "comment"),
+        (r"@[\w-]+", "keyword", None),
+        (r"\{", None, "block"),
+        (_CSS_STRING, "string", None),
+        (r":{1,2}[\w-]+", "function", None),
+        (_CSS_NUMBER, "number", None),
+        (r"[.#]?[A-Za-z_][\w-]*|\*", "class_name", None),
+    ],
+    "block": [
+        (r"/\*", "comment", "comment"),
+        (r"\}", None, "#pop"),
+        (r"[^\s{};][^{};]*?(?=\s*\{)", "class_name", None),
+        (r"\{", None, "block"),
+        (r"@[\w-]+", "keyword", None),
+        (r"--[\w-]+|[A-Za-z-][\w-]*(?=\s*:)", "function", None),
+        (r"!important\b", "keyword", None),
+        (r"#[0-9a-fA-F]{3,8}\b", "number", None),
+        (_CSS_NUMBER, "number", None),
+        (_CSS_STRING, "string", None),
+        (r"[A-Za-z-][\w-]*(?=\()", "keyword", None),
+        (r"[A-Za-z_-][\w-]*", None, None),
+    ],
+    "comment": [(r"\*/", "comment", "#pop")],
+}
+CSS_DEFAULTS = {"comment": "comment"}
+
+# HTML（<script>/<style> 中分别嵌入 JavaScript 和 CSS）
+_HTML_TAG = [
+    (r"/?>", "keyword", "#pop"),
+    (r'"', "string", "attr_double"),
+    (r"'", "string", "attr_single"),
+    (r"[^\s=/>\"']+", "function", None),
+]
+
+_SCRIPT_RULES, _SCRIPT_DEFAULTS = embed(JS_RULES, JS_DEFAULTS, "script:", (r"(?i:</script\s*>)", "keyword", "#root"))
+_STYLE_RULES, _STYLE_DEFAULTS = embed(CSS_RULES, CSS_DEFAULTS, "style:", (r"(?i:</style\s*>)", "keyword", "#root"))
+
+HTML_RULES = {
+    "root": [
+        (r"<!--", "comment", "comment"),
+        (r"(?i:<!DOCTYPE)[^>]*>?", "class_name", None),
+        (r"(?i:<script)(?![\w-])", "keyword", "script_tag"),
+        (r"(?i:<style)(?![\w-])", "keyword", "style_tag"),
+        (r"</?[A-Za-z][\w:-]*", "keyword", "tag"),
+        (r"&(?:#\d+|#[xX][0-9a-fA-F]+|\w+);", "number", None),
+    ],
+    "comment": [(r"-->", "comment", "#pop")],
+    "tag": _HTML_TAG,
+    "script_tag": [(r"/>", "keyword", "#pop"), (r">", "keyword", ("#pop", "script:root"))] + _HTML_TAG[1:],
+    "style_tag": [(r"/>", "keyword", "#pop"), (r">", "keyword", ("#pop", "style:root"))] + _HTML_TAG[1:],
+    "attr_double": [(r'"', "string", "#pop")],
+    "attr_single": [(r"'", "string", "#pop")],
+}
+HTML_RULES.update(_SCRIPT_RULES)
+HTML_RULES.update(_STYLE_RULES)
+HTML_DEFAULTS = {"comment": "comment", "attr_double": "string", "attr_single": "string"}
+HTML_DEFAULTS.update(_SCRIPT_DEFAULTS)
+HTML_DEFAULTS.update(_STYLE_DEFAULTS)
+
+# Markdown
+MARKDOWN_RULES = {
+    "root": [
+        (r"^ {0,3}```.*", "string", "fence_backtick"),
+        (r"^ {0,3}~~~.*", "string", "fence_tilde"),
+        (r"^ {0,3}#{1,6}(?=\s|$).*", "keyword", None),
+        (r"^ {0,3}>.*", "comment", None),
+        (r"^ {0,3}(?:(?:\* *){3,}|(?:- *){3,}|(?:_ *){3,})$", "operator", None),
+        (r"^\s*(?:[-*+]|\d+[.)])(?=\s)", "operator", None),
+        (r"<!--", "comment", "comment"),
+        (r"``(?:[^`]|`(?!`))+``|`[^`]+`", "string", None),
+        (r"!?\[[^\]]*\]\([^)]*\)", "function", None),
+        (r"^ {0,3}\[[^\]]+\]:\s*\S+", "function", None),
+        (r"\*\*[^*]+\*\*|__[^_]+__", "keyword", None),
+        (r"(?<![\w*])\*[^*\s][^*]*\*|(?<!\w)_[^_\s][^_]*_(?!\w)", "comment", None),
+        (r"</?[A-Za-z][^>]*>", "keyword", None),
+        (r"<?https?://[^\s>]+>?", "function", None),
+        (r"\w+", None, None),
+    ],
+    "fence_backtick": [(r"^ {0,3}```\s*$", "string", "#pop")],
+    "fence_tilde": [(r"^ {0,3}~~~\s*$", "string", "#pop")],
+    "comment": [(r"-->", "comment", "#pop")],
+}
+MARKDOWN_DEFAULTS = {"fence_backtick": "string", "fence_tilde": "string", "comment": "comment"}
+
+
+# 按文件类型注册的词法分析器
+LEXERS = {}
+
+
+def register_lexer(file_type, lexer):
+    """注册文件类型对应的词法分析器（需要提供 lexLine 方法）"""
+    LEXERS[file_type] = lexer
+
+
+def get_lexer(file_type):
+    """获取文件类型对应的词法分析器，没有注册时返回 None"""
+    return LEXERS.get(file_type)
+
+
+register_lexer("javascript", TableLexer("javascript", JS_RULES, JS_DEFAULTS))
+register_lexer("css", TableLexer("css", CSS_RULES, CSS_DEFAULTS))
+register_lexer("html", TableLexer("html", HTML_RULES, HTML_DEFAULTS))
+register_lexer("markdown", TableLexer("markdown", MARKDOWN_RULES, MARKDOWN_DEFAULTS))
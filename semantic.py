@@ -0,0 +1,467 @@
+import ast
+import builtins
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+# 语义高亮使用的标签，叠加在词法高亮的标签之上
+SEMANTIC_TAGS = ("parameter", "attribute", "builtin", "decorator", "call")
+
+BUILTIN_NAMES = frozenset(dir(builtins))
+
+_executor = None
+
+
+def get_executor():
+    """获取共享的语义分析进程池（只有一个工作进程）"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=1)
+    return _executor
+
+
+def shutdown_executor():
+    """关闭语义分析进程池"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def analyze(source):
+    """解析源代码，返回语义标记 [(标签, 行, 起始列, 结束列), ...]
+
+    在工作进程中调用，行从1开始，列为字符列。无法解析时返回 None。
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+    collector = SemanticCollector(source)
+    collector.visit(tree)
+    return collector.spans
+
+
+def _bound_names(nodes):
+    """收集一组语句中绑定的名字，不进入嵌套的函数和类"""
+    names = set()
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+            continue
+        if isinstance(node, (ast.Lambda, ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)):
+            continue
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            names.add(node.id)
+        elif isinstance(node, ast.alias):
+            names.add((node.asname or node.name).split(".")[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        stack.extend(ast.iter_child_nodes(node))
+    return names
+
+
+class SemanticCollector(ast.NodeVisitor):
+    """遍历语法树，收集参数、属性、内置名字、装饰器和调用位置"""
+
+    def __init__(self, source):
+        self.lines = source.split("\n")
+        self.spans = []
+        self.scopes = []  # [(参数集合, 局部名字集合, 是否类体), ...]，最内层在最后
+        self.module_names = set()
+
+    def add(self, tag, line, start, end):
+        """记录一个标记，把 ast 的 UTF-8 字节列转换为字符列"""
+        text = self.lines[line - 1] if 0 < line <= len(self.lines) else ""
+        if not text.isascii():
+            encoded = text.encode("utf-8")
+            start = len(encoded[:start].decode("utf-8", "ignore"))
+            end = len(encoded[:end].decode("utf-8", "ignore"))
+        if end > start:
+            self.spans.append((tag, line, start, end))
+
+    def resolve(self, name):
+        """判断名字在当前作用域中是参数、内置名字还是其他"""
+        for depth, (params, local_names, is_class) in enumerate(reversed(self.scopes)):
+            if is_class and depth:
+                # 类体中的名字对其中的函数不可见
+                continue
+            if name in params:
+                return "parameter"
+            if name in local_names:
+                return None
+        if name in self.module_names or name not in BUILTIN_NAMES:
+            return None
+        return "builtin"
+
+    def visit_Module(self, node):
+        self.module_names = _bound_names(node.body)
+        self.generic_visit(node)
+
+    def visit_FunctionDef(self, node):
+        for decorator in node.decorator_list:
+            self.visit_decorator(decorator)
+        self.visit_arguments_defaults(node.args)
+        if node.returns:
+            self.visit(node.returns)
+        params = self.visit_parameters(node.args)
+        self.scopes.append((params, _bound_names(node.body) - params, False))
+        for statement in node.body:
+            self.visit(statement)
+        self.scopes.pop()
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        self.visit_arguments_defaults(node.args)
+        params = self.visit_parameters(node.args)
+        self.scopes.append((params, set(), False))
+        self.visit(node.body)
+        self.scopes.pop()
+
+    def visit_ClassDef(self, node):
+        for decorator in node.decorator_list:
+            self.visit_decorator(decorator)
+        for base in node.bases:
+            self.visit(base)
+        for keyword in node.keywords:
+            self.visit(keyword)
+        self.scopes.append((set(), _bound_names(node.body), True))
+        for statement in node.body:
+            self.visit(statement)
+        self.scopes.pop()
+
+    def visit_ListComp(self, node):
+        self.scopes.append((set(), _bound_names(generator.target for generator in node.generators), False))
+        self.generic_visit(node)
+        self.scopes.pop()
+
+    visit_SetComp = visit_DictComp = visit_GeneratorExp = visit_ListComp
+
+    def visit_parameters(self, args):
+        """给参数定义加标签，返回参数名集合"""
+        params = set()
+        for arg in args.posonlyargs + args.args + args.kwonlyargs + [args.vararg, args.kwarg]:
+            if arg is None:
+                continue
+            params.add(arg.arg)
+            self.add("parameter", arg.lineno, arg.col_offset, arg.col_offset + len(arg.arg.encode("utf-8")))
+            if arg.annotation:
+                self.visit(arg.annotation)
+        return params
+
+    def visit_arguments_defaults(self, args):
+        """默认值在外层作用域中求值"""
+        for default in args.defaults + [d for d in args.kw_defaults if d is not None]:
+            self.visit(default)
+
+    def visit_decorator(self, node):
+        """装饰器名字（连同 @）加标签，调用参数照常处理"""
+        target = node.func if isinstance(node, ast.Call) else node
+        if isinstance(target, (ast.Name, ast.Attribute)):
+            self.add("decorator", target.lineno, max(0, target.col_offset - 1), target.end_col_offset)
+            if isinstance(node, ast.Call):
+                for arg in node.args:
+                    self.visit(arg)
+                for keyword in node.keywords:
+                    self.visit(keyword)
+        else:
+            self.visit(node)
+
+    def visit_Call(self, node):
+        func = node.func
+        if isinstance(func, ast.Name):
+            tag = self.resolve(func.id)
+            self.add(tag if tag == "builtin" else "call", func.lineno, func.col_offset, func.end_col_offset)
+        elif isinstance(func, ast.Attribute):
+            self.visit(func.value)
+            self.add_attribute("call", func)
+        else:
+            self.visit(func)
+        for arg in node.args:
+            self.visit(arg)
+        for keyword in node.keywords:
+            self.visit(keyword)
+
+    def visit_Attribute(self, node):
+        self.visit(node.value)
+        self.add_attribute("attribute", node)
+
+    def add_attribute(self, tag, node):
+        """属性名位于 Attribute 节点的末尾"""
+        end = node.end_col_offset
+        self.add(tag, node.end_lineno, end - len(node.attr.encode("utf-8")), end)
+
+    def visit_Name(self, node):
+        tag = self.resolve(node.id)
+        if tag:
+            self.add(tag, node.lineno, node.col_offset, node.end_col_offset)
+
+
+def _runs(lines):
+    """把按顺序排列的行号分组为连续的 (首行, 末行) 区间"""
+    runs = []
+    for line in lines:
+        if runs and line == runs[-1][1] + 1:
+            runs[-1][1] = line
+        else:
+            runs.append([line, line])
+    return runs
+
+
+class SemanticHighlighter:
+    """语义高亮
+
+    停止输入一段时间后，把缓冲区快照交给工作进程用 ast 解析，得到参数、
+    属性、内置名字、装饰器和调用位置等标记，叠加在词法高亮之上。分析
+    结果按文本内容缓存；代码无法解析时保留上一次成功解析得到的标签
+    （标签随文本移动）。结果在主线程中按行分片应用，过期版本直接丢弃。
+
+    记录每行当前带有的语义标记，编辑时按修改位置调整行号，只重新设置
+    标记改变或被编辑过的行。词法高亮器处于视口模式时，语义标签也只加在
+    它的可见区域，滚动时再补上。
+    """
+
+    DELAY = 400           # 停止输入后开始分析的延迟（毫秒）
+    POLL_INTERVAL = 30    # 等待工作进程结果的轮询间隔（毫秒）
+    SLICE_BUDGET = 0.008  # 每个分片占用主线程的最长时间（秒）
+    SLICE_LINES = 200     # 每次处理的行数
+    CACHE_SIZE = 8        # 缓存的分析结果数量
+
+    def __init__(self, text_widget, edit_bus=None):
+        self.text = text_widget
+        self.version = 0
+        self.cache = OrderedDict()  # 文本 -> 语义标记
+        self._source = None
+        self._future = None
+        self._timer_id = None
+        self._poll_id = None
+        self._slice_id = None
+        self.applied = {}    # 行号 -> 该行当前带有的语义标记
+        self.stale = set()   # 被编辑过、语义标签状态未知的行
+        self.result = None   # 最近应用的分析结果：行号 -> 语义标记
+        self.result_version = None
+        self.lexical = None  # 同一编辑框的词法高亮器
+        self._scroll_pending = False
+        for tag in SEMANTIC_TAGS:
+            self.text.tag_configure(tag)
+            self.text.tag_raise(tag)
+        self.edit_bus = edit_bus
+        if edit_bus is not None:
+            edit_bus.subscribe(self._on_edit)
+
+    def update(self, text, lexical=None):
+        """文本改变后调用，延迟一段时间再分析
+
+        lexical 为同一编辑框的词法高亮器，它处于视口模式时语义标签也只加在可见区域。
+        """
+        self.set_lexical(lexical)
+        if text == self._source:
+            return
+        self.version += 1
+        self._source = text
+        if self._timer_id is not None:
+            self.text.after_cancel(self._timer_id)
+        self._timer_id = self.text.after(self.DELAY, self._start, self.version, text)
+
+    def invalidate(self):
+        """文本已经改变：尚未应用的结果全部过期"""
+        self.version += 1
+        self._source = None
+
+    def set_lexical(self, lexical):
+        """设置同一编辑框的词法高亮器，在视口模式下跟随它的滚动"""
+        if lexical is self.lexical:
+            return
+        if self.lexical is not None and self._on_scroll in self.lexical.scroll_listeners:
+            self.lexical.scroll_listeners.remove(self._on_scroll)
+        self.lexical = lexical
+        if lexical is not None:
+            lexical.scroll_listeners.append(self._on_scroll)
+
+    def _on_edit(self, start, end, text, version):
+        """编辑事件：让旧结果失效，并按修改位置调整已加标签的行号
+
+        被编辑的行上的标签可能已经错位，记为状态未知，下次应用时重新设置。
+        """
+        self.invalidate()
+        first = int(start.split(".")[0])
+        last = int(end.split(".")[0])
+        inserted = text.count("\n")
+        shift = inserted - (last - first)
+        applied = {}
+        for line, spans in self.applied.items():
+            if line < first:
+                applied[line] = spans
+            elif line > last:
+                applied[line + shift] = spans
+        self.applied = applied
+        self.stale = {line if line < first else line + shift
+                      for line in self.stale if line < first or line > last}
+        self.stale.update(range(first, first + inserted + 1))
+
+    def clear(self):
+        """移除所有语义标签"""
+        self.version += 1
+        self._source = None
+        self.applied = {}
+        self.stale = set()
+        self.result = None
+        for tag in SEMANTIC_TAGS:
+            self.text.tag_remove(tag, "1.0", "end")
+
+    def close(self):
+        """取消尚未执行的回调"""
+        self.version += 1
+        for after_id in (self._timer_id, self._poll_id, self._slice_id):
+            if after_id is not None:
+                try:
+                    self.text.after_cancel(after_id)
+                except Exception:
+                    pass
+        self._timer_id = self._poll_id = self._slice_id = None
+        if self.edit_bus is not None:
+            self.edit_bus.unsubscribe(self._on_edit)
+        self.set_lexical(None)
+
+    def _start(self, version, text):
+        """把快照交给工作进程，命中缓存时直接应用"""
+        self._timer_id = None
+        if version != self.version:
+            return
+        if text in self.cache:
+            self.cache.move_to_end(text)
+            self._finish(version, text, self.cache[text])
+            return
+        if self._future is not None and not self._future.done():
+            # 上一次分析还没结束，结束后再分析最新的版本
+            self._poll_id = self._poll_id or self.text.after(self.POLL_INTERVAL, self._poll)
+            return
+        try:
+            self._future = get_executor().submit(analyze, text)
+        except Exception as e:
+            print(f"语义分析失败: {e}")
+            return
+        self._future.request = (version, text)
+        self._poll_id = self._poll_id or self.text.after(self.POLL_INTERVAL, self._poll)
+
+    def _poll(self):
+        """主线程：等待工作进程的结果"""
+        self._poll_id = None
+        future = self._future
+        if future is None:
+            return
+        if not future.done():
+            self._poll_id = self.text.after(self.POLL_INTERVAL, self._poll)
+            return
+        self._future = None
+        version, text = future.request
+        try:
+            spans = future.result()
+        except Exception as e:
+            print(f"语义分析失败: {e}")
+            return
+        self.cache[text] = spans
+        if len(self.cache) > self.CACHE_SIZE:
+            self.cache.popitem(last=False)
+        if version == self.version:
+            self._finish(version, text, spans)
+        elif self._timer_id is None and self._source is not None:
+            # 分析期间文本又改变了，延迟已过，立即分析最新版本
+            self._start(self.version, self._source)
+
+    def _finish(self, version, text, spans):
+        """应用分析结果；无法解析时保留上一次成功解析得到的标签"""
+        if spans is None:
+            return
+        by_line = {}
+        for tag, line, start, end in spans:
+            by_line.setdefault(line, []).append((tag, start, end))
+        by_line = {line: tuple(line_spans) for line, line_spans in by_line.items()}
+        # 超出文本末尾的行已经不存在
+        line_count = text.count("\n") + 1
+        self.applied = {line: line_spans for line, line_spans in self.applied.items() if line <= line_count}
+        self.stale = {line for line in self.stale if line <= line_count}
+        self.result = by_line
+        self.result_version = version
+        self._schedule(version)
+
+    def _on_scroll(self):
+        """词法高亮器在视口模式下滚动：文本没有改变时给新的可见区域补上语义标签"""
+        if self._scroll_pending or self.result is None or self.result_version != self.version:
+            return
+        self._scroll_pending = True
+        self.text.after_idle(self._sync_viewport)
+
+    def _sync_viewport(self):
+        self._scroll_pending = False
+        if self.result is not None and self.result_version == self.version:
+            self._schedule(self.version)
+
+    def _schedule(self, version):
+        """找出需要更新的行，开始分片应用"""
+        if self._slice_id is not None:
+            self.text.after_cancel(self._slice_id)
+            self._slice_id = None
+        self._apply_slice(version, self._changed_lines(self.result), 0)
+
+    def _window(self):
+        """词法高亮器处于视口模式时返回它的可见区域（行号从1开始），否则返回 None"""
+        lexical = self.lexical
+        if lexical is None or lexical.text is not self.text:
+            return None
+        window = lexical.viewport_window()
+        if window is None:
+            return None
+        return window[0] + 1, window[1] + 1
+
+    def _changed_lines(self, by_line):
+        """返回需要重新设置语义标签的 [(行号, 语义标记), ...]，按行号排序
+
+        视口模式下可见区域之外的行不带语义标签。
+        """
+        window = self._window()
+        if window is None:
+            candidates = self.stale.union(self.applied, by_line)
+        else:
+            candidates = self.stale.union(self.applied, range(window[0], window[1] + 1))
+        changed = []
+        for line in sorted(candidates):
+            if window is None or window[0] <= line <= window[1]:
+                line_spans = by_line.get(line, ())
+            else:
+                line_spans = ()
+            if line in self.stale or self.applied.get(line, ()) != line_spans:
+                changed.append((line, line_spans))
+        return changed
+
+    def _apply_slice(self, version, changed, pos):
+        """分片替换 changed 中各行的语义标签，每行的旧标签和新标签同时更新"""
+        self._slice_id = None
+        if version != self.version:
+            return
+        deadline = time.perf_counter() + self.SLICE_BUDGET
+        while pos < len(changed):
+            chunk = changed[pos:pos + self.SLICE_LINES]
+            ranges = {}
+            for line, line_spans in chunk:
+                for tag, start, end in line_spans:
+                    ranges.setdefault(tag, []).extend((f"{line}.{start}", f"{line}.{end}"))
+            for first, last in _runs(line for line, _ in chunk):
+                for tag in SEMANTIC_TAGS:
+                    self.text.tag_remove(tag, f"{first}.0", f"{last}.end")
+            for tag, indices in ranges.items():
+                self.text.tag_add(tag, *indices)
+            for line, line_spans in chunk:
+                self.stale.discard(line)
+                if line_spans:
+                    self.applied[line] = line_spans
+                else:
+                    self.applied.pop(line, None)
+            pos += len(chunk)
+            if time.perf_counter() >= deadline:
+                break
+        if pos < len(changed):
+            self._slice_id = self.text.after_idle(self._apply_slice, version, changed, pos)